@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from agents.cache.file_budget import FileBudget
+
+DATAFRAME_PREFIX = "df-"
+FIGURE_PREFIX = "fig-"
+
+
+class ArtifactStore:
+    """Local content-addressed store of query results and figures, referenced in messages by a short handle.
+
+    DataFrames are stored as uncompressed Arrow IPC (Feather v2) files so they can be read back memory-mapped,
+    figures as compact JSON. The handle is derived from the content, storing the same result twice is free. The
+    least recently used artifacts are removed once the store exceeds `max_bytes`, and those unused for
+    `ttl_seconds`, their handles are then reported as not found.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1024 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.budget = FileBudget(root, (".arrow", ".json"), max_bytes, ttl_seconds)
+
+    def path(self, handle: str) -> str:
+        if handle.startswith(DATAFRAME_PREFIX):
+            return os.path.join(self.root, f"{handle}.arrow")
+        if handle.startswith(FIGURE_PREFIX):
+            return os.path.join(self.root, f"{handle}.json")
+        raise ValueError(f"Unknown artifact handle: {handle}")
+
+    def _write(self, handle: str, data: bytes) -> str:
+        path = self.path(handle)
+        if not os.path.exists(path):
+            # write to a temporary file first, a concurrent reader never sees a partial artifact
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.budget.added(len(data))
+        else:
+            self.budget.touch(path)
+        return handle
+
+    def put_dataframe(self, df: pd.DataFrame) -> str:
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # object columns mixing types, e.g. numbers and text, are stored as text
+            objects = df.select_dtypes(include="object").columns
+            table = pa.Table.from_pandas(df.astype({col: str for col in objects}))
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        data = sink.getvalue().to_pybytes()
+        return self._write(DATAFRAME_PREFIX + hashlib.sha256(data).hexdigest()[:16], data)
+
+    def put_figure(self, figure_json: str) -> str:
+        """Store a figure serialized as JSON, e.g. by plotly's `fig.to_json()`"""
+        data = figure_json.encode()
+        return self._write(FIGURE_PREFIX + hashlib.sha256(data).hexdigest()[:16], data)
+
+    def load_dataframe(self, handle: str) -> pd.DataFrame:
+        path = self.path(handle)
+        df = feather.read_table(path, memory_map=True).to_pandas()
+        self.budget.touch(path)
+        return df
+
+    def load_figure(self, handle: str) -> dict:
+        path = self.path(handle)
+        with open(path, "rb") as f:
+            figure = json.load(f)
+        self.budget.touch(path)
+        return figure
+
+    def load(self, handle: str):
+        """DataFrame or figure dict behind the handle"""
+        if handle.startswith(DATAFRAME_PREFIX):
+            return self.load_dataframe(handle)
+        return self.load_figure(handle)
+
+
+def preview_dataframe(df: pd.DataFrame, rows: int = None) -> str:
+    """Shape, column types and first rows of the frame, what a model needs to reason about a result"""
+    rows = rows if rows is not None else int(os.getenv("ARTIFACT_PREVIEW_ROWS", "10"))
+    columns = ", ".join(f"{col} ({dtype})" for col, dtype in df.dtypes.items())
+    preview = f"{len(df)} rows x {len(df.columns)} columns: {columns}\n{df.head(rows).to_string()}"
+    if len(df) > rows:
+        preview += f"\n... {len(df) - rows} more rows"
+    return preview
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Artifact store shared by the agents and the python workers"""
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore(
+                os.getenv("ARTIFACT_DIR", "cache/artifacts"),
+                max_bytes=int(os.getenv("ARTIFACT_MAX_MB", "1024")) * 1024 * 1024,
+                ttl_seconds=float(os.getenv("ARTIFACT_TTL_HOURS", "168")) * 3600,
+            )
+    return _artifact_store
@@ -0,0 +1,360 @@
+import ast
+import builtins
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from langchain_experimental.utilities import PythonREPL
+
+from agents.cache.result_cache import database_version
+from agents.db import get_database_name
+from agents.repl_pool import ReplPool, get_repl_pool
+from agents.tracing import span
+
+# names every worker namespace starts with
+_PRESET_NAMES = {"db", "models", "load_artifact", "__name__"}
+
+
+def parse_code(code: str) -> Optional[ast.Module]:
+    try:
+        return ast.parse(PythonREPL.sanitize_input(code))
+    except SyntaxError:
+        return None
+
+
+def normalize_code(tree: ast.Module) -> str:
+    """Source of the code without comments and formatting, the same program always gives the same text"""
+    return ast.unparse(tree)
+
+
+def defined_names(tree: ast.Module) -> set[str]:
+    """Names the code binds, anywhere in it"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+_SCOPES = (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp, ast.Lambda)
+
+
+def _expression_names(node: ast.AST, local: frozenset = frozenset()) -> tuple[set[str], set[str]]:
+    """Names the node reads and binds, without the variables local to its comprehensions and lambdas"""
+    loads, stores = set(), set()
+    if isinstance(node, ast.Name):
+        if node.id not in local:
+            (loads if isinstance(node.ctx, ast.Load) else stores).add(node.id)
+        return loads, stores
+    if isinstance(node, ast.Lambda):
+        local = local | {arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)}
+    elif isinstance(node, _SCOPES):
+        local = local | {name.id for generator in node.generators for name in ast.walk(generator.target)
+                         if isinstance(name, ast.Name)}
+    for child in ast.iter_child_nodes(node):
+        child_loads, child_stores = _expression_names(child, local)
+        loads |= child_loads
+        stores |= child_stores
+    return loads, stores
+
+
+def _scan(body: list[ast.stmt], bound: set[str], free: set[str], deferred: set[str]) -> set[str]:
+    """Add to `free` the names the statements read before binding them, return the names bound after them.
+
+    Names bound in only some branches of an if or try, or in the body of a loop, do not count as bound after it.
+    Function and class bodies run later, what they read goes to `deferred`.
+    """
+    bound = set(bound)
+
+    def read(*nodes):
+        for node in nodes:
+            if node is not None:
+                free.update(_expression_names(node)[0] - bound)
+
+    for stmt in body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            header = stmt.decorator_list + (stmt.bases + [k.value for k in stmt.keywords]
+                                            if isinstance(stmt, ast.ClassDef) else [stmt.args])
+            read(*header)
+            deferred.update(_expression_names(stmt)[0] - defined_names(stmt))
+            bound.add(stmt.name)
+        elif isinstance(stmt, (ast.For, ast.AsyncFor)):
+            read(stmt.iter)
+            _scan(stmt.body + stmt.orelse, bound | _expression_names(stmt.target)[1], free, deferred)
+        elif isinstance(stmt, ast.While):
+            read(stmt.test)
+            _scan(stmt.body + stmt.orelse, bound, free, deferred)
+        elif isinstance(stmt, ast.If):
+            read(stmt.test)
+            bound = _scan(stmt.body, bound, free, deferred) & _scan(stmt.orelse, bound, free, deferred)
+        elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+            for item in stmt.items:
+                read(item.context_expr)
+                if item.optional_vars is not None:
+                    bound |= _expression_names(item.optional_vars)[1]
+            bound = _scan(stmt.body, bound, free, deferred)
+        elif isinstance(stmt, (ast.Try, ast.TryStar)):
+            after = _scan(stmt.body + stmt.orelse, bound, free, deferred)
+            for handler in stmt.handlers:
+                read(handler.type)
+                after &= _scan(handler.body, bound | ({handler.name} if handler.name else set()), free, deferred)
+            bound = _scan(stmt.finalbody, after, free, deferred)
+        elif isinstance(stmt, ast.AugAssign):
+            # `total += 1` reads total
+            loads, stores = _expression_names(stmt)
+            free.update((loads | stores) - bound)
+            bound |= stores
+        elif isinstance(stmt, ast.Delete):
+            loads, stores = _expression_names(stmt)
+            free.update((loads | stores) - bound)
+            bound -= stores
+        elif isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            bound |= defined_names(stmt)
+        elif not isinstance(stmt, (ast.Global, ast.Nonlocal)):
+            # the value is evaluated before the targets are bound: `df = df.dropna()` reads df
+            loads, stores = _expression_names(stmt)
+            free.update(loads - bound)
+            bound |= stores
+    return bound
+
+
+def free_names(tree: ast.Module) -> set[str]:
+    """Names the code reads before binding them, i.e. what it takes from earlier runs in the namespace"""
+    free, deferred = set(), set()
+    bound = _scan(tree.body, set(), free, deferred)
+    return (free | (deferred - bound)) - set(dir(builtins)) - _PRESET_NAMES
+
+
+# modules and attributes whose values differ from run to run: the clock and random numbers
+_VOLATILE_MODULES = {"time", "random", "uuid", "secrets"}
+_VOLATILE_ATTRIBUTES = {"now", "today", "utcnow", "random", "urandom"}
+
+
+def is_volatile(tree: ast.Module) -> bool:
+    """Whether the code reads the clock or random numbers, e.g. datetime.now() or np.random, and its output may
+    differ between two runs on the same data"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split(".")[0] in _VOLATILE_MODULES or alias.name.endswith(".random")
+                   for alias in node.names):
+                return True
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            if module.split(".")[0] in _VOLATILE_MODULES or module.endswith(".random"):
+                return True
+            if any(alias.name in _VOLATILE_ATTRIBUTES for alias in node.names):
+                return True
+        elif isinstance(node, ast.Attribute) and node.attr in _VOLATILE_ATTRIBUTES:
+            return True
+        elif isinstance(node, ast.Name) and node.id in _VOLATILE_MODULES:
+            return True
+    return False
+
+
+def _snapshot(directory: str) -> dict[str, tuple[int, int]]:
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class ExecutionCache:
+    """Persistent memo of generated code: the output of executed code and the code generated for a question.
+
+    Entries are stored per kind and tagged with the version they depend on, the data version for executions and
+    the schema and training data for generated code. Storing an entry removes the entries of older versions of
+    its kind, and the least recently used entries over the limit.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 1000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS execution_cache "
+            "(key TEXT PRIMARY KEY, kind TEXT, version TEXT, value TEXT, created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_execution_cache_accessed_at ON execution_cache (accessed_at)"
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, text: str, version: str) -> str:
+        return hashlib.sha256(f"{kind}\n{version}\n{text}".encode()).hexdigest()
+
+    def get(self, kind: str, text: str, version: str) -> Optional[dict]:
+        key = self._key(kind, text, version)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM execution_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE execution_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, kind: str, text: str, version: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO execution_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(kind, text, version), kind, version, json.dumps(value), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM execution_cache WHERE (kind = ? AND version != ?) OR created_at < ?",
+                (kind, version, now - self.ttl_seconds),
+            )
+            self._conn.execute(
+                "DELETE FROM execution_cache WHERE key IN (SELECT key FROM execution_cache "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, kind: str, text: str, version: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM execution_cache WHERE key = ?", (self._key(kind, text, version),))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM execution_cache")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT count(*) FROM execution_cache").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+class MemoizedRepl:
+    """Runs code on the worker pool, serving self-contained code from the cache at the same data version.
+
+    Only code that reads nothing from earlier runs, the clock or random numbers is memoized, its output only
+    depends on the data. A memoized run does not define its variables in the namespace, so when later code of the
+    conversation reads one of them the skipped runs are replayed first. Files the code writes to `output_dir` are
+    recorded with the output, an entry whose files were removed or changed since is run again.
+    """
+
+    def __init__(self, pool: ReplPool, cache: ExecutionCache, db_name: str, output_dir: str):
+        self.pool = pool
+        self.cache = cache
+        self.db_name = db_name
+        self.output_dir = output_dir
+        self._skipped: dict[str, list[tuple[str, set[str]]]] = {}
+        self._lock = threading.Lock()
+
+    def _files_intact(self, files: dict) -> bool:
+        for path, (mtime_ns, size) in files.items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+                return False
+        return True
+
+    def _replay(self, namespace_id: str, names: set[str]):
+        """Run the skipped code of the namespace, in order, if the code about to run uses any of its variables"""
+        with self._lock:
+            skipped = self._skipped.get(namespace_id, [])
+            if not any(defines & names for _, defines in skipped):
+                return
+            self._skipped[namespace_id] = []
+        with span("repl.replay", namespace=namespace_id, runs=len(skipped)):
+            for code, _ in skipped:
+                self.pool.execute(code, namespace_id)
+
+    def run(self, code: str, namespace_id: str = "default") -> str:
+        return self.execute(code, namespace_id)[0]
+
+    def execute(self, code: str, namespace_id: str = "default") -> tuple[str, bool]:
+        """Like run, also return whether the code ran to completion, as ReplPool.execute"""
+        tree = parse_code(code)
+        if tree is None:
+            # the worker reports the syntax error
+            return self.pool.execute(code, namespace_id)
+        needed, defines = free_names(tree), defined_names(tree)
+        if needed or is_volatile(tree):
+            self._replay(namespace_id, needed | defines)
+            return self.pool.execute(code, namespace_id)
+
+        normalized, version = normalize_code(tree), database_version(self.db_name)
+        with span("repl.memo") as s:
+            entry = self.cache.get("execution", normalized, version)
+            hit = entry is not None and self._files_intact(entry["files"])
+            s.set(hit=hit)
+        if hit:
+            with self._lock:
+                self._skipped.setdefault(namespace_id, []).append((code, defines))
+            return entry["output"], True
+
+        # the variables it rebinds must end up with its values, not those of earlier skipped runs
+        self._replay(namespace_id, defines)
+        before = _snapshot(self.output_dir)
+        output, ok = self.pool.execute(code, namespace_id)
+        if ok:
+            files = {path: stat for path, stat in _snapshot(self.output_dir).items() if before.get(path) != stat}
+            self.cache.put("execution", normalized, version, {"output": output, "files": files})
+        return output, ok
+
+
+_execution_cache = None
+_execution_cache_lock = threading.Lock()
+
+
+def get_execution_cache() -> ExecutionCache:
+    global _execution_cache
+    with _execution_cache_lock:
+        if _execution_cache is None:
+            _execution_cache = ExecutionCache(
+                os.getenv("EXECUTION_CACHE_PATH", "cache/execution_cache.db"),
+                ttl_seconds=float(os.getenv("EXECUTION_CACHE_TTL_HOURS", "168")) * 3600,
+                max_entries=int(os.getenv("EXECUTION_CACHE_MAX_ENTRIES", "1000")),
+            )
+    return _execution_cache
+
+
+_memoized_repl = None
+_memoized_repl_lock = threading.Lock()
+
+
+def get_memoized_repl() -> MemoizedRepl:
+    """The process wide worker pool behind the execution cache"""
+    global _memoized_repl
+    with _memoized_repl_lock:
+        if _memoized_repl is None:
+            _memoized_repl = MemoizedRepl(
+                get_repl_pool(), get_execution_cache(), get_database_name(), os.getenv("OUTPUT_DIRECTORY", ".")
+            )
+    return _memoized_repl
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+from typing import Sequence
+
+
+class FileBudget:
+    """Size and age limit of a directory of cache files, shared by every process using the directory.
+
+    A file's mtime is its last use: `touch` marks a file as used, and once the files are over `max_bytes` the
+    least recently used ones are removed, along with those unused for `ttl_seconds`. The size is tracked from the
+    writes of this process and corrected by the scan of each eviction.
+    """
+
+    def __init__(self, directory: str, suffixes: Sequence[str], max_bytes: int, ttl_seconds: float = None):
+        self.directory = directory
+        self.suffixes = tuple(suffixes)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _files(self) -> list[tuple[float, int, str]]:
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # temporary files of writes in progress end in other suffixes
+                if not entry.name.endswith(self.suffixes):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def touch(self, path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def added(self, size: int):
+        """Account for a file written to the directory, evicting when the files are over the limit"""
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            if self._bytes is None or self._bytes > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        expired_before = time.time() - self.ttl_seconds if self.ttl_seconds else None
+        for mtime, size, path in files:
+            if total <= self.max_bytes and (expired_before is None or mtime >= expired_before):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
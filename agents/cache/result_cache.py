@@ -0,0 +1,119 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import pandas as pd
+
+_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_WHITESPACE = re.compile(r"\s+")
+_READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Strip comments, collapse whitespace and lowercase everything outside of quoted literals"""
+    parts = _LITERAL.split(sql)
+    for i in range(0, len(parts), 2):
+        part = _BLOCK_COMMENT.sub(" ", _LINE_COMMENT.sub(" ", parts[i]))
+        parts[i] = _WHITESPACE.sub(" ", part).lower()
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def database_version(db_name: str) -> str:
+    """Version stamp of a SQLite database from the mtime and size of the database file and its WAL.
+
+    Any committed write touches one of the two files, so a changed stamp means the cached results are stale.
+    """
+    stamp = []
+    for path in (db_name, f"{db_name}-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamp.append("-")
+            continue
+        # an empty WAL, e.g. created by the first reader opening the database, holds no changes
+        stamp.append(f"{stat.st_mtime_ns}:{stat.st_size}" if stat.st_size or path == db_name else "-")
+    return "/".join(stamp)
+
+
+class ResultCache:
+    """LRU cache of sql results evicting by the total memory of the cached DataFrames"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_cacheable(sql: str) -> bool:
+        return bool(_READ_ONLY.match(_BLOCK_COMMENT.sub(" ", _LINE_COMMENT.sub(" ", sql))))
+
+    def get_or_run(self, sql: str, version: str, run_sql: Callable[[str], pd.DataFrame]) -> pd.DataFrame:
+        """Return a copy of the cached result of the sql at the given database version, run it on a miss"""
+        if not self.is_cacheable(sql):
+            return run_sql(sql)
+
+        key = (canonicalize_sql(sql), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # callers are free to mutate the frame they get back
+                return entry[0].copy()
+            self.misses += 1
+
+        df = run_sql(sql)
+        self.put(key, df)
+        return df.copy()
+
+    def put(self, key: tuple, df: pd.DataFrame):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            # results of older database versions can never be served again
+            for stale_key in [k for k in self._entries if k[0] == key[0] and k[1] != key[1]]:
+                self.current_bytes -= self._entries.pop(stale_key)[1]
+            self._entries[key] = (df, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Process wide result cache shared by every vanna instance"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(max_bytes=int(os.getenv("SQL_RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024)
+    return _result_cache
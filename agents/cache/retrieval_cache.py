@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+
+
+class _LRU:
+    """Thread-safe LRU map where concurrent misses on the same key compute the value only once"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute: Callable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[key] = Future()
+                owner = True
+            else:
+                # the same lookup is already running in another thread, e.g. a tool called in the same turn
+                self.hits += 1
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        pending.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RetrievalCache:
+    """In-memory LRU of question embeddings and of the top-k documents retrieved for a question.
+
+    Embeddings only depend on the text, retrieval results are keyed by collection, question, k and training data
+    version so a retrain never serves stale context.
+    """
+
+    def __init__(self, max_entries: int):
+        self._embeddings = _LRU(max_entries)
+        self._results = _LRU(max_entries)
+
+    def embedding(self, text: str, embed: Callable[[], list[float]]) -> list[float]:
+        return self._embeddings.get_or_compute(text, embed)
+
+    def retrieve(self, collection: str, question: str, n_results: int, version: str,
+                 query: Callable[[], list]) -> list:
+        # callers are free to mutate the list they get back
+        return list(self._results.get_or_compute((collection, question, n_results, version), query))
+
+    def clear(self):
+        self._embeddings.clear()
+        self._results.clear()
+
+    def stats(self) -> dict:
+        return {
+            name: {"hits": lru.hits, "misses": lru.misses, "entries": len(lru)}
+            for name, lru in (("embeddings", self._embeddings), ("results", self._results))
+        }
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Retrieval cache shared by every vanna instance and tool of the process"""
+    global _retrieval_cache
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache(int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024")))
+    return _retrieval_cache
@@ -0,0 +1,133 @@
+import hashlib
+import re
+import threading
+from typing import Callable, Optional, Sequence
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# words that flip the meaning of otherwise near-identical questions, e.g. "this fy" vs "last fy"
+_QUALIFIERS = {
+    "this", "last", "next", "previous", "current", "first", "top", "bottom", "highest", "lowest",
+    "min", "max", "minimum", "maximum", "average", "avg", "median", "not", "without", "before", "after",
+    "daily", "weekly", "monthly", "quarterly", "yearly", "annual", "month", "quarter", "year", "week", "day",
+}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question, strip punctuation and collapse whitespace"""
+    question = _PUNCTUATION.sub(" ", question.lower())
+    return _WHITESPACE.sub(" ", question).strip()
+
+
+def _signature(normalized_question: str) -> tuple:
+    """Numbers and qualifiers that must be identical for a near hit to be served"""
+    words = normalized_question.split(" ")
+    return tuple(_NUMBER.findall(normalized_question)), tuple(w for w in words if w in _QUALIFIERS)
+
+
+class SemanticSQLCache:
+    """Persistent question -> SQL cache stored in a Chroma collection next to the vanna training data.
+
+    Exact hits are looked up by the hash of the normalized question, near hits by cosine similarity of the
+    question embedding. Every entry is tagged with the version returned by `version_fn` (schema + training
+    data), entries of other versions are never served and are purged as soon as the version changes.
+    """
+
+    def __init__(
+            self,
+            chroma_client,
+            embedding_function,
+            version_fn: Callable[[], str],
+            similarity_threshold: float = 0.95,
+            collection_name: str = "sql_cache",
+            embed: Optional[Callable[[str], Sequence[float]]] = None,
+    ):
+        self.collection = chroma_client.get_or_create_collection(
+            name=collection_name,
+            embedding_function=embedding_function,
+            metadata={"hnsw:space": "cosine"},
+        )
+        self.version_fn = version_fn
+        self.similarity_threshold = similarity_threshold
+        # embeds a single text, e.g. through the retrieval cache, instead of the embedding function of the collection
+        self.embed = embed
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_id(normalized_question: str, version: str) -> str:
+        return hashlib.sha256(f"{version}\n{normalized_question}".encode()).hexdigest()
+
+    def _current_version(self) -> str:
+        version = self.version_fn()
+        with self._lock:
+            if version != self._version:
+                # schema or training data changed, drop everything generated against the old version
+                self.collection.delete(where={"version": {"$ne": version}})
+                self._version = version
+        return version
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, question: str) -> Optional[str]:
+        """Return the cached SQL for the question, or None on a miss"""
+        version = self._current_version()
+        normalized = normalize_question(question)
+
+        exact = self.collection.get(ids=[self._entry_id(normalized, version)], include=["metadatas"])
+        if exact["ids"]:
+            self._count("hits")
+            return exact["metadatas"][0]["sql"]
+
+        if self.similarity_threshold < 1 and self.collection.count() > 0:
+            result = self.collection.query(
+                **({"query_embeddings": [self.embed(normalized)]} if self.embed is not None
+                   else {"query_texts": [normalized]}),
+                n_results=1,
+                where={"version": version},
+                include=["metadatas", "documents", "distances"],
+            )
+            if result["ids"] and result["ids"][0]:
+                similarity = 1 - result["distances"][0][0]
+                if (similarity >= self.similarity_threshold
+                        and _signature(result["documents"][0][0]) == _signature(normalized)):
+                    self._count("semantic_hits")
+                    return result["metadatas"][0][0]["sql"]
+
+        self._count("misses")
+        return None
+
+    def put(self, question: str, sql: str):
+        """Store the SQL generated for the question under the current version"""
+        version = self._current_version()
+        normalized = normalize_question(question)
+        self.collection.upsert(
+            ids=[self._entry_id(normalized, version)],
+            documents=[normalized],
+            **({"embeddings": [self.embed(normalized)]} if self.embed is not None else {}),
+            metadatas=[{"version": version, "sql": sql, "question": question}],
+        )
+
+    def clear(self):
+        """Remove every cached entry"""
+        entry_ids = self.collection.get(include=[])["ids"]
+        if entry_ids:
+            self.collection.delete(ids=entry_ids)
+
+    def stats(self) -> dict:
+        """Hit/miss counters since the process started"""
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "entries": self.collection.count(),
+        }
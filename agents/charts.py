@@ -0,0 +1,236 @@
+"""Static image export of plotly figures for slides and downloads.
+
+Exporting through kaleido starts a headless browser, which takes far longer than rendering a chart. The renderer
+keeps a few warm worker processes, each holding its browser open between exports, renders several figures in
+parallel, and caches the images on disk by the hash of the figure and the export options, so the same chart is
+only exported once, until it is evicted as one of the least recently used images. A worker stuck in an export,
+e.g. on a browser that stopped responding, is ended after the timeout and the pool started again.
+
+Usage:
+    python -m agents.charts fig-1a2b3c4d5e6f7a8b [--format svg]    # print the path of the image
+"""
+import argparse
+import faulthandler
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Sequence
+
+from agents.cache.file_budget import FileBudget
+from agents.tracing import span
+
+FORMATS = ("png", "svg", "jpeg", "webp", "pdf")
+# pixels of the figure images placed on slides
+SLIDE_IMAGE_WIDTH, SLIDE_IMAGE_HEIGHT = 1200, 750
+
+
+def _warm_up(timeout: float):
+    """Initializer of a worker: import plotly and start the browser once, the exports reuse it"""
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    # a browser that never answers blocks the export instead of failing it, the worker exits instead
+    faulthandler.dump_traceback_later(timeout, exit=True)
+    try:
+        import kaleido
+
+        if hasattr(kaleido, "start_sync_server"):
+            # kaleido >= 1.1 starts a browser per export unless a server is kept running
+            kaleido.start_sync_server(silence_warnings=True)
+    except ImportError:
+        pass
+    try:
+        pio.to_image(go.Figure(), format="png", width=10, height=10)
+    except Exception:
+        # e.g. no browser installed, every export reports the error
+        pass
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+
+
+def _export(figure_json: str, fmt: str, width: Optional[int], height: Optional[int], scale: float, path: str,
+            timeout: float):
+    import plotly.io as pio
+
+    faulthandler.dump_traceback_later(timeout, exit=True)
+    try:
+        image = pio.to_image(pio.from_json(figure_json, skip_invalid=True), format=fmt, width=width, height=height,
+                             scale=scale)
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+    # write to a temporary file first, a concurrent reader never sees a partial image
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChartRenderer:
+    """Pool of warm kaleido workers with an on-disk cache of the exported images.
+
+    An export taking longer than `timeout` seconds ends its worker, its future and those of the other exports
+    running at the time raise BrokenProcessPool.
+    """
+
+    def __init__(self, cache_dir: str, workers: int = 2, timeout: float = 60, prefetch_backoff: float = 300,
+                 max_bytes: int = 512 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.budget = FileBudget(cache_dir, tuple(f".{fmt}" for fmt in FORMATS), max_bytes, ttl_seconds)
+        self.workers = workers
+        self.timeout = timeout
+        self.prefetch_backoff = prefetch_backoff
+        self.hits = 0
+        self.misses = 0
+        self._prefetch_paused_until = 0.0
+        self._executor = None
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn" if sys.platform == "win32" else "forkserver")
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_warm_up,
+                                             initargs=(self.timeout,))
+
+    def path(self, figure_json: str, fmt: str = "png", width: int = None, height: int = None,
+             scale: float = 1) -> str:
+        """Where the image of the figure with these options is cached"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported image format {fmt}, use one of {', '.join(FORMATS)}")
+        key = hashlib.sha256(f"{fmt}\n{width}\n{height}\n{scale}\n{figure_json}".encode()).hexdigest()[:24]
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def submit(self, figure_json: str, fmt: str = "png", width: int = None, height: int = None,
+               scale: float = 1) -> Future:
+        """Start exporting the figure unless it is cached or already being exported, the future gives the path"""
+        path = self.path(figure_json, fmt, width, height, scale)
+        with self._lock:
+            if os.path.exists(path):
+                self.budget.touch(path)
+                self.hits += 1
+                future = Future()
+                future.set_result(path)
+                return future
+            if path in self._pending:
+                # the same chart twice in a deck is exported once
+                self.hits += 1
+                return self._pending[path]
+            self.misses += 1
+            args = (_export, figure_json, fmt, width, height, scale, path, self.timeout)
+            if self._executor is None:
+                self._start()
+            try:
+                future = self._executor.submit(*args)
+            except BrokenProcessPool:
+                # a worker was ended by the timeout
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._start()
+                future = self._executor.submit(*args)
+            self._pending[path] = future
+        # a failed export is tried again by the next request
+        future.add_done_callback(lambda done: self._forget(path, done))
+        return future
+
+    def _forget(self, path: str, future: Future):
+        with self._lock:
+            self._pending.pop(path, None)
+            failed = future.cancelled() or future.exception() is not None
+            if failed:
+                self._prefetch_paused_until = time.monotonic() + self.prefetch_backoff
+        if not failed and os.path.exists(path):
+            self.budget.added(os.path.getsize(path))
+
+    def prefetch(self, figure_json: str, width: int = SLIDE_IMAGE_WIDTH, height: int = SLIDE_IMAGE_HEIGHT):
+        """Export the png of the figure in the background, at the size of the slides by default.
+
+        Skipped for `prefetch_backoff` seconds after an export failed, e.g. without a browser, so the workers are
+        not kept busy for nothing.
+        """
+        if time.monotonic() >= self._prefetch_paused_until:
+            self.submit(figure_json, "png", width, height)
+
+    def _result(self, future: Future) -> str:
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            raise TimeoutError(f"The image export did not finish within {self.timeout:g} seconds") from None
+
+    def render(self, figure_json: str, fmt: str = "png", width: int = None, height: int = None,
+               scale: float = 1) -> str:
+        """Path of the image of the figure, exported if it is not cached"""
+        with span("charts.render", format=fmt) as s:
+            future = self.submit(figure_json, fmt, width, height, scale)
+            s.set(cache_hit=future.done())
+            # the workers end exports that take longer than the timeout
+            return self._result(future)
+
+    def render_many(self, figures: Sequence[str], fmt: str = "png", width: int = None, height: int = None,
+                    scale: float = 1) -> list:
+        """Export the figures in parallel, the path of each image or the exception its export raised"""
+        with span("charts.render_many", figures=len(figures), format=fmt) as s:
+            futures = [self.submit(figure, fmt, width, height, scale) for figure in figures]
+            s.set(cache_hits=sum(future.done() for future in futures))
+            results = []
+            for future in futures:
+                try:
+                    results.append(self._result(future))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_chart_renderer = None
+_chart_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """Process wide renderer, the workers start on the first export"""
+    global _chart_renderer
+    with _chart_renderer_lock:
+        if _chart_renderer is None:
+            _chart_renderer = ChartRenderer(
+                os.getenv("CHART_CACHE_DIR", "cache/charts"),
+                workers=int(os.getenv("CHART_RENDER_WORKERS", "2")),
+                timeout=float(os.getenv("CHART_RENDER_TIMEOUT_SECONDS", "60")),
+                prefetch_backoff=float(os.getenv("CHART_PREFETCH_BACKOFF_SECONDS", "300")),
+                max_bytes=int(os.getenv("CHART_CACHE_MAX_MB", "512")) * 1024 * 1024,
+                ttl_seconds=float(os.getenv("CHART_CACHE_TTL_HOURS", "168")) * 3600,
+            )
+    return _chart_renderer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the figure behind a handle as an image")
+    parser.add_argument("handle", help="figure handle, fig-...")
+    parser.add_argument("--format", default="png", choices=FORMATS)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--scale", type=float, default=1)
+    args = parser.parse_args()
+
+    from agents.artifacts import get_artifact_store
+
+    with open(get_artifact_store().path(args.handle)) as f:
+        figure_json = f.read()
+    renderer = get_chart_renderer()
+    try:
+        print(renderer.render(figure_json, args.format, args.width, args.height, args.scale))
+    finally:
+        renderer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Durable, bounded checkpointer for the supervisor graph.
+
+Checkpoints are stored in SQLite with zlib compressed msgpack blobs. A background thread compacts the database:
+threads idle for longer than the TTL are deleted, only the latest checkpoints of a conversation are kept, and the
+checkpoints of finished subgraph (agent) runs are dropped. Our graphs only use reducer channels (add_messages),
+not DeltaChannel, so the latest checkpoint holds the full state and older ones are not needed to rebuild it.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from agents.tracing import span
+
+_COMPRESSED_SUFFIX = "+zlib"
+
+
+class CompressedSerializer(SerializerProtocol):
+    """Compress the blobs of another serializer with zlib, small blobs are stored as they are"""
+
+    def __init__(self, serde: SerializerProtocol = None, min_size: int = 512, level: int = 6):
+        self.serde = serde or JsonPlusSerializer()
+        self.min_size = min_size
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < self.min_size:
+            return type_, data
+        return type_ + _COMPRESSED_SUFFIX, zlib.compress(data, self.level)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, blob = data
+        if type_.endswith(_COMPRESSED_SUFFIX):
+            type_, blob = type_.removesuffix(_COMPRESSED_SUFFIX), zlib.decompress(blob)
+        return self.serde.loads_typed((type_, blob))
+
+
+class BoundedSqliteSaver(SqliteSaver):
+    """SqliteSaver with async support, retention limits and background compaction.
+
+    The async methods run the synchronous ones on a worker thread, the connection is shared and every access
+    goes through the lock of SqliteSaver.
+    """
+
+    def __init__(
+            self,
+            conn: sqlite3.Connection,
+            *,
+            serde: SerializerProtocol = None,
+            keep_per_thread: int = 10,
+            ttl_seconds: float = 7 * 24 * 3600,
+            compact_interval: float = 600,
+    ):
+        super().__init__(conn, serde=serde or CompressedSerializer())
+        self.keep_per_thread = keep_per_thread
+        self.ttl_seconds = ttl_seconds
+        self.compact_interval = compact_interval
+        self._stop = threading.Event()
+        self._compactor = None
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL)")
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    def compact(self) -> dict:
+        """Delete idle threads and the checkpoints no longer needed to resume a conversation"""
+        with self.cursor() as cur:
+            expired = [row[0] for row in cur.execute(
+                "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+            )]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+
+        with self.cursor() as cur:
+            # subgraph checkpoints older than the latest checkpoint of the parent graph belong to finished runs
+            cur.execute(
+                "DELETE FROM checkpoints WHERE checkpoint_ns != '' AND checkpoint_id < "
+                "(SELECT max(checkpoint_id) FROM checkpoints AS root "
+                "WHERE root.thread_id = checkpoints.thread_id AND root.checkpoint_ns = '')"
+            )
+            subgraph_checkpoints = cur.rowcount
+            # checkpoint ids are uuid6, ordering them orders the checkpoints by time
+            cur.execute(
+                "DELETE FROM checkpoints WHERE rowid IN (SELECT rowid FROM ("
+                "SELECT rowid, row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) "
+                "AS position FROM checkpoints) WHERE position > ?)",
+                (self.keep_per_thread,),
+            )
+            old_checkpoints = cur.rowcount
+            cur.execute(
+                "DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints AS c WHERE "
+                "c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns "
+                "AND c.checkpoint_id = writes.checkpoint_id)"
+            )
+            writes = cur.rowcount
+        with self.cursor(transaction=False) as cur:
+            cur.execute("PRAGMA incremental_vacuum")
+            cur.fetchall()
+        return {
+            "expired_threads": len(expired),
+            "subgraph_checkpoints": subgraph_checkpoints,
+            "old_checkpoints": old_checkpoints,
+            "writes": writes,
+        }
+
+    def start_compaction(self):
+        """Compact every `compact_interval` seconds on a daemon thread"""
+        if self._compactor is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.compact_interval):
+                try:
+                    with span("checkpoint.compact") as s:
+                        s.set(**self.compact())
+                except Exception as e:
+                    print(f"checkpoint compaction failed. Error: {repr(e)}")
+
+        self._compactor = threading.Thread(target=run, name="checkpoint-compaction", daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self.lock:
+            self.conn.close()
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+            self,
+            config: Optional[RunnableConfig],
+            *,
+            filter: Optional[dict[str, Any]] = None,
+            before: Optional[RunnableConfig] = None,
+            limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[tuple[str, Any]],
+            task_id: str,
+            task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def open_checkpointer(path: str, **kwargs) -> BoundedSqliteSaver:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # only takes effect on a new database, lets compaction hand the freed pages back to the file system
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return BoundedSqliteSaver(conn, **kwargs)
+
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> BoundedSqliteSaver:
+    """Checkpointer shared by the graphs of the process, compacting in the background"""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            checkpointer = open_checkpointer(
+                os.getenv("CHECKPOINT_DB_PATH", "cache/checkpoints.db"),
+                keep_per_thread=int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "10")),
+                ttl_seconds=float(os.getenv("CHECKPOINT_TTL_HOURS", "168")) * 3600,
+                compact_interval=float(os.getenv("CHECKPOINT_COMPACT_INTERVAL_SECONDS", "600")),
+            )
+            checkpointer.start_compaction()
+            _checkpointer = checkpointer
+    return _checkpointer
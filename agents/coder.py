@@ -1,27 +1,24 @@
-import json
 import os
+import threading
 from typing import Annotated, TypedDict, Sequence
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from langchain_experimental.utilities import PythonREPL
-from langchain_core.messages import BaseMessage, ToolMessage, SystemMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 
 from pydantic import BaseModel, Field
 
-from agents.data_analyst import DataAnalystVanna
-from agents.llm.llm import build_llm
-
-model = build_llm()
-
-# This executes code locally, which can be unsafe
-repl = PythonREPL()
-
-vn = DataAnalystVanna(config={"model": "gpt-4o-mini", "client": "persistent", "path": "./vanna-db"})
-vn.connect_to_sqlite(os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db"))
+from agents.cache.execution_cache import get_execution_cache, get_memoized_repl, normalize_code, parse_code
+from agents.cache.sql_cache import normalize_question
+from agents.data_analyst import get_vanna
+from agents.repl_pool import get_repl_pool
+from agents.history import compact_history
+from agents.tool_node import create_tool_node
+from agents.tracing import span
+from agents.llm.llm import get_llm
 
 
 class CoderState(TypedDict):
@@ -35,18 +32,57 @@ class Code(BaseModel):
     code: str = Field(description="Code block")
 
 
+# code handed out by generate_python_code, by its normalized source, with the question and version it is cached
+# under: it is cached once it runs to completion, and removed from the cache when it fails
+_issued_code: dict[str, tuple[str, str]] = {}
+_issued_code_lock = threading.Lock()
+_MAX_ISSUED_CODE = 256
+
+
+def _issue_code(code: str, question: str, version: str):
+    tree = parse_code(code)
+    if tree is None:
+        return
+    with _issued_code_lock:
+        _issued_code[normalize_code(tree)] = (question, version)
+        while len(_issued_code) > _MAX_ISSUED_CODE:
+            _issued_code.pop(next(iter(_issued_code)))
+
+
+def _record_outcome(code: str, ok: bool):
+    """Cache code handed out by generate_python_code once it ran to completion, drop it when it failed"""
+    tree = parse_code(code)
+    if tree is None:
+        return
+    with _issued_code_lock:
+        issued = _issued_code.pop(normalize_code(tree), None)
+    if issued is None:
+        return
+    question, version = issued
+    if ok:
+        get_execution_cache().put("code", question, version, {"code": code})
+    else:
+        get_execution_cache().delete("code", question, version)
+
+
 @tool
 def python_repl_tool(
         code: Annotated[str, "the python code to execute."],
+        config: RunnableConfig,
 ):
     """Use this to execute python code. If you want to see the output of a value,
     you should print it out with `print(...)`. This is visible to the user."""
+    # This executes code locally in a worker process, which can be unsafe.
+    # Every conversation thread gets its own namespace, with a read-only `db` handle on the database.
+    thread_id = str(config.get("configurable", {}).get("thread_id", "default"))
+    # the same code on the same data is served from the execution cache
+    repl = get_memoized_repl() if os.getenv("EXECUTION_CACHE_ENABLED", "true").lower() == "true" else get_repl_pool()
     try:
-        result = repl.run(code)
-        print("code.code", code)
-        print("code execution result", result)
+        result, ok = repl.execute(code, namespace_id=thread_id)
     except BaseException as e:
+        _record_outcome(code, False)
         return f"Failed to execute. Error: {repr(e)}"
+    _record_outcome(code, ok)
     result_str = f"Successfully executed:\n```python\n{code}\n```\nStdout: {result}"
     return result_str
 
@@ -54,20 +90,43 @@ def python_repl_tool(
 @tool
 def generate_python_code(user_input: str) -> str:
     """Generate python code given user input."""
+    vn = get_vanna()
+    code_cache = get_execution_cache() if os.getenv("CODE_CACHE_ENABLED", "true").lower() == "true" else None
+    if code_cache is not None:
+        # the code only depends on the question and the schema and training data retrieved for it
+        question, version = normalize_question(user_input), vn.cache_version()
+        if (cached := code_cache.get("code", question, version)) is not None:
+            with span("coder.generate_code", cache_hit=True):
+                _issue_code(cached["code"], question, version)
+                return cached["code"]
     ddl_list = vn.get_related_ddl(user_input)
     doc_list = vn.get_related_documentation(user_input)
 
     system_prompt = f"""You are a python expert. Please help to generate a code to answer the question. 
 Your response should ONLY be based on the given context and follow the response guidelines and format instructions. 
-You can access to SQLite database if you need to, connect using
+You can access to SQLite database if you need to, a read-only handle `db` is already available, do not import it:
 ```python
-import sqlite3
-
-db_name = "{os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db")}"
+df = db.run_sql("SELECT ...")  # returns a pandas DataFrame, fails for very large results: aggregate in sql
+head = db.preview_sql("SELECT ...", rows=20)  # first rows only, to look at the data
 
-con = sqlite3.connect(db_name)
+with db.connection() as con:  # raw sqlite3 connection, e.g. for pd.read_sql_query(sql, con)
+    ...
+```
+Do not open your own connection with sqlite3.connect and do not close the connection of `db`.
+Fit models through the registry `models`, also available without import, it returns the model fitted earlier on
+the same query and data instead of fitting it again:
+```python
+model = models.fit(LinearRegression(), "SELECT ...", features=["period"], target="sales", name="sales_trend")
+# any other model: spec describes it, fit gets the query result as a DataFrame and returns the fitted model
+model = models.get_or_fit("SELECT ...", spec="ExponentialSmoothing(trend='add')", fit=lambda df: ..., name="...")
+model = models.lookup(name="sales_trend")  # latest fitted model by name or target, None if there is none
+```
+For a follow-up question about an earlier prediction, look the model up before fitting a new one.
+Results of earlier questions are referenced by a handle, e.g. df-1a2b3c4d5e6f7a8b for a DataFrame or
+fig-1a2b3c4d5e6f7a8b for a plotly figure dict, if the question mentions one load it instead of querying again:
+```python
+df = load_artifact("df-1a2b3c4d5e6f7a8b")
 ```
-Close the connection at the end of the code. Do not delete or modify any data.
 The tables within the database:
 ===Tables 
 {"\n ".join(ddl_list)}
@@ -93,30 +152,27 @@ creation, please use the slides_generator_agent" and return code=''.
             ("placeholder", "{messages}"),
         ]
     )
-    code_gen_chain = code_gen_prompt | model.with_structured_output(Code)
-    result = code_gen_chain.invoke({"messages": [("user", user_input)]})
-    print("code generation result", result)
+    code_gen_chain = code_gen_prompt | get_llm().with_structured_output(Code)
+    with span("coder.generate_code", cache_hit=False) as s:
+        result = code_gen_chain.invoke({"messages": [("user", user_input)]})
+        s.set(prefix=result.prefix, code=result.code)
+    if code_cache is not None and result.code.strip():
+        # cached once python_repl_tool ran it to completion, broken code is generated again on the retry
+        _issue_code(result.code, question, version)
     return result.code
 
 
 tools = [python_repl_tool, generate_python_code]
-model = model.bind_tools(tools)
 
-tools_by_name = {tool.name: tool for tool in tools}
+_model = None
 
 
-def tool_node(state: CoderState):
-    outputs = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool_result = tools_by_name[tool_call["name"]].invoke(tool_call["args"])
-        outputs.append(
-            ToolMessage(
-                content=json.dumps(tool_result),
-                name=tool_call["name"],
-                tool_call_id=tool_call["id"],
-            )
-        )
-    return {"messages": outputs}
+def get_model():
+    """Shared llm with the coder tools bound"""
+    global _model
+    if _model is None:
+        _model = get_llm().bind_tools(tools)
+    return _model
 
 
 def call_model(
@@ -125,9 +181,10 @@ def call_model(
 ):
     system_prompt = SystemMessage(
         "You are a coder agent, please use generate_python_code tool to generate code given user's intent"
-        "And then use python_repl_tool to execute your code, and then return your result."
+        "And then use python_repl_tool to execute your code, and then return your result. "
+        "Pass any result handle (df-... or fig-...) from the conversation on to generate_python_code."
     )
-    response = model.invoke([system_prompt] + state["messages"], config)
+    response = get_model().invoke(compact_history(system_prompt, state["messages"]), config)
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
@@ -147,7 +204,7 @@ def should_continue(state: CoderState):
 def create_coder_agent():
     workflow = StateGraph(CoderState)
     workflow.add_node("agent", call_model)
-    workflow.add_node("tools", tool_node)
+    workflow.add_node("tools", create_tool_node(tools))
     workflow.set_entry_point("agent")
     workflow.add_conditional_edges(
         "agent",
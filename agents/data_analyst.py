@@ -1,4 +1,7 @@
+import hashlib
 import os
+import threading
+import time
 
 from vanna.openai import OpenAI_Chat
 from typing import (
@@ -9,13 +12,23 @@ from typing import (
 from langchain_core.tools import tool
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
-import json
-from langchain_core.messages import ToolMessage, SystemMessage
+from langchain_core.messages import SystemMessage
 from langchain_core.runnables import RunnableConfig
 
 from vanna.chromadb import ChromaDB_VectorStore
 
-from agents.llm.llm import build_llm, get_llm_client
+from agents.artifacts import get_artifact_store, preview_dataframe
+from agents.cache.result_cache import database_version, get_result_cache
+from agents.cache.retrieval_cache import get_retrieval_cache
+from agents.cache.sql_cache import SemanticSQLCache
+from agents.charts import get_chart_renderer
+from agents.db import get_database_name, get_pool
+from agents.history import compact_history
+from agents.index_advisor import get_query_log
+from agents.llm.llm import get_llm, get_llm_client
+from agents.sql_guard import SQLValidationError, get_sql_validator
+from agents.tool_node import create_tool_node
+from agents.tracing import span
 from langgraph.graph import StateGraph, END
 
 from dotenv import load_dotenv
@@ -30,12 +43,231 @@ class DataAnalystVanna(ChromaDB_VectorStore, OpenAI_Chat):
         ChromaDB_VectorStore.__init__(self, config=config)
         azure_openai_client = get_llm_client()
         OpenAI_Chat.__init__(self, client=azure_openai_client, config=config)
+        self.retrieval_cache = None
+        if os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true":
+            self.retrieval_cache = get_retrieval_cache()
+        # the training data version is memoized, listing the ids of every collection on each lookup is not free
+        self.training_version_ttl = float(os.getenv("TRAINING_VERSION_TTL_SECONDS", "10"))
+        self._training_version = None
+        self._training_version_at = 0.0
+        # set while vanna generates sql, its intermediate sql only needs the first rows of the result
+        self._introspecting = threading.local()
+        self.introspection_rows = int(os.getenv("SQL_INTROSPECTION_ROWS", "50"))
+        self.sql_cache = None
+        if os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true":
+            self.sql_cache = SemanticSQLCache(
+                self.chroma_client,
+                self.embedding_function,
+                version_fn=self.cache_version,
+                similarity_threshold=float(os.getenv("SQL_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+                embed=self.generate_embedding,
+            )
+
+    def connect_to_sqlite(self, url: str, check_same_thread: bool = False, **kwargs):
+        """Run sql on the shared read-only connection pool, and serve repeated queries from the result cache.
+
+        The pool interrupts queries past SQL_TIMEOUT_SECONDS and fails results over SQL_MAX_ROWS rows, the
+        intermediate sql vanna runs to look at the data only fetches the first SQL_INTROSPECTION_ROWS rows.
+        """
+        self.db_name = url
+        self.dialect = "SQLite"
+        pool = get_pool(url)
+        run_sql_pool = pool.run_sql
+
+        def run_sql_database(sql: str):
+            with span("sqlite.execute") as s:
+                df = run_sql_pool(sql)
+                s.set(rows=len(df))
+            return df
+
+        self.run_sql = run_sql_database
+        self.run_sql_is_set = True
+        self.sql_validator = None
+        if os.getenv("SQL_VALIDATION_ENABLED", "true").lower() == "true":
+            self.sql_validator = get_sql_validator(url)
+        if os.getenv("QUERY_LOG_ENABLED", "true").lower() == "true":
+            # the workload of the index advisor, only queries that actually hit the database are logged
+            run_sql_uncached = self.run_sql
+            query_log = get_query_log()
+
+            def run_sql_logged(sql: str):
+                start = time.perf_counter()
+                df = run_sql_uncached(sql)
+                if get_result_cache().is_cacheable(sql) and "sqlite_master" not in sql:
+                    query_log.record(sql, (time.perf_counter() - start) * 1000, len(df))
+                return df
+
+            self.run_sql = run_sql_logged
+        if os.getenv("SQL_RESULT_CACHE_ENABLED", "true").lower() == "true":
+            run_sql = self.run_sql
+            result_cache = get_result_cache()
+
+            def run_sql_cached(sql: str):
+                return result_cache.get_or_run(sql, database_version(self.db_name), run_sql)
+
+            self.run_sql = run_sql_cached
+        # a run served from the result cache has no sqlite.execute child
+        run_sql_untraced = self.run_sql
+
+        def run_sql_traced(sql: str):
+            if getattr(self._introspecting, "active", False):
+                self.validate_sql(sql)
+                with span("sqlite.preview", sql=sql) as s:
+                    df = pool.preview_sql(sql, self.introspection_rows)
+                    s.set(rows=len(df))
+                return df
+            with span("vanna.run_sql", sql=sql) as s:
+                df = run_sql_untraced(sql)
+                s.set(rows=len(df))
+            return df
+
+        self.run_sql = run_sql_traced
 
+    def validate_sql(self, sql: str):
+        """Raise SQLValidationError for sql that does not match the schema or would read too many rows"""
+        if getattr(self, "sql_validator", None) is None:
+            return
+        with span("sql.validate") as s:
+            try:
+                validation = self.sql_validator.validate(sql)
+            except SQLValidationError as e:
+                s.set(rejected=str(e))
+                raise
+            s.set(estimated_rows=validation.estimated_rows)
 
-vn = DataAnalystVanna(config={"model": os.getenv("MODEL_NAME"), "client": "persistent", "path": "./vanna-db"})
-vn.connect_to_sqlite(os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db"))
-training_data = vn.get_training_data()
-print("training_data", training_data)
+    def is_sql_valid(self, sql: str) -> bool:
+        if not super().is_sql_valid(sql):
+            return False
+        try:
+            self.validate_sql(sql)
+        except SQLValidationError:
+            return False
+        return True
+
+    def training_data_version(self) -> str:
+        """Hash of the training data ids, vanna derives the ids from the content so any change alters the hash.
+
+        Training through this instance refreshes it right away, training from another process (train.py) is
+        picked up within TRAINING_VERSION_TTL_SECONDS.
+        """
+        if self._training_version is None or time.monotonic() - self._training_version_at > self.training_version_ttl:
+            digest = hashlib.sha256()
+            for collection in (self.sql_collection, self.ddl_collection, self.documentation_collection):
+                digest.update("\n".join(sorted(collection.get(include=[])["ids"])).encode())
+            self._training_version, self._training_version_at = digest.hexdigest(), time.monotonic()
+        return self._training_version
+
+    def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
+        self._training_version = None
+        return super().add_question_sql(question, sql, **kwargs)
+
+    def add_ddl(self, ddl: str, **kwargs) -> str:
+        self._training_version = None
+        return super().add_ddl(ddl, **kwargs)
+
+    def add_documentation(self, documentation: str, **kwargs) -> str:
+        self._training_version = None
+        return super().add_documentation(documentation, **kwargs)
+
+    def remove_training_data(self, id: str, **kwargs) -> bool:
+        self._training_version = None
+        return super().remove_training_data(id, **kwargs)
+
+    def generate_embedding(self, data: str, **kwargs) -> list[float]:
+        """Embed the text once per process, the same question is embedded for every collection it is looked up in"""
+        embed = super().generate_embedding
+
+        def embed_traced():
+            with span("vanna.embedding", chars=len(data)):
+                return embed(data, **kwargs)
+
+        if self.retrieval_cache is None:
+            return embed_traced()
+        return self.retrieval_cache.embedding(data, embed_traced)
+
+    def _retrieve(self, collection, question: str, n_results: int) -> list:
+        def query():
+            embedding = self.generate_embedding(question)
+            with span("chroma.query", collection=collection.name, n_results=n_results) as s:
+                documents = ChromaDB_VectorStore._extract_documents(
+                    collection.query(query_embeddings=[embedding], n_results=n_results)
+                )
+                s.set(documents=len(documents))
+            return documents
+
+        with span("vanna.retrieve", collection=collection.name):
+            if self.retrieval_cache is None:
+                return query()
+            return self.retrieval_cache.retrieve(
+                collection.name, question, n_results, self.training_data_version(), query
+            )
+
+    def get_similar_question_sql(self, question: str, **kwargs) -> list:
+        return self._retrieve(self.sql_collection, question, self.n_results_sql)
+
+    def get_related_ddl(self, question: str, **kwargs) -> list:
+        return self._retrieve(self.ddl_collection, question, self.n_results_ddl)
+
+    def get_related_documentation(self, question: str, **kwargs) -> list:
+        return self._retrieve(self.documentation_collection, question, self.n_results_documentation)
+
+    def schema_version(self) -> str:
+        """Hash of the table and view definitions, unlike the schema cookie it ignores new indexes"""
+        if not self.run_sql_is_set:
+            return ""
+        ddl = self.run_sql("SELECT sql FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name")
+        return hashlib.sha256("\n".join(ddl["sql"].fillna("")).encode()).hexdigest()
+
+    def cache_version(self) -> str:
+        """Version of everything the generated sql depends on"""
+        return f"{self.schema_version()}-{self.training_data_version()}"
+
+    def generate_sql(self, question: str, allow_llm_to_see_data=False, **kwargs) -> str:
+        """Serve the sql from the question cache when possible, only valid sql is cached"""
+        with span("vanna.generate_sql", question=question) as s:
+            if self.sql_cache is not None and (sql := self.sql_cache.get(question)) is not None:
+                s.set(cache_hit=True, sql=sql)
+                return sql
+            self._introspecting.active = True
+            try:
+                sql = super().generate_sql(question, allow_llm_to_see_data=allow_llm_to_see_data, **kwargs)
+            finally:
+                self._introspecting.active = False
+            if self.sql_cache is not None and self.is_sql_valid(sql):
+                self.sql_cache.put(question, sql)
+            s.set(cache_hit=False, sql=sql)
+            return sql
+
+    def generate_summary(self, question: str, df, **kwargs) -> str:
+        with span("vanna.generate_summary", rows=len(df)):
+            return super().generate_summary(question, df, **kwargs)
+
+    def generate_plotly_code(self, question: str = None, sql: str = None, df_metadata: str = None, **kwargs) -> str:
+        with span("vanna.generate_plotly_code"):
+            return super().generate_plotly_code(question=question, sql=sql, df_metadata=df_metadata, **kwargs)
+
+    def submit_prompt(self, prompt, **kwargs) -> str:
+        """The llm calls of vanna, the client does not report usage so tokens are estimated at 4 characters each"""
+        with span("vanna.submit_prompt", model=self.config.get("model") if self.config else None) as s:
+            response = super().submit_prompt(prompt, **kwargs)
+            s.set(input_tokens=sum(len(str(m["content"])) for m in prompt) // 4, output_tokens=len(response) // 4,
+                  tokens_estimated=True)
+            return response
+
+
+_vn = None
+_vn_lock = threading.Lock()
+
+
+def get_vanna() -> DataAnalystVanna:
+    """Vanna instance shared by all agents, created and connected on first use"""
+    global _vn
+    with _vn_lock:
+        if _vn is None:
+            vn = DataAnalystVanna(config={"model": os.getenv("MODEL_NAME"), "client": "persistent", "path": "./vanna-db"})
+            vn.connect_to_sqlite(get_database_name())
+            _vn = vn
+    return _vn
 
 
 # data analyst react agent
@@ -47,23 +279,28 @@ class DataAnalysisState(TypedDict):
 @tool
 def answer_question_about_data(user_input: str) -> dict:
     """
-    Call to get the answer about the data, and return a dictionary with the sql, sql execution result and answer
+    Call to get the answer about the data, and return a dictionary with the sql, a preview of the sql execution
+    result, the handle of the full result and the answer
     :param user_input: (str) the question user ask
-    :return: (dict) a dictionary containing the sql, execution_result, answer
+    :return: (dict) a dictionary containing the sql, execution_result, result_handle, answer
     """
+    vn = get_vanna()
     try:
         sql = vn.generate_sql(user_input, allow_llm_to_see_data=True)
+        vn.validate_sql(sql)
         sql_result = vn.run_sql(sql)
         answer = vn.generate_summary(user_input, sql_result)
         return {
             "sql": sql,
-            "execution_result": str(sql_result),
+            "execution_result": preview_dataframe(sql_result),
+            "result_handle": get_artifact_store().put_dataframe(sql_result),
             "answer": answer,
         }
     except Exception as e:
         return {
             "sql": None,
             "execution_result": None,
+            "result_handle": None,
             "answer": str(e),
         }
 
@@ -71,52 +308,57 @@ def answer_question_about_data(user_input: str) -> dict:
 @tool
 def visualize_data(user_input: str) -> dict:
     """
-    Call to get data visualization plot about the data, and return a dictionary with the sql, sql execution result,
-    plotly_code, and plotly_figure
+    Call to get data visualization plot about the data, and return a dictionary with the sql, a preview of the sql
+    execution result, the handle of the full result, plotly_code, and the handle of the plotly figure
     :param user_input: (str) the question user ask
-    :return: (dict) a dictionary containing the sql, execution_result, plotly_code, and plotly_figure
+    :return: (dict) a dictionary containing the sql, execution_result, result_handle, plotly_code, and figure_handle
     """
+    vn = get_vanna()
     try:
         sql = vn.generate_sql(user_input)
+        vn.validate_sql(sql)
         df = vn.run_sql(sql)
         plotly_code = vn.generate_plotly_code(question=user_input, sql=sql,
                                               df_metadata=f"Running df.dtypes gives:\n {df.dtypes}")
         fig = vn.get_plotly_figure(plotly_code=plotly_code, df=df)
-        return {
+        figure_json = fig.to_json()
+        store = get_artifact_store()
+        result = {
             "sql": sql,
-            "execution_result": str(df),
+            "execution_result": preview_dataframe(df),
+            "result_handle": store.put_dataframe(df),
             "plotly_code": plotly_code,
-            "plotly_figure": fig.to_dict()
+            "figure_handle": store.put_figure(figure_json),
         }
     except Exception as e:
         return {
             "sql": None,
             "execution_result": str(e),
+            "result_handle": None,
             "plotly_code": None,
-            "plotly_figure": None
+            "figure_handle": None,
         }
+    if os.getenv("CHART_PREFETCH_ENABLED", "true").lower() == "true":
+        try:
+            # exported in the background, a slide showing the chart finds the image cached
+            get_chart_renderer().prefetch(figure_json)
+        except Exception as e:
+            # optional, the visualization is complete without it
+            print(f"chart prefetch failed. Error: {repr(e)}")
+    return result
 
 
 tools = [answer_question_about_data, visualize_data]
-model = build_llm()
-model = model.bind_tools(tools)
-
-tools_by_name = {tool.name: tool for tool in tools}
-
-
-# Define our tool node
-def tool_node(state: DataAnalysisState):
-    outputs = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool_result = tools_by_name[tool_call["name"]].invoke(tool_call["args"])
-        outputs.append(
-            ToolMessage(
-                content=json.dumps(tool_result),
-                name=tool_call["name"],
-                tool_call_id=tool_call["id"],
-            )
-        )
-    return {"messages": outputs}
+
+_model = None
+
+
+def get_model():
+    """Shared llm with the data analyst tools bound"""
+    global _model
+    if _model is None:
+        _model = get_llm().bind_tools(tools)
+    return _model
 
 
 # Define the node that calls the model
@@ -125,11 +367,14 @@ def call_model(
         config: RunnableConfig,
 ):
     system_prompt = SystemMessage(
-        "You are an data analyst, Always use one tool at a time."
+        "You are an data analyst. "
         "For data analysis task / inquiry about the, use answer_question_about_data. "
-        "For data visualization task, use visualize_data"
+        "For data visualization task, use visualize_data. "
+        "Results are returned as a preview and a result_handle (df-...) to the full data, the figure as a "
+        "figure_handle (fig-...), mention the handles in your answer so other agents can load them. "
+        "If the request needs both an answer and a visualization, call both tools in the same turn."
     )
-    response = model.invoke([system_prompt] + state["messages"], config)
+    response = get_model().invoke(compact_history(system_prompt, state["messages"]), config)
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
@@ -149,7 +394,7 @@ def should_continue(state: DataAnalysisState):
 def create_data_analyst_agent():
     workflow = StateGraph(DataAnalysisState)
     workflow.add_node("agent", call_model)
-    workflow.add_node("tools", tool_node)
+    workflow.add_node("tools", create_tool_node(tools))
 
     workflow.set_entry_point("agent")
 
@@ -0,0 +1,195 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+
+def get_database_name() -> str:
+    return os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db")
+
+
+def enable_wal(db_name: str):
+    """Switch the database to WAL so readers never block each other or a writer, the setting is persistent"""
+    try:
+        conn = sqlite3.connect(db_name)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+    except sqlite3.OperationalError as e:
+        # e.g. the database lives on a read-only volume, readers still work in the current journal mode
+        print(f"Could not enable WAL on {db_name}: {e}")
+
+
+class QueryTimeoutError(TimeoutError):
+    pass
+
+
+class ResultTooLargeError(ValueError):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only SQLite connections.
+
+    A thread checks out one connection at a time and gets the same connection back on nested checkouts,
+    so a connection is never used by two threads at once. Queries are interrupted past `query_timeout` seconds
+    and results are fetched in batches, a result of more than `max_rows` rows fails before it is all in memory.
+    """
+
+    def __init__(
+            self,
+            db_name: str,
+            size: int = 8,
+            mmap_size: int = 256 * 1024 * 1024,
+            cache_size_kib: int = 64 * 1024,
+            checkout_timeout: float = 30,
+            query_timeout: float = 30,
+            max_rows: int = 1_000_000,
+            fetch_size: int = 10_000,
+    ):
+        if not os.path.exists(db_name):
+            raise FileNotFoundError(f"SQLite database {db_name} does not exist, please run ingest_data.py first")
+        self.db_name = db_name
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.checkout_timeout = checkout_timeout
+        self.query_timeout = query_timeout
+        self.max_rows = max_rows
+        self.fetch_size = fetch_size
+        self._uri = f"{Path(db_name).absolute().as_uri()}?mode=ro"
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        enable_wal(db_name)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection available after {self.checkout_timeout}s") from None
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread"""
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.held = conn
+        try:
+            yield conn
+        finally:
+            self._local.held = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def deadline(self, timeout: float = None):
+        """Connection of the current thread whose statements are interrupted once the timeout has passed"""
+        timeout = self.query_timeout if timeout is None else timeout
+        with self.connection() as conn:
+            if not timeout:
+                yield conn
+                return
+            expires = time.monotonic() + timeout
+            # called every 10k virtual machine instructions, a non-zero return aborts the statement
+            conn.set_progress_handler(lambda: time.monotonic() > expires, 10_000)
+            try:
+                yield conn
+            except sqlite3.OperationalError as e:
+                if str(e) == "interrupted" and time.monotonic() > expires:
+                    raise QueryTimeoutError(f"Query cancelled after {timeout}s") from None
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
+
+    def _fetch(self, sql: str, limit: int, truncate: bool, timeout: float = None) -> pd.DataFrame:
+        with self.deadline(timeout) as conn:
+            cursor = conn.execute(sql)
+            try:
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                rows = []
+                while len(rows) <= limit:
+                    batch = cursor.fetchmany(min(self.fetch_size, limit + 1 - len(rows)))
+                    if not batch:
+                        break
+                    rows.extend(batch)
+            finally:
+                # the rest of the result is never computed
+                cursor.close()
+        if len(rows) > limit:
+            if not truncate:
+                raise ResultTooLargeError(
+                    f"The query returns more than {limit} rows, aggregate the data or add a LIMIT"
+                )
+            del rows[limit:]
+        return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    def run_sql(self, sql: str, max_rows: int = None, timeout: float = None) -> pd.DataFrame:
+        """Full result of the query, fails when it has more than `max_rows` rows"""
+        return self._fetch(sql, self.max_rows if max_rows is None else max_rows, truncate=False, timeout=timeout)
+
+    def preview_sql(self, sql: str, rows: int = 10, timeout: float = None) -> pd.DataFrame:
+        """First rows of the result, only as much of the query is executed as they need"""
+        return self._fetch(sql, rows, truncate=True, timeout=timeout)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str = None) -> ConnectionPool:
+    """Process wide connection pool of the database"""
+    db_name = db_name or get_database_name()
+    key = os.path.abspath(db_name)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                db_name,
+                size=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+                mmap_size=int(os.getenv("SQLITE_MMAP_SIZE_MB", "256")) * 1024 * 1024,
+                cache_size_kib=int(os.getenv("SQLITE_CACHE_SIZE_MB", "64")) * 1024,
+                query_timeout=float(os.getenv("SQL_TIMEOUT_SECONDS", "30")),
+                max_rows=int(os.getenv("SQL_MAX_ROWS", "1000000")),
+            )
+    return _pools[key]
@@ -0,0 +1,219 @@
+"""Deterministic PowerPoint rendering of a deck outline.
+
+The model describes the deck as a small outline, titles, bullets and charts or tables of earlier results
+referenced by handle, and the deck is built from it with native pptx charts, so no presentation code is generated
+or debugged. Figures a native chart can not show are placed as images, exported together before the slides are
+built.
+"""
+import base64
+import os
+import re
+from typing import Literal, Optional
+
+import numpy as np
+import pandas as pd
+from pptx import Presentation
+from pptx.chart.data import CategoryChartData
+from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION
+from pptx.util import Inches, Pt
+from pydantic import BaseModel, Field
+
+from agents.artifacts import DATAFRAME_PREFIX, FIGURE_PREFIX, get_artifact_store
+from agents.charts import SLIDE_IMAGE_HEIGHT, SLIDE_IMAGE_WIDTH, get_chart_renderer
+
+# title, title and content, title only
+TITLE_LAYOUT, BULLETS_LAYOUT, TITLE_ONLY_LAYOUT = 0, 1, 5
+MAX_CATEGORIES = 50
+MAX_TABLE_ROWS = 15
+
+CHART_TYPES = {
+    "bar": XL_CHART_TYPE.BAR_CLUSTERED,
+    "column": XL_CHART_TYPE.COLUMN_CLUSTERED,
+    "line": XL_CHART_TYPE.LINE_MARKERS,
+    "pie": XL_CHART_TYPE.PIE,
+}
+
+
+class SlideOutline(BaseModel):
+    """One slide of the deck"""
+    kind: Literal["bullets", "chart", "table", "image"] = Field(
+        description="bullets, a chart or a table of a result, or the image of a figure (fig-...) as it was plotted, "
+                    "for figures a bar, column, line or pie chart can not show, e.g. scatter plots or maps"
+    )
+    title: str = Field(description="Slide title")
+    bullets: list[str] = Field(default_factory=list, description="Short bullet points, for every kind of slide")
+    handle: Optional[str] = Field(default=None, description="Result handle (df-... or fig-...) of a chart or table")
+    chart_type: Literal["bar", "column", "line", "pie"] = Field(default="column", description="Type of chart")
+    x: Optional[str] = Field(default=None, description="Column of the categories of a chart")
+    y: list[str] = Field(default_factory=list, description="Columns of the values of a chart, one series each")
+
+
+class DeckOutline(BaseModel):
+    """Outline of a presentation"""
+    title: str = Field(description="Title of the presentation")
+    subtitle: str = Field(default="", description="Subtitle of the title slide")
+    file_name: str = Field(description="Short file name for the presentation, without extension")
+    slides: list[SlideOutline] = Field(description="The slides after the title slide")
+
+
+def _values(data) -> list:
+    """Values of a trace attribute, plotly serializes numeric arrays as base64 typed arrays"""
+    if isinstance(data, dict) and "bdata" in data:
+        return np.frombuffer(base64.b64decode(data["bdata"]), dtype=data["dtype"]).tolist()
+    return list(data)
+
+
+def _figure_frame(figure: dict) -> pd.DataFrame:
+    """The traces of a plotly figure as one frame, x as first column and one column per trace"""
+    frame = None
+    for i, trace in enumerate(figure.get("data", [])):
+        if "x" not in trace or "y" not in trace:
+            continue
+        series = pd.DataFrame({"x": _values(trace["x"]), trace.get("name") or f"series {i + 1}": _values(trace["y"])})
+        series = series.groupby("x", sort=False).sum(numeric_only=True).reset_index()
+        frame = series if frame is None else frame.merge(series, on="x", how="outer")
+    return frame if frame is not None else pd.DataFrame()
+
+
+def load_result(handle: str) -> pd.DataFrame:
+    store = get_artifact_store()
+    if handle.startswith(DATAFRAME_PREFIX):
+        return store.load_dataframe(handle)
+    if handle.startswith(FIGURE_PREFIX):
+        return _figure_frame(store.load_figure(handle))
+    raise ValueError(f"Unknown artifact handle: {handle}")
+
+
+def _chart_columns(df: pd.DataFrame, x: Optional[str], y: list[str]) -> tuple[str, list[str]]:
+    """The requested columns where they exist, otherwise the first column and the numeric ones"""
+    numeric = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+    if x not in df.columns:
+        x = next((col for col in df.columns if col not in numeric), df.columns[0])
+    y = [col for col in y if col in numeric and col != x] or [col for col in numeric if col != x]
+    return x, y
+
+
+def _add_bullets(slide, bullets: list[str], left, top, width, height):
+    frame = slide.shapes.add_textbox(left, top, width, height).text_frame
+    frame.word_wrap = True
+    for i, bullet in enumerate(bullets):
+        paragraph = frame.paragraphs[0] if i == 0 else frame.add_paragraph()
+        paragraph.text = f"• {bullet}"
+        paragraph.font.size = Pt(16)
+
+
+def _add_chart(slide, outline: SlideOutline, df: pd.DataFrame, left, top, width, height):
+    x, y = _chart_columns(df, outline.x, outline.y)
+    if not y:
+        raise ValueError(f"{outline.handle} has no numeric column to chart")
+    df = df.head(MAX_CATEGORIES)
+    chart_type = outline.chart_type
+    if chart_type == "pie":
+        # a pie shows one series
+        y = y[:1]
+    data = CategoryChartData()
+    data.categories = [str(value) for value in df[x]]
+    for col in y:
+        data.add_series(str(col), [None if pd.isna(value) else float(value) for value in df[col]])
+    chart = slide.shapes.add_chart(CHART_TYPES[chart_type], left, top, width, height, data).chart
+    chart.has_legend = len(y) > 1 or chart_type == "pie"
+    if chart.has_legend:
+        chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+        chart.legend.include_in_layout = False
+
+
+def _add_table(slide, df: pd.DataFrame, left, top, width, height):
+    df = df.head(MAX_TABLE_ROWS)
+    table = slide.shapes.add_table(len(df) + 1, len(df.columns), left, top, width, height).table
+    for j, col in enumerate(df.columns):
+        table.cell(0, j).text = str(col)
+    for i, row in enumerate(df.itertuples(index=False), start=1):
+        for j, value in enumerate(row):
+            table.cell(i, j).text = f"{value:,.2f}" if isinstance(value, float) else str(value)
+            table.cell(i, j).text_frame.paragraphs[0].font.size = Pt(11)
+
+
+def _render_images(outline: DeckOutline) -> dict:
+    """Image path, or the error, of every figure shown as an image, exported in parallel"""
+    handles = list(dict.fromkeys(
+        slide.handle for slide in outline.slides
+        if slide.kind == "image" and slide.handle and slide.handle.startswith(FIGURE_PREFIX)
+    ))
+    store = get_artifact_store()
+    images, figures = {}, {}
+    for handle in handles:
+        try:
+            with open(store.path(handle)) as f:
+                figures[handle] = f.read()
+        except (OSError, ValueError) as e:
+            # e.g. a handle the model made up or a result evicted from the store
+            images[handle] = e
+    if figures:
+        rendered = get_chart_renderer().render_many(list(figures.values()), width=SLIDE_IMAGE_WIDTH,
+                                                    height=SLIDE_IMAGE_HEIGHT)
+        images.update(zip(figures, rendered))
+    return images
+
+
+def _add_image(slide, image, left, top, width, height):
+    if isinstance(image, Exception):
+        raise image
+    picture = slide.shapes.add_picture(image, left, top)
+    # scaled to fit the content area, keeping the aspect ratio
+    ratio = min(width / picture.width, height / picture.height)
+    picture.width, picture.height = int(picture.width * ratio), int(picture.height * ratio)
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^\w-]+", "_", name).strip("_")[:80] or "presentation"
+
+
+def render_deck(outline: DeckOutline, output_dir: str) -> str:
+    """Build the presentation of the outline in output_dir and return its path.
+
+    A chart, table or image whose result can not be loaded, charted or exported keeps its bullets and notes the
+    problem.
+    """
+    presentation = Presentation()
+    width, height = presentation.slide_width, presentation.slide_height
+
+    title_slide = presentation.slides.add_slide(presentation.slide_layouts[TITLE_LAYOUT])
+    title_slide.shapes.title.text = outline.title
+    title_slide.placeholders[1].text = outline.subtitle
+    images = _render_images(outline)
+
+    for slide_outline in outline.slides:
+        if slide_outline.kind == "bullets" or not slide_outline.handle:
+            slide = presentation.slides.add_slide(presentation.slide_layouts[BULLETS_LAYOUT])
+            slide.shapes.title.text = slide_outline.title
+            body = slide.placeholders[1].text_frame
+            for i, bullet in enumerate(slide_outline.bullets):
+                (body.paragraphs[0] if i == 0 else body.add_paragraph()).text = bullet
+            continue
+
+        slide = presentation.slides.add_slide(presentation.slide_layouts[TITLE_ONLY_LAYOUT])
+        slide.shapes.title.text = slide_outline.title
+        bullets = list(slide_outline.bullets)
+        # bullets on the left third, the chart or table on the rest of the slide
+        left = Inches(0.5) if not bullets else Inches(3.5)
+        top, content_height = Inches(1.6), height - Inches(2.0)
+        content_width = width - left - Inches(0.5)
+        try:
+            if slide_outline.kind == "image":
+                if slide_outline.handle not in images:
+                    raise ValueError("only figures (fig-...) can be shown as images")
+                _add_image(slide, images[slide_outline.handle], left, top, content_width, content_height)
+            elif slide_outline.kind == "chart":
+                _add_chart(slide, slide_outline, load_result(slide_outline.handle), left, top, content_width,
+                           content_height)
+            else:
+                _add_table(slide, load_result(slide_outline.handle), left, top, content_width, content_height)
+        except Exception as e:
+            bullets.append(f"({slide_outline.handle} could not be shown: {e})")
+        if bullets:
+            _add_bullets(slide, bullets, Inches(0.5), top, Inches(2.8), content_height)
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{_file_name(outline.file_name)}.pptx")
+    presentation.save(path)
+    return path
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from agents.llm.llm import get_llm
+from agents.tracing import span
+
+HISTORY_ENABLED = os.getenv("HISTORY_COMPACTION_ENABLED", "true").lower() == "true"
+TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
+# part of the budget reserved for the summary of the older turns
+SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "1000"))
+# tool results of earlier turns are cut to this many characters, the answer built from them is kept in full
+TOOL_RESULT_MAX_CHARS = int(os.getenv("HISTORY_TOOL_RESULT_MAX_CHARS", "1500"))
+
+SUMMARY_PROMPT = (
+    "You maintain the running summary of a conversation between a user and a team of data science agents. "
+    "Update the current summary with the new messages. Keep the user's goals, the questions asked, the key numbers, "
+    "sql, findings, file paths and decisions. Leave out raw data dumps and code unless it is needed later. "
+    "Answer with the updated summary only."
+)
+
+_summaries: OrderedDict[str, str] = OrderedDict()
+_summaries_lock = threading.Lock()
+_MAX_SUMMARIES = 1024
+
+
+def _truncate_tool_result(message: BaseMessage) -> BaseMessage:
+    if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+        return message
+    if len(message.content) <= TOOL_RESULT_MAX_CHARS:
+        return message
+    truncated = len(message.content) - TOOL_RESULT_MAX_CHARS
+    content = f"{message.content[:TOOL_RESULT_MAX_CHARS]}... [{truncated} characters of an earlier tool result removed]"
+    return message.model_copy(update={"content": content})
+
+
+def _transcript(messages: Sequence[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        speaker = f"{message.type} ({message.name})" if message.name else message.type
+        lines.append(f"{speaker}: {message.content}")
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            lines.append(f"{speaker} calls {tool_call['name']}: {tool_call['args']}")
+    return "\n".join(lines)
+
+
+def summarize(messages: Sequence[BaseMessage]) -> str:
+    """Summary of the messages, extending the cached summary of their longest already summarized prefix.
+
+    Messages are immutable and have unique ids in the graph state, so a summary is cached under the id of the last
+    message it covers and the supervisor and the agents share them.
+    """
+    base, start = "", 0
+    with _summaries_lock:
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].id is not None and messages[i].id in _summaries:
+                base, start = _summaries[messages[i].id], i + 1
+                _summaries.move_to_end(messages[i].id)
+                break
+    if start == len(messages):
+        return base
+
+    request = [
+        SystemMessage(SUMMARY_PROMPT),
+        HumanMessage(f"Current summary:\n{base or '(empty)'}\n\nNew messages:\n{_transcript(messages[start:])}"),
+    ]
+    # no callbacks, the summary is not part of the answer streamed to the user
+    with span("history.summarize", messages=len(messages) - start):
+        summary = get_llm().invoke(request, config={"callbacks": []}).content
+    if messages[-1].id is not None:
+        with _summaries_lock:
+            _summaries[messages[-1].id] = summary
+            while len(_summaries) > _MAX_SUMMARIES:
+                _summaries.popitem(last=False)
+    return summary
+
+
+def compact_history(system_prompt: SystemMessage, messages: Sequence[BaseMessage],
+                    budget: int = None) -> list[BaseMessage]:
+    """The system prompt and the conversation fitted into the token budget.
+
+    The current turn (from the last user message on) is always sent verbatim. Tool results of earlier turns are
+    truncated, and when the conversation is still over budget the oldest turns are replaced by their summary,
+    appended to the system prompt, while as many recent turns as fit are kept verbatim.
+    """
+    messages = list(messages)
+    if not HISTORY_ENABLED:
+        return [system_prompt] + messages
+    budget = budget or TOKEN_BUDGET
+
+    turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)] or [0]
+    current = turn_starts[-1]
+    messages = [_truncate_tool_result(m) if i < current else m for i, m in enumerate(messages)]
+    if count_tokens_approximately([system_prompt] + messages) <= budget:
+        return [system_prompt] + messages
+
+    # turns are only cut at user messages, so a tool call is never separated from its result
+    recent_budget = budget - SUMMARY_TOKENS - count_tokens_approximately([system_prompt])
+    split = current
+    for start in reversed(turn_starts[:-1]):
+        if count_tokens_approximately(messages[start:]) > recent_budget:
+            break
+        split = start
+    if split == 0:
+        return [system_prompt] + messages
+
+    summary = summarize(messages[:split])
+    return [SystemMessage(f"{system_prompt.content}\n\nSummary of the earlier conversation:\n{summary}")] + messages[split:]
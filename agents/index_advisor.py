@@ -0,0 +1,230 @@
+"""Workload-driven index advisor for the SQLite database.
+
+The data analyst logs every query it executes with its latency. The advisor turns the logged workload into
+index candidates (equality filters and joins first, then one range filter, then group by columns, widened into
+a covering index when small), keeps the candidates that EXPLAIN QUERY PLAN actually picks up, and optionally
+creates them and reports the latency before and after.
+
+Usage:
+    python -m agents.index_advisor            # propose indexes
+    python -m agents.index_advisor --apply    # create them and measure the latency of the logged queries
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+
+from agents.cache.result_cache import canonicalize_sql
+from agents.db import get_database_name
+from agents.sql_analysis import analyze_query
+
+MAX_INDEX_COLUMNS = 6
+
+
+class QueryLog:
+    """Log of executed sql and its latency, stored in SQLite, keeping the latest `max_rows` queries"""
+
+    def __init__(self, path: str, max_rows: int = 100_000):
+        self.max_rows = max_rows
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_log (sql TEXT, canonical_sql TEXT, elapsed_ms REAL, rows INTEGER, "
+            "executed_at TEXT DEFAULT (datetime('now')))"
+        )
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, elapsed_ms: float, rows: int):
+        with self._lock:
+            rowid = self._conn.execute(
+                "INSERT INTO query_log (sql, canonical_sql, elapsed_ms, rows) VALUES (?, ?, ?, ?)",
+                (sql, canonicalize_sql(sql), elapsed_ms, rows),
+            ).lastrowid
+            # rowids only grow, a range delete on the primary key
+            self._conn.execute("DELETE FROM query_log WHERE rowid <= ?", (rowid - self.max_rows,))
+
+    def workload(self, min_calls: int = 1) -> list[dict]:
+        """Distinct queries with their call count and latency, most expensive in total first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT min(sql), count(*), avg(elapsed_ms), sum(elapsed_ms) FROM query_log "
+                "GROUP BY canonical_sql HAVING count(*) >= ? ORDER BY sum(elapsed_ms) DESC",
+                (min_calls,),
+            ).fetchall()
+        return [{"sql": r[0], "calls": r[1], "avg_ms": r[2], "total_ms": r[3]} for r in rows]
+
+
+_query_log = None
+_query_log_lock = threading.Lock()
+
+
+def get_query_log() -> QueryLog:
+    global _query_log
+    with _query_log_lock:
+        if _query_log is None:
+            _query_log = QueryLog(
+                os.getenv("QUERY_LOG_PATH", "cache/query_log.db"),
+                max_rows=int(os.getenv("QUERY_LOG_MAX_ROWS", "100000")),
+            )
+    return _query_log
+
+
+@dataclass
+class IndexCandidate:
+    table: str
+    columns: tuple[str, ...]
+    queries: list[dict] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return f"idx_auto_{self.table}_{'_'.join(self.columns)}"
+
+    @property
+    def ddl(self) -> str:
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        return f'CREATE INDEX IF NOT EXISTS "{self.name}" ON "{self.table}" ({columns})'
+
+    @property
+    def weight(self) -> float:
+        return sum(q["total_ms"] for q in self.queries)
+
+
+class IndexAdvisor:
+    def __init__(self, db_name: str, query_log: QueryLog):
+        self.db_name = db_name
+        self.query_log = query_log
+        self.conn = sqlite3.connect(db_name, isolation_level=None)
+        self.table_columns = self._table_columns()
+
+    def _table_columns(self) -> dict[str, set[str]]:
+        tables = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        return {
+            t.lower(): {row[1].lower() for row in self.conn.execute(f'PRAGMA table_xinfo("{t}")')}
+            for (t,) in tables
+        }
+
+    def _existing_indexes(self, table: str) -> list[tuple[str, ...]]:
+        indexes = []
+        for index in self.conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            columns = self.conn.execute(f'PRAGMA index_xinfo("{index[1]}")').fetchall()
+            indexes.append(tuple(c[2].lower() for c in columns if c[5] and c[2] is not None))
+        return indexes
+
+    def plan(self, sql: str) -> str:
+        return "\n".join(row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+
+    def candidates(self, min_calls: int = 1) -> list[IndexCandidate]:
+        """One candidate per table and query shape, skipping those already covered by an existing index"""
+        candidates = {}
+        for query in self.query_log.workload(min_calls):
+            shape = analyze_query(query["sql"], self.table_columns)
+            for table in set(shape.tables.values()):
+                leading = shape.equality.get(table, []) + [c for c in shape.join.get(table, [])
+                                                           if c not in shape.equality.get(table, [])]
+                columns = list(leading)
+                if shape.range.get(table):
+                    columns.append(shape.range[table][0])
+                columns.extend(c for c in shape.group_by.get(table, []) if c not in columns)
+                if not columns:
+                    continue
+                # widen into a covering index when it stays small, so the table itself is never read
+                remaining = [c for c in shape.columns(table) if c not in columns]
+                if len(columns) + len(remaining) <= MAX_INDEX_COLUMNS:
+                    columns.extend(remaining)
+                key = (table, tuple(columns))
+                if any(index[:len(columns)] == key[1] for index in self._existing_indexes(table)):
+                    continue
+                candidates.setdefault(key, IndexCandidate(table, key[1])).queries.append(query)
+        return sorted(candidates.values(), key=lambda c: c.weight, reverse=True)
+
+    def evaluate(self, candidate: IndexCandidate) -> list[dict]:
+        """Create the index in a transaction that is rolled back, return the queries whose plan picks it up"""
+        before = {q["sql"]: self.plan(q["sql"]) for q in candidate.queries}
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(candidate.ddl)
+            after = {q["sql"]: self.plan(q["sql"]) for q in candidate.queries}
+        finally:
+            self.conn.execute("ROLLBACK")
+        return [
+            {**q, "plan_before": before[q["sql"]], "plan_after": after[q["sql"]]}
+            for q in candidate.queries if candidate.name in after[q["sql"]]
+        ]
+
+    def _latency_ms(self, sql: str, repeat: int = 3) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.conn.execute(sql).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def advise(self, apply: bool = False, min_calls: int = 1, max_indexes: int = 5) -> list[dict]:
+        """Propose (and with apply=True create) the indexes that most of the logged latency would benefit from"""
+        report = []
+        for candidate in self.candidates(min_calls):
+            if len(report) >= max_indexes:
+                break
+            improved = self.evaluate(candidate)
+            if not improved:
+                continue
+            recommendation = {"table": candidate.table, "ddl": candidate.ddl, "queries": improved}
+            if apply:
+                for query in improved:
+                    query["before_ms"] = self._latency_ms(query["sql"])
+                self.conn.execute(candidate.ddl)
+                for query in improved:
+                    query["after_ms"] = self._latency_ms(query["sql"])
+                # the planner picked the index up but it did not pay off, e.g. a filter that is not selective
+                recommendation["applied"] = (sum(q["after_ms"] for q in improved)
+                                             < sum(q["before_ms"] for q in improved))
+                if not recommendation["applied"]:
+                    self.conn.execute(f'DROP INDEX "{candidate.name}"')
+            report.append(recommendation)
+        if any(r.get("applied") for r in report):
+            self.conn.execute("PRAGMA optimize")
+        return report
+
+
+def _print_report(report: list[dict]):
+    if not report:
+        print("No index would improve the logged queries.")
+    for recommendation in report:
+        if "applied" not in recommendation:
+            action = "Proposed"
+        else:
+            action = "Created" if recommendation["applied"] else "Dropped, no faster"
+        print(f"{action}: {recommendation['ddl']}")
+        for query in recommendation["queries"]:
+            latency = f"{query['avg_ms']:.1f}ms avg over {query['calls']} calls"
+            if "after_ms" in query:
+                latency = f"{query['before_ms']:.1f}ms -> {query['after_ms']:.1f}ms"
+            print(f"  {latency}: {' '.join(query['sql'].split())[:120]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose or create indexes for the logged query workload")
+    parser.add_argument("--apply", action="store_true", help="create the proposed indexes")
+    parser.add_argument("--min-calls", type=int, default=1, help="ignore queries logged fewer times")
+    parser.add_argument("--max-indexes", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    advisor = IndexAdvisor(get_database_name(), get_query_log())
+    report = advisor.advise(apply=args.apply, min_calls=args.min_calls, max_indexes=args.max_indexes)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,6 @@ load_dotenv(dotenv_path)
 
 def _build_azure_openai() -> AzureChatOpenAI:
     """Initialize the Azure OpenAI chat model"""
-    print("Initializing LLM: AzureChatOpenAI")
-
     if (azure_openai_deployment_id := os.getenv("AZURE_OPENAI_DEPLOYMENT_ID")) is None:
         raise ValueError("AZURE_OPENAI_DEPLOYMENT_ID is not set")
 
@@ -19,6 +17,7 @@ def _build_azure_openai() -> AzureChatOpenAI:
         # model details used for tracing and token counting
         model=os.getenv("MODEL_NAME"),
         model_version=os.getenv("OPENAI_API_VERSION"),
+        temperature=float(temperature) if (temperature := os.getenv("LLM_TEMPERATURE")) else None,
     )
 
 
@@ -10,13 +10,12 @@ load_dotenv(dotenv_path)
 
 def _build_deepseek() -> ChatDeepSeek:
     """Initialize the DeepSeek chat model"""
-    print("Initializing LLM: ChatDeepSeek")
-
     if (DEEPSEEK_API_KEY := os.getenv("DEEPSEEK_API_KEY")) is None:
         raise ValueError("DEEPSEEK_API_KEY is not set")
 
     return ChatDeepSeek(
         model=os.getenv("MODEL_NAME"),
+        temperature=float(temperature) if (temperature := os.getenv("LLM_TEMPERATURE")) else None,
         model_kwargs={"parallel_tool_calls": False}
     )
 
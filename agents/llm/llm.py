@@ -1,14 +1,16 @@
 import os
+import threading
 
 from langchain_core.language_models import BaseChatModel
 
+from agents.llm.cache import get_llm_cache
 from agents.llm.azure_openai import _build_azure_openai, get_azure_openai_client
 from agents.llm.deepseek import _build_deepseek, get_deepseek_client
 from agents.llm.mistral import get_mistral_client, _build_mistral
+from agents.tracing import span
 
 
-def build_llm() -> BaseChatModel:
-    """langchain llm object"""
+def _build_provider_llm() -> BaseChatModel:
     llm_type = os.getenv("LLM_TYPE")
     if llm_type == "azure_openai":
         return _build_azure_openai()
@@ -19,6 +21,31 @@ def build_llm() -> BaseChatModel:
     raise ValueError(f"Unknown LLM type: {llm_type}. Only 'azure_openai' and 'deepseek' are currently supported.")
 
 
+def build_llm() -> BaseChatModel:
+    """langchain llm object, with the persistent response cache when enabled and the model is deterministic"""
+    with span("llm.build", provider=os.getenv("LLM_TYPE"), model=os.getenv("MODEL_NAME")):
+        llm = _build_provider_llm()
+    if os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true":
+        if getattr(llm, "temperature", None) == 0:
+            llm.cache = get_llm_cache()
+        else:
+            print("LLM cache is enabled but only applies with LLM_TEMPERATURE=0, responses are not cached")
+    return llm
+
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm() -> BaseChatModel:
+    """langchain llm object shared by the supervisor and all agents, built on first use"""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = build_llm()
+    return _llm
+
+
 def get_llm_client():
     """Set up llm client for vanna.ai"""
     llm_type = os.getenv("LLM_TYPE")
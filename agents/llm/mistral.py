@@ -9,15 +9,13 @@ load_dotenv(dotenv_path)
 
 def _build_mistral() -> ChatMistralAI:
     """Initialize the Mistral chat model"""
-    print("Initializing LLM: Mistral")
-
     api_key = os.getenv("MISTRAL_API_KEY")
     if api_key is None:
         raise ValueError("MISTRAL_API_KEY is not set")
 
     return ChatMistralAI(
         model=os.getenv("MODEL_NAME"),
-        temperature=0,
+        temperature=float(temperature) if (temperature := os.getenv("LLM_TEMPERATURE")) else 0,
     )
 
 
@@ -0,0 +1,237 @@
+"""Registry of fitted models, reachable from the python workers as `models`.
+
+Generated code fits a model through the registry instead of directly: the model is keyed on the query of its
+training data, the model spec, the code of the fit function and the data version, stored with joblib, and loaded
+with its arrays memory-mapped the next time the same model is asked for, e.g. by a follow-up "predict for next
+quarter". `lookup` finds the latest model by name or target without knowing how it was fitted.
+
+Usage:
+    python -m agents.model_registry            # list the registered models
+    python -m agents.model_registry --clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Callable, Optional, Sequence
+
+import joblib
+import pandas as pd
+
+from agents.cache.result_cache import canonicalize_sql, database_version
+from agents.db import get_database_name, get_pool
+
+
+def estimator_spec(estimator: Any) -> str:
+    """Class and parameters of an unfitted estimator, the same model always gives the same text"""
+    params = estimator.get_params(deep=True) if hasattr(estimator, "get_params") else {}
+    cls = type(estimator)
+    return json.dumps({"class": f"{cls.__module__}.{cls.__qualname__}", "params": params}, sort_keys=True,
+                      default=repr)
+
+
+def fit_fingerprint(fit: Callable) -> str:
+    """Hash of the bytecode, constants and names of the fit function and the values it closes over.
+
+    Globals it reads are only part of it by name, a fit depending on their values has to describe them in the spec.
+    """
+    parts = []
+
+    def add_code(code: types.CodeType):
+        parts.extend((code.co_code.hex(), repr(code.co_names), repr(code.co_freevars)))
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                add_code(const)
+            else:
+                parts.append(repr(const))
+
+    code = getattr(fit, "__code__", None)
+    if code is None:
+        # e.g. functools.partial or a callable object
+        parts.append(repr(fit))
+    else:
+        add_code(code)
+        for cell in fit.__closure__ or ():
+            try:
+                parts.append(repr(cell.cell_contents))
+            except ValueError:
+                # a cell not assigned yet
+                parts.append("<empty>")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+class ModelRegistry:
+    """Fitted models stored as joblib files in `root` with an SQLite index, shared by all worker processes.
+
+    Refitting a model at a new data version replaces the one of the older version, and the least recently used
+    models are removed once the files exceed `max_bytes`.
+    """
+
+    def __init__(self, root: str, db_name: str, max_bytes: int = 1024 * 1024 * 1024):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.db_name = db_name
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(os.path.join(root, "registry.db"), check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS models (key TEXT PRIMARY KEY, name TEXT, query TEXT, spec TEXT, "
+            "features TEXT, target TEXT, data_version TEXT, rows INTEGER, bytes INTEGER, fit_seconds REAL, "
+            "created_at REAL, used_at REAL, fit TEXT)"
+        )
+        if "fit" not in {row[1] for row in self._conn.execute("PRAGMA table_info(models)")}:
+            # registries created before the fit function was part of the key
+            self._conn.execute("ALTER TABLE models ADD COLUMN fit TEXT")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str, spec: str, fit: str, version: str) -> str:
+        return hashlib.sha256(f"{canonicalize_sql(query)}\n{spec}\n{fit}\n{version}".encode()).hexdigest()[:24]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.joblib")
+
+    def _load(self, key: str) -> Optional[Any]:
+        try:
+            # uncompressed numpy arrays are memory-mapped instead of read
+            model = joblib.load(self._path(key), mmap_mode="r")
+        except FileNotFoundError:
+            with self._lock:
+                self._conn.execute("DELETE FROM models WHERE key = ?", (key,))
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE models SET used_at = ? WHERE key = ?", (time.time(), key))
+        return model
+
+    def _save(self, key: str, model: Any, name: str, query: str, spec: str, fit: str, features: Sequence[str],
+              target: Optional[str], version: str, rows: int, fit_seconds: float):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, self._path(key))
+        now = time.time()
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT key FROM models WHERE query = ? AND spec = ? AND fit IS ? AND key != ?",
+                (canonicalize_sql(query), spec, fit, key),
+            )]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO models (key, name, query, spec, fit, features, target, data_version, rows, "
+                "bytes, fit_seconds, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, name, canonicalize_sql(query), spec, fit, json.dumps(list(features)), target, version, rows,
+                 os.path.getsize(self._path(key)), fit_seconds, now, now),
+            )
+            total = 0
+            for row_key, size in self._conn.execute("SELECT key, bytes FROM models ORDER BY used_at DESC").fetchall():
+                total += size
+                if total > self.max_bytes and row_key != key:
+                    stale.append(row_key)
+            for stale_key in stale:
+                self._conn.execute("DELETE FROM models WHERE key = ?", (stale_key,))
+                try:
+                    os.remove(self._path(stale_key))
+                except FileNotFoundError:
+                    pass
+
+    def get_or_fit(self, query: str, spec: str, fit: Callable[[pd.DataFrame], Any], name: str = None,
+                   features: Sequence[str] = (), target: str = None) -> Any:
+        """The model fitted by `fit` on the result of `query`, fitted only if not registered at this data version.
+
+        `spec` describes the model, e.g. "ExponentialSmoothing(trend='add', seasonal=12)", fit gets the query
+        result and returns the fitted model. Different fit functions, e.g. other preprocessing, give different
+        models for the same spec.
+        """
+        version, fingerprint = database_version(self.db_name), fit_fingerprint(fit)
+        key = self._key(query, spec, fingerprint, version)
+        model = self._load(key)
+        if model is not None:
+            return model
+        df = get_pool(self.db_name).run_sql(query)
+        start = time.perf_counter()
+        model = fit(df)
+        self._save(key, model, name or spec, query, spec, fingerprint, features, target, version, len(df),
+                   time.perf_counter() - start)
+        return model
+
+    def fit(self, estimator: Any, query: str, features: Sequence[str], target: str, name: str = None) -> Any:
+        """An sklearn style estimator fitted on the feature and target columns of the query result"""
+        features = list(features)
+
+        def fit_estimator(df: pd.DataFrame) -> Any:
+            return estimator.fit(df[features], df[target])
+
+        return self.get_or_fit(query, estimator_spec(estimator), fit_estimator, name=name or type(estimator).__name__,
+                               features=features, target=target)
+
+    def lookup(self, name: str = None, target: str = None, query: str = None) -> Optional[Any]:
+        """The most recently used model of the current data version matching every given criterion, or None"""
+        clauses, params = ["data_version = ?"], [database_version(self.db_name)]
+        for column, value in (("name", name), ("target", target), ("query", query and canonicalize_sql(query))):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT key FROM models WHERE {' AND '.join(clauses)} ORDER BY used_at DESC LIMIT 1", params
+            ).fetchone()
+        return self._load(row[0]) if row else None
+
+    def list(self) -> pd.DataFrame:
+        """Registered models, most recently used first"""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT name, target, features, query, rows, fit_seconds, data_version, "
+                "datetime(used_at, 'unixepoch') AS used_at FROM models ORDER BY models.used_at DESC",
+                self._conn,
+            )
+
+    def clear(self):
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM models")]
+            self._conn.execute("DELETE FROM models")
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+_registries: dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(db_name: str = None) -> ModelRegistry:
+    """Process wide registry of the models trained on the database"""
+    db_name = db_name or get_database_name()
+    with _registries_lock:
+        if db_name not in _registries:
+            _registries[db_name] = ModelRegistry(
+                os.getenv("MODEL_REGISTRY_DIR", "cache/models"),
+                db_name,
+                max_bytes=int(os.getenv("MODEL_REGISTRY_MAX_MB", "1024")) * 1024 * 1024,
+            )
+    return _registries[db_name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or clear the fitted models of the coder")
+    parser.add_argument("--clear", action="store_true", help="remove every registered model")
+    args = parser.parse_args()
+
+    registry = get_model_registry()
+    if args.clear:
+        registry.clear()
+        print("Model registry cleared")
+        return
+    models = registry.list()
+    print(models.to_string(index=False) if len(models) else "No models registered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Planning step in front of the supervisor for requests with several parts.
+
+The planner asks the model for a dependency graph of steps, one agent each, and runs every step as soon as the
+steps it depends on are done, so independent parts (e.g. the top categories and a sales forecast) run at the same
+time and the request takes about as long as its longest chain of dependent steps. The results are added to the
+conversation in plan order, whatever order the steps finished in, and the supervisor writes the final answer
+from them. Requests that look like a single question, or that the model does not break down into several steps,
+go to the supervisor as before.
+"""
+import contextvars
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional, Sequence
+
+from langchain_core.callbacks import dispatch_custom_event
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import START, StateGraph
+from pydantic import BaseModel, Field
+
+from agents.history import compact_history
+from agents.llm.llm import get_llm
+from agents.router import KEYWORD_RULES, MULTI_STEP, SUPERVISOR
+from agents.tracing import span
+
+PLANNER_NODE = "planner"
+
+AGENT_DESCRIPTIONS = {
+    "data_analyst_agent": "answers questions about the data with sql and makes charts",
+    "coder_agent": "machine learning, statistics and other python code",
+    "slides_generator_agent": "creates powerpoint slides, from the results of other steps",
+}
+
+# agents running code in the python namespace of the conversation
+REPL_AGENTS = {"coder_agent", "slides_generator_agent"}
+
+PLANNER_PROMPT = (
+    "You plan how a team of agents carries out the user's latest request. The agents:\n{agents}\n"
+    "Break the request down into steps, one agent per step, as few steps as possible. Each instruction must be "
+    "self-contained, with the periods, names and numbers from the conversation it needs. A step depends on another "
+    "only if it needs that step's result, e.g. slides on the numbers they present. Steps that do not depend on "
+    "each other run at the same time."
+)
+
+
+class Step(BaseModel):
+    """One step of the plan, carried out by one agent"""
+    id: int = Field(description="Step number, starting at 1")
+    agent: str = Field(description="Name of the agent carrying out the step")
+    instruction: str = Field(description="Self-contained instruction for the agent")
+    depends_on: list[int] = Field(default_factory=list, description="Numbers of the steps whose results it needs")
+
+
+class Plan(BaseModel):
+    """Steps carrying out the request and their dependencies"""
+    steps: list[Step] = Field(description="The steps, in the order they are listed to the user")
+
+
+def looks_compound(question: str) -> bool:
+    """Whether the request names the work of several agents, the only ones worth a planning call"""
+    question = question.lower()
+    agents = [agent for agent, rule in KEYWORD_RULES.items() if rule.search(question)]
+    return len(agents) >= 2 and (MULTI_STEP.search(question) is not None or " and " in question or "," in question)
+
+
+def order_steps(plan: Plan, agents: Sequence[str], max_steps: int) -> Optional[list[Step]]:
+    """The steps in dependency order, ties by step number, or None when the plan is not a valid DAG"""
+    steps = {step.id: step for step in plan.steps}
+    if len(steps) != len(plan.steps) or not 2 <= len(steps) <= max_steps:
+        return None
+    if any(step.agent not in agents or not set(step.depends_on) <= steps.keys() - {step.id} for step in plan.steps):
+        return None
+    ordered, done = [], set()
+    while len(ordered) < len(steps):
+        ready = sorted(i for i, step in steps.items() if i not in done and set(step.depends_on) <= done)
+        if not ready:
+            # a cycle
+            return None
+        ordered.extend(steps[i] for i in ready)
+        done.update(ready)
+    return ordered
+
+
+def _instruction(step: Step, results: dict[int, str]) -> str:
+    if not step.depends_on:
+        return step.instruction
+    inputs = "\n\n".join(f"Result of step {i}:\n{results[i]}" for i in sorted(step.depends_on))
+    return f"{step.instruction}\n\n{inputs}"
+
+
+def execute_plan(steps: list[Step], agents: dict, history: Sequence[BaseMessage], config: RunnableConfig,
+                 max_parallel: int = 4) -> dict[int, list[BaseMessage]]:
+    """Run every step once its dependencies are done, return the messages each step added by step number.
+
+    An agent sees the conversation and its instruction, with the results of the steps it depends on. A step whose
+    dependency failed is not run. Steps of the agents in REPL_AGENTS run one after another: they share the python
+    namespace of the conversation, and concurrent steps would overwrite each other's variables.
+    """
+    results: dict[int, str] = {}
+    outputs: dict[int, list[BaseMessage]] = {}
+    failed = set()
+
+    def run_step(step: Step, instruction: str) -> list[BaseMessage]:
+        messages = list(history) + [HumanMessage(instruction)]
+        with span("planner.step", step=step.id, agent=step.agent, depends_on=str(step.depends_on)):
+            output = agents[step.agent].invoke({"messages": messages}, config)
+        # named after the agent, as in the supervisor's own hand-offs, so the supervisor knows who answered
+        return [m.model_copy(update={"name": step.agent}) if isinstance(m, AIMessage) else m
+                for m in output["messages"][len(messages):]]
+
+    pending = list(steps)
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="plan") as pool:
+        running = {}
+        while pending or running:
+            for step in [s for s in pending if set(s.depends_on) <= results.keys()]:
+                if failed & set(step.depends_on):
+                    pending.remove(step)
+                    failed.add(step.id)
+                    results[step.id] = "Not carried out, a step it depends on failed."
+                    outputs[step.id] = [AIMessage(f"Step {step.id} skipped: {results[step.id]}", name=step.agent)]
+                    continue
+                if step.agent in REPL_AGENTS and any(s.agent in REPL_AGENTS for s in running.values()):
+                    # started once the step using the namespace is done
+                    continue
+                pending.remove(step)
+                # copy the context so tracing and callbacks of the planner follow the step into the thread
+                context = contextvars.copy_context()
+                running[pool.submit(context.run, run_step, step, _instruction(step, results))] = step
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    outputs[step.id] = future.result()
+                    last = outputs[step.id][-1] if outputs[step.id] else None
+                    results[step.id] = last.content if isinstance(last, AIMessage) else ""
+                except Exception as e:
+                    failed.add(step.id)
+                    results[step.id] = f"Failed. Error: {repr(e)}"
+                    outputs[step.id] = [AIMessage(f"Step {step.id} failed. Error: {repr(e)}", name=step.agent)]
+    return outputs
+
+
+def add_planner(workflow: StateGraph, agents: Sequence, supervisor_name: str = SUPERVISOR):
+    """Put the planner between the start and the supervisor of the workflow built by create_supervisor"""
+    # the steps run the agents outside the graph's checkpoints, several of them at once
+    agents_by_name = {agent.name: agent.copy({"checkpointer": False}) for agent in agents}
+    descriptions = "\n".join(f"- {name}: {AGENT_DESCRIPTIONS.get(name, name)}" for name in agents_by_name)
+    system_prompt = SystemMessage(PLANNER_PROMPT.format(agents=descriptions))
+    max_steps = int(os.getenv("PLANNER_MAX_STEPS", "6"))
+    max_parallel = int(os.getenv("PLANNER_MAX_PARALLEL", "4"))
+    planner_model = None
+
+    def plan(state: dict, config: RunnableConfig) -> dict:
+        nonlocal planner_model
+        messages = state["messages"]
+        question = messages[-1].content if messages and isinstance(messages[-1], HumanMessage) else None
+        if not isinstance(question, str) or not looks_compound(question):
+            return {}
+        if planner_model is None:
+            planner_model = get_llm().with_structured_output(Plan)
+        with span("planner.plan") as s:
+            try:
+                steps = order_steps(planner_model.invoke(compact_history(system_prompt, messages), config),
+                                    list(agents_by_name), max_steps)
+            except Exception as e:
+                # the supervisor coordinates the request step by step instead
+                s.set(error=repr(e))
+                return {}
+            s.set(steps=len(steps) if steps else 0)
+        if steps is None:
+            return {}
+
+        listing = "\n".join(
+            f"{step.id}. [{step.agent}] {step.instruction}"
+            + (f" (after step {', '.join(map(str, step.depends_on))})" if step.depends_on else "")
+            for step in steps
+        )
+        # lets the ui show the plan while its steps run
+        dispatch_custom_event("plan", {"steps": listing})
+        outputs = execute_plan(steps, agents_by_name, messages, config, max_parallel=max_parallel)
+        plan_message = AIMessage(
+            f"I broke the request down into this plan, the steps are done and their results follow:\n{listing}",
+            name=supervisor_name,
+        )
+        return {"messages": [plan_message] + [message for step in steps for message in outputs[step.id]]}
+
+    workflow.edges.discard((START, supervisor_name))
+    workflow.add_node(PLANNER_NODE, plan)
+    workflow.add_edge(START, PLANNER_NODE)
+    workflow.add_edge(PLANNER_NODE, supervisor_name)
@@ -0,0 +1,198 @@
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+from contextlib import redirect_stdout
+from io import StringIO
+
+try:
+    import resource
+except ImportError:  # not available on windows, memory limits are not enforced there
+    resource = None
+
+from langchain_experimental.utilities import PythonREPL
+
+from agents.artifacts import get_artifact_store
+from agents.db import get_database_name, get_pool
+from agents.model_registry import get_model_registry
+from agents.tracing import span
+
+# heavy libraries the generated code usually needs, imported once in the fork server
+PRELOAD_MODULES = ["pandas", "numpy", "pyarrow.feather", "sklearn.linear_model", "statsmodels.api", "pptx", "plotly.graph_objects"]
+
+
+def _new_namespace(db_name: str) -> dict:
+    # query results and figures of the other agents, loaded by handle with a memory-mapped read
+    namespace = {"__name__": "__main__", "load_artifact": get_artifact_store().load}
+    if os.path.exists(db_name):
+        namespace["db"] = get_pool(db_name)
+        # fitted models outlive the run, follow-up questions reuse them
+        namespace["models"] = get_model_registry(db_name)
+    return namespace
+
+
+def _worker_main(conn, db_name: str, memory_limit_mb: int):
+    """Loop of a worker process: execute (namespace_id, code) requests, reply with (output, fatal, ok)"""
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    namespaces = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        namespace_id, code = request
+        namespace = namespaces.get(namespace_id)
+        if namespace is None:
+            namespace = namespaces[namespace_id] = _new_namespace(db_name)
+        stdout = StringIO()
+        try:
+            with redirect_stdout(stdout):
+                exec(PythonREPL.sanitize_input(code), namespace)
+            conn.send((stdout.getvalue(), False, True))
+        except MemoryError as e:
+            # the interpreter state is unreliable after running out of memory, ask to be recycled
+            conn.send((repr(e), True, False))
+            break
+        except BaseException as e:
+            conn.send((repr(e), False, False))
+
+
+class _Worker:
+    def __init__(self, context, db_name: str, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, db_name, memory_limit_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    def run(self, namespace_id: str, code: str, timeout: float) -> tuple[str, bool, bool]:
+        self.conn.send((namespace_id, code))
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ReplPool:
+    """Pool of warm worker processes executing python code.
+
+    Each namespace (one per conversation thread) sticks to one worker, so its variables survive between runs
+    while different conversations run in parallel on different workers. A run that exceeds the wall-clock
+    timeout kills its worker, and workers are recycled after `max_runs` runs, which also resets the
+    namespaces they hold.
+    """
+
+    def __init__(
+            self,
+            db_name: str,
+            size: int = 2,
+            timeout: float = 300,
+            memory_limit_mb: int = 4096,
+            max_runs: int = 50,
+    ):
+        if sys.platform == "win32":
+            self._context = multiprocessing.get_context("spawn")
+        else:
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(PRELOAD_MODULES)
+        self.db_name = db_name
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_runs = max_runs
+        self._workers = [self._start_worker() for _ in range(size)]
+        self._worker_locks = [threading.Lock() for _ in range(size)]
+        self._assignments: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(self._context, self.db_name, self.memory_limit_mb)
+
+    def _assign(self, namespace_id: str) -> int:
+        with self._lock:
+            if namespace_id not in self._assignments:
+                load = [0] * len(self._workers)
+                for index in self._assignments.values():
+                    load[index] += 1
+                self._assignments[namespace_id] = load.index(min(load))
+            return self._assignments[namespace_id]
+
+    def _recycle(self, index: int):
+        """Replace the worker, forgetting the namespaces it held"""
+        self._workers[index].stop()
+        self._workers[index] = self._start_worker()
+        with self._lock:
+            self._assignments = {k: v for k, v in self._assignments.items() if v != index}
+
+    def run(self, code: str, namespace_id: str = "default") -> str:
+        """Run code in the namespace, return anything printed or the repr of the raised exception"""
+        return self.execute(code, namespace_id)[0]
+
+    def execute(self, code: str, namespace_id: str = "default") -> tuple[str, bool]:
+        """Like run, also return whether the code ran to completion"""
+        index = self._assign(namespace_id)
+        with span("repl.run", namespace=namespace_id, worker=index, code=code) as s, self._worker_locks[index]:
+            worker = self._workers[index]
+            try:
+                output, fatal, ok = worker.run(namespace_id, code, self.timeout)
+            except TimeoutError:
+                self._recycle(index)
+                s.set(outcome="timeout")
+                return f"Execution timed out after {self.timeout} seconds", False
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                self._recycle(index)
+                s.set(outcome="worker_exited")
+                return "Execution failed, the python process exited (out of memory?)", False
+            worker.runs += 1
+            if fatal or worker.runs >= self.max_runs:
+                self._recycle(index)
+            s.set(outcome="fatal" if fatal else "ok" if ok else "error", output_chars=len(output), output=output)
+            return output, ok
+
+    def close(self):
+        for index, worker in enumerate(self._workers):
+            with self._worker_locks[index]:
+                worker.stop()
+
+
+_repl_pool = None
+_repl_pool_lock = threading.Lock()
+
+
+def get_repl_pool() -> ReplPool:
+    """Process wide pool of python workers, started on first use"""
+    global _repl_pool
+    with _repl_pool_lock:
+        if _repl_pool is None:
+            _repl_pool = ReplPool(
+                get_database_name(),
+                size=int(os.getenv("REPL_POOL_SIZE", str(min(4, os.cpu_count() or 1)))),
+                timeout=float(os.getenv("REPL_TIMEOUT_SECONDS", "300")),
+                memory_limit_mb=int(os.getenv("REPL_MEMORY_LIMIT_MB", "4096")),
+                max_runs=int(os.getenv("REPL_MAX_RUNS", "50")),
+            )
+    return _repl_pool
@@ -0,0 +1,262 @@
+"""Fast path in front of the supervisor.
+
+A request that clearly belongs to one agent is sent straight to it, saving the supervisor's hand-off call and
+its final answer call. The router classifies the request with a nearest neighbour vote over the embeddings of
+past supervisor decisions, and with keyword rules for the first request of a conversation while there are too few
+of them. Anything it is not confident about, e.g. requests for several agents or follow-ups the logged decisions
+do not cover, goes to the supervisor as before.
+
+The supervisor's decisions are the training data: when a turn starts, the turn before it is logged with the
+agent the supervisor handed it to, or "supervisor" when it needed none or several agents.
+
+Usage:
+    python -m agents.router "What are the total sales generated in this fy?"
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import dispatch_custom_event
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Command
+from langgraph_supervisor.handoff import METADATA_KEY_IS_HANDOFF_BACK
+
+from agents.tracing import span
+
+SUPERVISOR = "supervisor"
+ROUTER_NODE = "router"
+FAST_PATH_END_NODE = "fast_path_end"
+
+# requests naming what only one agent does, used until there are enough logged decisions. Words of any question,
+# e.g. what or which, are left out: "which one was better?" is a follow-up the supervisor answers from the history
+KEYWORD_RULES = {
+    "data_analyst_agent": re.compile(
+        r"\b(how (many|much)|total|average|sum|count|plot|chart|graph|visuali[sz]e|trend|distribution|"
+        r"breakdown)\b"
+    ),
+    "coder_agent": re.compile(
+        r"\b(regression|predict\w*|forecast\w*|machine learning|model|train|classif\w*|cluster\w*|python|script|"
+        r"statistic\w*|correlation)\b"
+    ),
+    "slides_generator_agent": re.compile(r"\b(slides?|ppt|pptx|powerpoint|presentation|deck)\b"),
+}
+# several steps in one request are coordinated by the supervisor
+MULTI_STEP = re.compile(r"\b(and then|then|finally|after that|afterwards|also)\b|\?.*\?")
+
+
+@dataclass
+class Route:
+    destination: str
+    confidence: float
+    source: str
+
+
+class RoutingLog:
+    """Past supervisor decisions with the embedding of the request, stored in SQLite and kept in memory"""
+
+    def __init__(self, path: str, max_examples: int = 5000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_examples = max_examples
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS routing_log (message_id TEXT PRIMARY KEY, question TEXT, destination TEXT, "
+            "embedding BLOB, logged_at TEXT DEFAULT (datetime('now')))"
+        )
+        self._lock = threading.Lock()
+        rows = self._conn.execute(
+            "SELECT destination, embedding FROM routing_log ORDER BY rowid DESC LIMIT ?", (max_examples,)
+        ).fetchall()[::-1]
+        self._destinations = [row[0] for row in rows]
+        self._embeddings = [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+        self._matrix = None
+
+    def record(self, message_id: str, question: str, destination: str, embedding: Sequence[float]):
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO routing_log (message_id, question, destination, embedding) VALUES (?, ?, ?, ?)",
+                (message_id, question, destination, vector.tobytes()),
+            ).rowcount
+            if inserted:
+                self._destinations.append(destination)
+                self._embeddings.append(vector)
+                del self._destinations[:-self.max_examples]
+                del self._embeddings[:-self.max_examples]
+                self._matrix = None
+
+    def examples(self) -> tuple[np.ndarray, list[str]]:
+        """Unit embeddings as a matrix, one row per decision, and the destinations"""
+        with self._lock:
+            if self._matrix is None and self._embeddings:
+                self._matrix = np.vstack(self._embeddings)
+            return self._matrix, list(self._destinations)
+
+    def __len__(self):
+        return len(self._destinations)
+
+
+class Router:
+    def __init__(self, log: RoutingLog, embed: Callable[[str], Sequence[float]], agents: Sequence[str],
+                 confidence: float = 0.8, min_similarity: float = 0.85, neighbors: int = 5):
+        self.log = log
+        self.embed = embed
+        self.agents = list(agents)
+        self.confidence = confidence
+        self.min_similarity = min_similarity
+        self.neighbors = neighbors
+
+    def _vote(self, question: str) -> Optional[Route]:
+        """Similarity weighted vote of the closest past decisions, None without at least two close ones"""
+        matrix, destinations = self.log.examples()
+        if matrix is None or len(destinations) < 2:
+            return None
+        query = np.asarray(self.embed(question), dtype=np.float32)
+        similarities = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        closest = np.argsort(similarities)[::-1][:self.neighbors]
+        closest = [i for i in closest if similarities[i] >= self.min_similarity]
+        if len(closest) < 2:
+            return None
+        votes = {}
+        for i in closest:
+            votes[destinations[i]] = votes.get(destinations[i], 0.0) + float(similarities[i])
+        destination = max(votes, key=votes.get)
+        return Route(destination, votes[destination] / sum(votes.values()), "neighbors")
+
+    def _keywords(self, question: str) -> Optional[Route]:
+        question = question.lower()
+        if MULTI_STEP.search(question):
+            return None
+        matched = [agent for agent, rule in KEYWORD_RULES.items() if agent in self.agents and rule.search(question)]
+        if len(matched) != 1:
+            return None
+        return Route(matched[0], 1.0, "keywords")
+
+    def route(self, question: str, first_turn: bool = True) -> Route:
+        """Agent to send the request to, or the supervisor when no classifier is confident.
+
+        Keywords only route the first request of a conversation, a later one may refer to the earlier answers.
+        """
+        vote = self._vote(question)
+        if vote is not None and vote.confidence >= self.confidence:
+            return vote
+        # the logged decisions disagree, or the request is unlike any of them
+        if vote is None and first_turn and (keywords := self._keywords(question)) is not None:
+            return keywords
+        return Route(SUPERVISOR, vote.confidence if vote else 0.0, "fallback")
+
+    def learn(self, messages: Sequence[BaseMessage]):
+        """Log the supervisor's decision for the last completed turn of the conversation"""
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(turn_starts) < 2:
+            return
+        start, end = turn_starts[-2], turn_starts[-1]
+        question = messages[start]
+        decisions = [m for m in messages[start + 1:end] if isinstance(m, AIMessage) and m.name == SUPERVISOR]
+        if not decisions or question.id is None or not isinstance(question.content, str):
+            # answered by the fast path, the router does not learn from itself
+            return
+        handed_to = {call["name"].removeprefix("transfer_to_") for m in decisions for call in m.tool_calls}
+        handed_to &= set(self.agents)
+        destination = handed_to.pop() if len(handed_to) == 1 else SUPERVISOR
+        self.log.record(question.id, question.content, destination, self.embed(question.content))
+
+
+def _current_turn(messages: Sequence[BaseMessage]) -> Sequence[BaseMessage]:
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i:]
+    return messages
+
+
+def add_router(workflow: StateGraph, router: Router, supervisor_name: str = SUPERVISOR):
+    """Put the router at the start of the workflow built by create_supervisor.
+
+    Requests it is not confident about go where the workflow started before, the supervisor or the planner. An
+    agent reached through the fast path answers the user directly: its hand-back messages to the supervisor are
+    removed and the run ends, otherwise it returns to the supervisor as before.
+    """
+    entry = next(end for start, end in workflow.edges if start == START)
+
+    def route(state: dict) -> Command:
+        messages = state["messages"]
+        router.learn(messages)
+        question = messages[-1].content if messages and isinstance(messages[-1], HumanMessage) else None
+        if not isinstance(question, str):
+            return Command(goto=entry)
+        with span("router.route") as s:
+            first_turn = sum(isinstance(m, HumanMessage) for m in messages) == 1
+            decision = router.route(question, first_turn)
+            s.set(destination=decision.destination, confidence=decision.confidence, source=decision.source)
+        if decision.destination == SUPERVISOR:
+            return Command(goto=entry)
+        # lets the ui stream the answer of the agent instead of the supervisor's
+        dispatch_custom_event("fast_path", {"agent": decision.destination})
+        return Command(goto=decision.destination)
+
+    def after_agent(state: dict) -> str:
+        supervised = any(isinstance(m, AIMessage) and m.name == supervisor_name for m in _current_turn(state["messages"]))
+        return supervisor_name if supervised else FAST_PATH_END_NODE
+
+    def fast_path_end(state: dict) -> dict:
+        handed_back = [m for m in state["messages"][-2:] if m.response_metadata.get(METADATA_KEY_IS_HANDOFF_BACK)]
+        return {"messages": [RemoveMessage(id=m.id) for m in handed_back]}
+
+    workflow.edges.discard((START, entry))
+    workflow.add_node(ROUTER_NODE, route, destinations=(entry, *router.agents))
+    workflow.add_edge(START, ROUTER_NODE)
+    workflow.add_node(FAST_PATH_END_NODE, fast_path_end)
+    workflow.add_edge(FAST_PATH_END_NODE, END)
+    for agent in router.agents:
+        workflow.edges.discard((agent, supervisor_name))
+        workflow.add_conditional_edges(agent, after_agent, [supervisor_name, FAST_PATH_END_NODE])
+
+
+_routing_log = None
+_routing_log_lock = threading.Lock()
+
+
+def get_routing_log() -> RoutingLog:
+    global _routing_log
+    with _routing_log_lock:
+        if _routing_log is None:
+            _routing_log = RoutingLog(
+                os.getenv("ROUTER_LOG_PATH", "cache/routing_log.db"),
+                max_examples=int(os.getenv("ROUTER_MAX_EXAMPLES", "5000")),
+            )
+    return _routing_log
+
+
+def create_router(agents: Sequence[str], embed: Callable[[str], Sequence[float]]) -> Router:
+    return Router(
+        get_routing_log(),
+        embed,
+        agents,
+        confidence=float(os.getenv("ROUTER_CONFIDENCE", "0.8")),
+        min_similarity=float(os.getenv("ROUTER_MIN_SIMILARITY", "0.85")),
+        neighbors=int(os.getenv("ROUTER_NEIGHBORS", "5")),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show where the router would send a request")
+    parser.add_argument("question")
+    args = parser.parse_args()
+
+    from agents.data_analyst import get_vanna
+
+    router = create_router(list(KEYWORD_RULES), get_vanna().generate_embedding)
+    decision = router.route(args.question)
+    print(f"{decision.destination} (confidence {decision.confidence:.2f}, {decision.source}, "
+          f"{len(router.log)} logged decisions)")
+
+
+if __name__ == "__main__":
+    main()
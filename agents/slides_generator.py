@@ -1,35 +1,76 @@
-import json
 import os
+import re
 from typing import Annotated, Sequence, TypedDict
 
-from langchain_core.messages import BaseMessage, SystemMessage, ToolMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from langgraph.graph import add_messages, StateGraph, END
 
+from agents.artifacts import preview_dataframe
 from agents.coder import python_repl_tool, Code
-from agents.llm.llm import build_llm
+from agents.deck import DeckOutline, load_result, render_deck
+from agents.llm.llm import get_llm
+from agents.history import compact_history
+from agents.tool_node import create_tool_node
+from agents.tracing import span
 
 from dotenv import load_dotenv
 
 load_dotenv(".env")
 
 output_dir = os.getenv("OUTPUT_DIRECTORY", ".")
-os.makedirs(output_dir, exist_ok=True)
 
-model = build_llm()
+_HANDLE = re.compile(r"\b(?:df|fig)-[0-9a-f]{16}\b")
+
+OUTLINE_PROMPT = """You outline PowerPoint presentations. Extract the key insights of the request and the results
+it refers to, and describe the deck: a title, then a few slides of short bullets, charts or tables. A chart or table
+shows one of the results below by its handle, name the columns of a chart exactly as they are listed. A figure
+(fig-...) that is not a bar, line or pie chart, e.g. a scatter plot or a map, is shown as an image. Keep numbers
+as they appear in the results.
+===Results
+{results}
+"""
+
+
+@tool
+def create_slides(user_input: str) -> str:
+    """Create a PowerPoint presentation from the user input and the results it refers to by handle (df-... or
+    fig-...), return the path of the saved presentation."""
+    results = []
+    for handle in dict.fromkeys(_HANDLE.findall(user_input)):
+        try:
+            results.append(f"{handle}: {preview_dataframe(load_result(handle), rows=5)}")
+        except (FileNotFoundError, ValueError):
+            results.append(f"{handle}: not found")
+    outline_chain = ChatPromptTemplate.from_messages(
+        [
+            ("system", OUTLINE_PROMPT.format(results="\n".join(results) or "none")),
+            ("placeholder", "{messages}"),
+        ]
+    ) | get_llm().with_structured_output(DeckOutline)
+    with span("slides.outline") as s:
+        outline = outline_chain.invoke({"messages": [("user", user_input)]})
+        s.set(slides=len(outline.slides))
+    with span("slides.render"):
+        path = render_deck(outline, output_dir)
+    listing = "\n".join(f"{i}. {slide.title} ({slide.kind})" for i, slide in enumerate(outline.slides, start=2))
+    return f"Saved the presentation to {path}:\n1. {outline.title} (title)\n{listing}"
 
 
 @tool
 def generate_python_pptx_code(user_input: str) -> str:
     """Generate python-pptx code given user input."""
+    os.makedirs(output_dir, exist_ok=True)
     prompt = f"""You are an AI assistant specialized in creating PowerPoint presentations using the python-pptx library.
 Extract key insights and generate relevant charts based on the past conversation. 
 Finally, create a well-structured presentation that includes these charts and any necessary images, ensuring 
 that the formatting is professional and visually appealing.
 Afterward, save the presentation in pptx format in {output_dir} directory, 
 give the file a relevant name.
+Data and figures of earlier answers are referenced by handles (df-... or fig-...), load them with 
+`load_artifact(handle)`, it returns a pandas DataFrame or a plotly figure dict, instead of querying the data again.
 """
     code_gen_prompt = ChatPromptTemplate.from_messages(
         [
@@ -40,9 +81,10 @@ give the file a relevant name.
             ("placeholder", "{messages}"),
         ]
     )
-    code_gen_chain = code_gen_prompt | model.with_structured_output(Code)
-    result = code_gen_chain.invoke({"messages": [("user", user_input)]})
-    print("code generation result", result)
+    code_gen_chain = code_gen_prompt | get_llm().with_structured_output(Code)
+    with span("slides.generate_code") as s:
+        result = code_gen_chain.invoke({"messages": [("user", user_input)]})
+        s.set(prefix=result.prefix, code=result.code)
     return result.code
 
 
@@ -51,23 +93,17 @@ class SlidesGeneratorState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
 
-tools = [python_repl_tool, generate_python_pptx_code]
-model = model.bind_tools(tools, parallel_tool_calls=False)
-tools_by_name = {tool.name: tool for tool in tools}
+tools = [create_slides, python_repl_tool, generate_python_pptx_code]
+
+_model = None
 
 
-def tool_node(state: SlidesGeneratorState):
-    outputs = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool_result = tools_by_name[tool_call["name"]].invoke(tool_call["args"])
-        outputs.append(
-            ToolMessage(
-                content=json.dumps(tool_result),
-                name=tool_call["name"],
-                tool_call_id=tool_call["id"],
-            )
-        )
-    return {"messages": outputs}
+def get_model():
+    """Shared llm with the slides generator tools bound"""
+    global _model
+    if _model is None:
+        _model = get_llm().bind_tools(tools, parallel_tool_calls=False)
+    return _model
 
 
 def call_model(
@@ -75,12 +111,14 @@ def call_model(
         config: RunnableConfig,
 ):
     system_prompt = SystemMessage(
-        "You are a powerpoint slides generator agent, please use generate_python_code tool to creating PowerPoint "
-        "presentations using the python-pptx library given user's intent"
-        "And then use python_repl_tool to execute your code."
-        f"Save the presentation in pptx format in {output_dir} directory."
+        "You are a powerpoint slides generator agent, please use create_slides to create PowerPoint presentations "
+        "given user's intent, with the insights and numbers from the conversation and any result handle "
+        "(df-... or fig-...) it should chart. "
+        "Only if the presentation needs something create_slides can not do, e.g. images or custom layouts, use "
+        "generate_python_pptx_code to generate python-pptx code and then python_repl_tool to execute it, passing "
+        f"the result handles on as well. Save the presentation in pptx format in {output_dir} directory."
     )
-    response = model.invoke([system_prompt] + state["messages"], config)
+    response = get_model().invoke(compact_history(system_prompt, state["messages"]), config)
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
@@ -99,7 +137,7 @@ def should_continue(state: SlidesGeneratorState):
 def create_slides_generator_agent():
     workflow = StateGraph(SlidesGeneratorState)
     workflow.add_node("agent", call_model)
-    workflow.add_node("tools", tool_node)
+    workflow.add_node("tools", create_tool_node(tools))
     workflow.set_entry_point("agent")
     workflow.add_conditional_edges(
         "agent",
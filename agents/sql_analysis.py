@@ -0,0 +1,127 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_QUOTED_IDENTIFIER = re.compile(r'"((?:[^"]|"")*)"|`([^`]*)`|\[([^]]*)]')
+_CLAUSE = re.compile(r"\b(select|from|where|group\s+by|order\s+by|having|limit|on|join|union|window)\b")
+# a table of the main schema can be qualified, main.sales_data
+_TABLE_ITEM = re.compile(r"^\s*(?:main\s*\.\s*)?(\w+)(?:\s+(?:as\s+)?(\w+))?")
+_COLUMN = re.compile(r"(?<![\w.])(?:(\w+)\.)?([a-z_]\w*)\b(?!\s*\()")
+_EQUALITY = re.compile(r"^\s*(=|==|in\b|is\b)")
+_EQUALITY_BEFORE = re.compile(r"(=|==)\s*$")
+_RANGE = re.compile(r"^\s*(<=|>=|<>|!=|<|>|between\b|like\b|glob\b)")
+_RANGE_BEFORE = re.compile(r"(<=|>=|<|>)\s*$")
+
+# words that follow a table name and must not be taken for an alias
+_NOT_ALIAS = {
+    "left", "right", "inner", "outer", "cross", "natural", "full", "where", "group", "order", "having", "limit",
+    "on", "using", "join", "union", "window", "as",
+}
+
+# clauses whose column references are classified, mapped to the usage they count as
+_USAGE_CLAUSES = {"where": "filter", "on": "join", "having": "filter", "group by": "group_by",
+                  "order by": "order_by", "select": "select"}
+
+
+def normalize_sql(sql: str) -> str:
+    """Lowercase sql with comments removed, string literals replaced by ? and identifier quotes stripped"""
+    sql = _BLOCK_COMMENT.sub(" ", _LINE_COMMENT.sub(" ", sql))
+    sql = _STRING.sub("?", sql)
+    sql = _QUOTED_IDENTIFIER.sub(lambda m: next(g for g in m.groups() if g is not None), sql)
+    return re.sub(r"\s+", " ", sql).strip().lower()
+
+
+def split_clauses(normalized_sql: str) -> list[tuple[str, str]]:
+    """(keyword, text) pairs of the clauses of the statement, subqueries are flattened into the sequence"""
+    parts = _CLAUSE.split(normalized_sql)
+    return [(re.sub(r"\s+", " ", parts[i]), parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+
+def table_references(clauses: list[tuple[str, str]]) -> Iterator[tuple[str, Optional[str], str]]:
+    """(table, alias, rest of the item) of every item of the from and join clauses.
+
+    The table may also be a CTE, a subquery alias or a table-valued function, whose rest starts with "(".
+    """
+    for keyword, text in clauses:
+        if keyword not in ("from", "join"):
+            continue
+        for item in text.split(","):
+            match = _TABLE_ITEM.match(item)
+            if match is None:
+                continue
+            alias = match.group(2) if match.group(2) not in _NOT_ALIAS else None
+            yield match.group(1), alias, item[match.end(1):]
+
+
+@dataclass
+class QueryShape:
+    """Tables referenced by a query and how each of their columns is used"""
+    tables: dict[str, str] = field(default_factory=dict)  # alias or name -> table
+    equality: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+    range: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+    join: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+    group_by: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+    order_by: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+    select: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+
+    def columns(self, table: str) -> list[str]:
+        """Every column of the table referenced by the query, in order of first use"""
+        seen = []
+        for usage in (self.equality, self.join, self.range, self.group_by, self.order_by, self.select):
+            seen.extend(col for col in usage.get(table, []) if col not in seen)
+        return seen
+
+
+def _add(usage: dict, table: str, column: str):
+    if column not in usage[table]:
+        usage[table].append(column)
+
+
+def analyze_query(sql: str, table_columns: dict[str, set[str]]) -> QueryShape:
+    """Best-effort analysis of the tables and columns a query filters, joins, groups and selects on.
+
+    `table_columns` maps the lowercase table names of the database to their lowercase column names, names that
+    are not found there (CTEs, subquery aliases, functions) are ignored.
+    """
+    shape = QueryShape()
+    clauses = split_clauses(normalize_sql(sql))
+
+    for table, alias, _ in table_references(clauses):
+        if table not in table_columns:
+            continue
+        shape.tables[table] = table
+        if alias:
+            shape.tables[alias] = table
+
+    referenced = set(shape.tables.values())
+    for keyword, text in clauses:
+        usage_kind = _USAGE_CLAUSES.get(keyword)
+        if usage_kind is None:
+            continue
+        for match in _COLUMN.finditer(text):
+            qualifier, column = match.group(1), match.group(2)
+            if qualifier is not None:
+                tables = [shape.tables[qualifier]] if qualifier in shape.tables else []
+            else:
+                tables = [t for t in referenced if column in table_columns[t]]
+            tables = [t for t in tables if column in table_columns[t]]
+            if not tables:
+                continue
+
+            before, after = text[:match.start()], text[match.end():]
+            if usage_kind == "filter":
+                if _EQUALITY.match(after) or _EQUALITY_BEFORE.search(before):
+                    usage = shape.equality
+                elif _RANGE.match(after) or _RANGE_BEFORE.search(before):
+                    usage = shape.range
+                else:
+                    continue
+            else:
+                usage = getattr(shape, usage_kind)
+            for table in tables:
+                _add(usage, table, column)
+    return shape
@@ -0,0 +1,170 @@
+"""Validation of generated sql before it is executed.
+
+A query is parsed and checked against the live schema (one read-only statement, known tables, known columns of
+qualified references), then prepared with EXPLAIN QUERY PLAN, which catches every other error SQLite would raise
+without running it. The plan gives the cost estimate: the rows of each table it scans without an index,
+multiplied across the loops of a join and by the rows a correlated subquery runs for, so a cartesian product, an
+unindexed join of the large tables or a subquery scanning a table per row is rejected in milliseconds instead of
+running until the deadline.
+"""
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+
+from agents.db import ConnectionPool, get_pool
+from agents.sql_analysis import normalize_sql, split_clauses, table_references
+
+_CTE_NAME = re.compile(
+    r"(?:\bwith(?:\s+recursive)?|,)\s*(\w+)\s*(?:\([^)]*\)\s*)?as\s*(?:not\s+)?(?:materialized\s*)?\("
+)
+_QUALIFIED_COLUMN = re.compile(r"(?<![\w.])(\w+)\.(\w+)\b")
+# SQLite before 3.36 prints SCAN TABLE sales_data
+_PLAN_TABLE = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\w+)")
+
+
+class SQLValidationError(ValueError):
+    pass
+
+
+@dataclass
+class Validation:
+    """Outcome of a successful validation"""
+    tables: list[str]
+    estimated_rows: int
+    plan: list[str] = field(default_factory=list)
+
+
+class SQLValidator:
+    """Checks queries against the schema of the database behind the pool, the schema is reloaded when it changes"""
+
+    def __init__(self, pool: ConnectionPool, max_scan_rows: int = 100_000_000):
+        self.pool = pool
+        self.max_scan_rows = max_scan_rows
+        self._schema_version = None
+        self._table_columns: dict[str, set[str]] = {}
+        self._table_rows: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _load_schema(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        with self._lock:
+            if version == self._schema_version:
+                return
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                "AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'"
+            )]
+            self._table_columns = {
+                table.lower(): {row[1].lower() for row in conn.execute(f"PRAGMA table_xinfo('{table}')")}
+                for table in tables
+            }
+            # max(rowid) is a b-tree lookup, close enough to the row count of tables that are only appended to
+            self._table_rows = {}
+            for table in tables:
+                try:
+                    row_count = conn.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()[0]
+                except sqlite3.OperationalError:
+                    # views and WITHOUT ROWID tables
+                    continue
+                self._table_rows[table.lower()] = row_count or 0
+            self._schema_version = version
+
+    def _check_references(self, sql: str) -> dict[str, str]:
+        """The tables of the query by name and alias"""
+        normalized = normalize_sql(sql)
+        statements = [s for s in normalized.split(";") if s.strip()]
+        if not statements:
+            raise SQLValidationError("The query is empty")
+        if len(statements) > 1:
+            raise SQLValidationError("Only a single statement can be executed")
+        if not re.match(r"^\(*\s*(select|with)\b", statements[0]):
+            # vanna returns its errors in place of the sql
+            raise SQLValidationError(f"Only SELECT queries can be executed, got: {sql.strip()[:200]}")
+
+        ctes = set(_CTE_NAME.findall(statements[0]))
+        aliases = {}
+        for table, alias, rest in table_references(split_clauses(statements[0])):
+            if table in ctes or rest.lstrip().startswith("("):
+                # subqueries, CTEs and table-valued functions
+                continue
+            if table not in self._table_columns:
+                raise SQLValidationError(
+                    f"no such table: {table}. The tables are: {', '.join(sorted(self._table_columns))}"
+                )
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+
+        for qualifier, column in _QUALIFIED_COLUMN.findall(statements[0]):
+            table = aliases.get(qualifier)
+            if table is not None and column not in self._table_columns[table]:
+                raise SQLValidationError(
+                    f"no such column: {qualifier}.{column}. The columns of {table} are: "
+                    f"{', '.join(sorted(self._table_columns[table]))}"
+                )
+        return aliases
+
+    def _estimate(self, plan: list[tuple], aliases: dict[str, str]) -> int:
+        """Rows read by the plan: the loops of a join multiply, a correlated subquery runs once per row of the loop
+        it is in, other subqueries and automatic indexes add up"""
+        loops: dict[int, int] = {}
+        correlated: dict[int, int] = {}
+        built = 0
+        for node, parent, _, detail in plan:
+            if "CORRELATED " in detail:
+                correlated[node] = parent
+                continue
+            match = _PLAN_TABLE.match(detail)
+            if match is None:
+                continue
+            kind, name = match.groups()
+            rows = self._table_rows.get(aliases.get(name.lower(), name.lower()))
+            if rows is None:
+                continue
+            if kind == "SEARCH" and "AUTOMATIC" in detail:
+                # SQLite indexes the table once for the join
+                built += rows
+            # a search through an index or the primary key reads a few rows per outer row
+            loops[parent] = loops.get(parent, 1) * max(rows if kind == "SCAN" else 1, 1)
+
+        def runs(node: int) -> int:
+            if node not in correlated:
+                return 1
+            parent = correlated[node]
+            return runs(parent) * loops.get(parent, 1)
+
+        return sum(runs(node) * rows for node, rows in loops.items()) + built
+
+    def validate(self, sql: str) -> Validation:
+        """Raise SQLValidationError when the query can not or should not run"""
+        with self.pool.deadline() as conn:
+            self._load_schema(conn)
+            aliases = self._check_references(sql)
+            try:
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {sql.strip().rstrip(';')}").fetchall()
+            except sqlite3.Error as e:
+                raise SQLValidationError(str(e)) from None
+        estimated_rows = self._estimate(plan, aliases)
+        if self.max_scan_rows and estimated_rows > self.max_scan_rows:
+            raise SQLValidationError(
+                f"The query would read about {estimated_rows:,} rows (limit {self.max_scan_rows:,}), "
+                f"join on indexed columns or filter the tables first"
+            )
+        return Validation(sorted(set(aliases.values())), estimated_rows, [row[3] for row in plan])
+
+
+_validators: dict[str, SQLValidator] = {}
+_validators_lock = threading.Lock()
+
+
+def get_sql_validator(db_name: str = None) -> SQLValidator:
+    """Validator of the database behind the process wide connection pool"""
+    pool = get_pool(db_name)
+    with _validators_lock:
+        if pool.db_name not in _validators:
+            _validators[pool.db_name] = SQLValidator(
+                pool, max_scan_rows=int(os.getenv("SQL_MAX_SCAN_ROWS", "100000000"))
+            )
+    return _validators[pool.db_name]
@@ -1,16 +1,51 @@
-from langgraph.checkpoint.memory import InMemorySaver
+import os
+import threading
+
+from langchain_core.messages import SystemMessage
 from langgraph_supervisor import create_supervisor
 
+from agents.checkpointer import get_checkpointer
 from agents.coder import create_coder_agent
-from agents.llm.llm import build_llm
-from agents.data_analyst import create_data_analyst_agent
+from agents.history import compact_history
+from agents.llm.llm import get_llm
+from agents.data_analyst import create_data_analyst_agent, get_vanna
+from agents.planner import add_planner
+from agents.repl_pool import get_repl_pool
+from agents.router import add_router, create_router
 from agents.slides_generator import create_slides_generator_agent
+from agents.tracing import get_tracer
+
+SUPERVISOR_PROMPT = SystemMessage(
+    "You are a team supervisor managing a data analyst, a coder and a slides generator. "
+    "For data analysis task, e.g. inquiry about data or data visualization, use data_analyst_agent. "
+    "For machine learning tasks or general coding task in python, use coder_agent. "
+    "For generating powerpoint slides, please use the slides_generator_agent, do not use the code_agent. "
+    "Think step by step and coordinate them to answer user's request. "
+    "If the request was carried out following a plan, the results of its steps are in the conversation, give the "
+    "final response from them and only hand off again for a step that failed. "
+    "Otherwise, if there is multiple questions, please breakdown and answer sequentially, "
+    "with the most suitable agent. "
+    "Give final response to the user based on all the output from the agent(s), include detailed information. "
+)
+
+
+def warm_up():
+    """Create the shared resources ahead of the first request"""
+    get_llm()
+    get_vanna()
+    get_repl_pool()
+
 
+def get_ai_data_scientist(warm: bool = True):
+    if warm:
+        # open the vector store and database in the background while the graph is being compiled
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
-def get_ai_data_scientist():
-    model = build_llm()
-    # persistence
-    checkpointer = InMemorySaver()
+    # register the tracing callbacks before the first run
+    get_tracer()
+    model = get_llm()
+    # persistence, conversations survive restarts and idle ones are evicted
+    checkpointer = get_checkpointer()
 
     # agents
     data_analyst_agent = create_data_analyst_agent()
@@ -18,20 +53,22 @@ def get_ai_data_scientist():
     slides_generator_agent = create_slides_generator_agent()
 
     # Create supervisor workflow
+    agents = [data_analyst_agent, coder_agent, slides_generator_agent]
     workflow = create_supervisor(
-        [data_analyst_agent, coder_agent, slides_generator_agent],
+        agents,
         model=model,
-        prompt=(
-            "You are a team supervisor managing a data analyst, a coder and a slides generator. "
-            "For data analysis task, e.g. inquiry about data or data visualization, use data_analyst_agent. "
-            "For machine learning tasks or general coding task in python, use coder_agent. "
-            "For generating powerpoint slides, please use the slides_generator_agent, do not use the code_agent. "
-            "Think step by step and coordinate them to answer user's request. "
-            "If there is multiple questions, please breakdown and answer sequentially, with the most suitable agent. "
-            "Give final response to the user based on all the output from the agent(s), include detailed information. "
-        ),
+        # the full history is kept in the state, the model sees it compacted to the token budget
+        prompt=lambda state: compact_history(SUPERVISOR_PROMPT, state["messages"]),
         output_mode="full_history",
     )
+    if os.getenv("PLANNER_ENABLED", "true").lower() == "true":
+        # independent parts of a compound request run concurrently
+        add_planner(workflow, agents)
+    if os.getenv("ROUTER_ENABLED", "true").lower() == "true":
+        # requests that clearly belong to one agent skip the supervisor
+        router = create_router([agent.name for agent in agents],
+                               lambda question: get_vanna().generate_embedding(question))
+        add_router(workflow, router)
 
     # Compile
     app = workflow.compile(
@@ -0,0 +1,91 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_MAX_WORKERS", "8")), thread_name_prefix="tool")
+
+
+def _error_message(tool_call: dict, error: str) -> ToolMessage:
+    return ToolMessage(
+        content=json.dumps(error),
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"],
+        status="error",
+    )
+
+
+class _ToolCall:
+    """A tool call submitted to the pool, its timeout counts from when a worker starts running it"""
+
+    def __init__(self, tool: BaseTool, args: dict, config: RunnableConfig):
+        self.started_at = None
+        self._started = threading.Event()
+        # copy the context so callbacks and tracing of the parent run follow the tool into the thread
+        context = contextvars.copy_context()
+        self.future = _executor.submit(context.run, self._run, tool, args, config)
+
+    def _run(self, tool: BaseTool, args: dict, config: RunnableConfig):
+        self.started_at = time.monotonic()
+        self._started.set()
+        return tool.invoke(args, config)
+
+    def result(self, timeout: float):
+        if not self._started.wait(timeout) and self.future.cancel():
+            raise TimeoutError(f"no worker became free within {timeout} seconds")
+        # the worker picked the call up as it was cancelled
+        self._started.wait()
+        return self.future.result(timeout=max(0.0, self.started_at + timeout - time.monotonic()))
+
+
+def create_tool_node(tools: list[BaseTool], timeout: float = None):
+    """Graph node executing the tool calls of the last message.
+
+    Independent tool calls of one turn run concurrently on a bounded thread pool, the resulting messages keep
+    the order of the tool calls. A tool that fails or runs past `timeout` seconds yields an error message for
+    its call only, so the model still receives the results of the other calls. The timeout counts from when the
+    tool starts running, a call still waiting for a worker after `timeout` seconds is cancelled. A timed-out tool
+    can not be cancelled: it keeps its worker until it returns.
+    """
+    tools_by_name = {tool.name: tool for tool in tools}
+    if timeout is None:
+        timeout = float(os.getenv("TOOL_TIMEOUT_SECONDS", "600"))
+
+    def tool_node(state, config: RunnableConfig):
+        tool_calls = state["messages"][-1].tool_calls
+        calls = [
+            _ToolCall(tools_by_name[tool_call["name"]], tool_call["args"], config)
+            if tool_call["name"] in tools_by_name else None
+            for tool_call in tool_calls
+        ]
+
+        outputs = []
+        for tool_call, call in zip(tool_calls, calls):
+            if call is None:
+                outputs.append(_error_message(tool_call, f"Unknown tool {tool_call['name']}"))
+                continue
+            try:
+                tool_result = call.result(timeout)
+            except TimeoutError as e:
+                reason = str(e) if call.started_at is None else f"timed out after {timeout} seconds"
+                outputs.append(_error_message(tool_call, f"{tool_call['name']} {reason}"))
+                continue
+            except Exception as e:
+                outputs.append(_error_message(tool_call, f"{tool_call['name']} failed. Error: {repr(e)}"))
+                continue
+            outputs.append(
+                ToolMessage(
+                    content=json.dumps(tool_result),
+                    name=tool_call["name"],
+                    tool_call_id=tool_call["id"],
+                )
+            )
+        return {"messages": outputs}
+
+    return tool_node
@@ -0,0 +1,515 @@
+"""Spans of the hot path, exported to a local JSONL or OTLP JSON file, and a report of where the time went.
+
+Graph nodes (the supervisor decision, each agent's call_model), tool invocations and llm calls are recorded by a
+langchain callback handler registered for every run, the rest (vanna sql generation and execution, vector store
+retrieval, python execution) by `span` blocks in the code. Spans nest across both: a `span` block opened inside
+a tool is a child of the tool's span.
+
+Usage:
+    python -m agents.tracing                    # time per span name, slowest first
+    python -m agents.tracing --slowest 3        # span tree of the 3 slowest traces
+    python -m agents.tracing --trace <trace_id>
+"""
+import argparse
+import atexit
+import contextvars
+import json
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Optional
+from uuid import UUID, uuid4
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.runnables.config import var_child_runnable_config
+from langchain_core.tracers.context import register_configure_hook
+from langgraph.errors import GraphBubbleUp
+
+SERVICE_NAME = "ai-data-scientist"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_t0")
+
+    def __init__(self, name: str, trace_id: str, span_id: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._t0 = time.perf_counter_ns()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_unix_nano": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    return record
+
+
+class SpanExporter:
+    """Appends finished spans to a file from a background thread, the traced code never waits on the disk.
+
+    "jsonl" writes one span per line, "otlp" one OTLP/JSON `resourceSpans` export request per batch, the format
+    of the OpenTelemetry collector file exporter. The file is rotated to `<path>.1` past `max_bytes`.
+    """
+
+    def __init__(self, path: str, fmt: str = "jsonl", max_bytes: int = 100 * 1024 * 1024):
+        if fmt not in ("jsonl", "otlp"):
+            raise ValueError(f"Unknown trace export format: {fmt}. Only 'jsonl' and 'otlp' are supported.")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        self._queue.put(span)
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until the spans exported so far are written"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [item for item in batch if isinstance(item, Span)]
+            if spans:
+                try:
+                    self._write(spans)
+                except OSError as e:
+                    print(f"Could not write {len(spans)} spans to {self.path}. Error: {repr(e)}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, spans: list[Span]):
+        if self.fmt == "jsonl":
+            lines = [json.dumps(span.to_dict(), default=str) for span in spans]
+        else:
+            lines = [json.dumps({"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "agents.tracing"}, "spans": [_otlp_span(s) for s in spans]}],
+            }]})]
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class Tracer:
+    """Creates spans and hands the finished ones to the exporter, a tracer without exporter records nothing"""
+
+    def __init__(self, exporter: Optional[SpanExporter], max_attribute_chars: int = 2000):
+        self.exporter = exporter
+        self.max_attribute_chars = max_attribute_chars
+        self.handler = TracingCallbackHandler(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def _attribute(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        value = str(value)
+        if len(value) > self.max_attribute_chars:
+            value = value[:self.max_attribute_chars] + f"... [{len(value) - self.max_attribute_chars} more]"
+        return value
+
+    def start_span(self, name: str, parent: Optional[Span], attributes: dict = None, trace_id: str = None,
+                   span_id: str = None) -> Span:
+        trace_id = parent.trace_id if parent is not None else trace_id or uuid4().hex
+        return Span(name, trace_id, span_id or uuid4().hex[:16], parent.span_id if parent is not None else None,
+                    dict(attributes or {}))
+
+    def end_span(self, span: Span, error: BaseException = None, **attributes):
+        span.end_ns = span.start_ns + time.perf_counter_ns() - span._t0
+        span.set(**attributes)
+        span.attributes = {key: self._attribute(value) for key, value in span.attributes.items() if value is not None}
+        if error is not None:
+            span.error = self._attribute(repr(error))
+        self.exporter.export(span)
+
+    def current_span(self) -> Optional[Span]:
+        """Innermost open `span` block, or the span of the langchain run (tool, node) the code runs in"""
+        span = _current_span.get()
+        if span is not None:
+            return span
+        config = var_child_runnable_config.get()
+        callbacks = config.get("callbacks") if config else None
+        if isinstance(callbacks, BaseCallbackManager) and callbacks.parent_run_id is not None:
+            return self.handler.span_of(callbacks.parent_run_id)
+        return None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record the block as a span, `.set(...)` on the yielded span adds attributes, e.g. row counts"""
+        if self.exporter is None:
+            yield _NOOP_SPAN
+            return
+        span = self.start_span(name, self.current_span(), attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span, error)
+
+
+def _token_usage(response) -> dict:
+    """Token counts of an llm response, from the message usage metadata or the provider's llm_output"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return {"input_tokens": usage.get("input_tokens"), "output_tokens": usage.get("output_tokens")}
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return {"input_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens")}
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Spans for the graph run, its nodes, llm calls and tools, identified by the langchain run id.
+
+    The other runnables a graph is made of (prompts, routing functions, parsers) are not recorded, their children
+    are attached to the nearest recorded ancestor.
+    """
+
+    # called in order on the thread of the run, even in async runs, the bookkeeping is cheap
+    run_inline = True
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: dict[UUID, Span] = {}
+        # nearest recorded ancestor of the open runs that are not recorded
+        self._ancestors: dict[UUID, Optional[Span]] = {}
+        self._lock = threading.Lock()
+
+    def span_of(self, run_id: UUID) -> Optional[Span]:
+        with self._lock:
+            return self._spans.get(run_id) or self._ancestors.get(run_id)
+
+    def _parent(self, parent_run_id: Optional[UUID]) -> Optional[Span]:
+        parent = self.span_of(parent_run_id) if parent_run_id is not None else None
+        # a run started inside a `span` block opened below its parent run belongs to the block, e.g. the llm
+        # call of a chain invoked in a span of a tool, so does a run started without parent
+        block = _current_span.get()
+        if block is not None and (parent is None or (block.trace_id == parent.trace_id and block._t0 > parent._t0)):
+            return block
+        return parent
+
+    def _open(self, name: str, run_id: UUID, parent_run_id: Optional[UUID], attributes: dict):
+        parent = self._parent(parent_run_id)
+        # run ids are time ordered, their random low half is the span id
+        span = self.tracer.start_span(name, parent, attributes, trace_id=run_id.hex, span_id=run_id.hex[16:])
+        with self._lock:
+            self._spans[run_id] = span
+
+    def _skip(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        parent = self._parent(parent_run_id)
+        with self._lock:
+            self._ancestors[run_id] = parent
+
+    def _close(self, run_id: UUID, error: BaseException = None, **attributes):
+        if isinstance(error, GraphBubbleUp):
+            # control flow, e.g. the handoff of a transfer tool to another agent, not a failure
+            error = None
+        with self._lock:
+            self._ancestors.pop(run_id, None)
+            span = self._spans.pop(run_id, None)
+        if span is not None:
+            self.tracer.end_span(span, error, **attributes)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: UUID = None, tags=None,
+                       metadata: dict = None, **kwargs: Any):
+        if not self.tracer.enabled:
+            return
+        metadata = metadata or {}
+        name = kwargs.get("name")
+        namespace = metadata.get("langgraph_checkpoint_ns", "")
+        if parent_run_id is None:
+            self._open(f"graph:{name}", run_id, None, {"thread_id": metadata.get("thread_id")})
+        elif name is not None and name == metadata.get("langgraph_node") and metadata.get("checkpoint_ns") != namespace:
+            # a node, named by its path through the subgraphs, e.g. node:coder_agent/agent for the coder's call_model
+            path = "/".join(part.split(":")[0] for part in namespace.split("|")) or name
+            self._open(f"node:{path}", run_id, parent_run_id, {"step": metadata.get("langgraph_step")})
+        else:
+            self._skip(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: UUID = None, tags=None,
+                            metadata: dict = None, **kwargs: Any):
+        if not self.tracer.enabled:
+            return
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or kwargs.get("name") or "chat_model"
+        self._open(f"llm:{model}", run_id, parent_run_id,
+                   {"provider": metadata.get("ls_provider"), "input_messages": len(messages[0])})
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: UUID = None, tags=None,
+                     metadata: dict = None, **kwargs: Any):
+        if not self.tracer.enabled:
+            return
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or kwargs.get("name") or "llm"
+        self._open(f"llm:{model}", run_id, parent_run_id, {"provider": metadata.get("ls_provider")})
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        if run_id not in self._spans:
+            return
+        message = getattr(response.generations[0][0], "message", None) if response.generations else None
+        tool_calls = [call["name"] for call in getattr(message, "tool_calls", None) or []]
+        # what the model decided, e.g. the agent the supervisor transfers to
+        self._close(run_id, tool_calls=",".join(tool_calls) or None, **_token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, parent_run_id: UUID = None, tags=None,
+                      metadata: dict = None, **kwargs: Any):
+        if not self.tracer.enabled:
+            return
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._open(f"tool:{name}", run_id, parent_run_id, {"input": input_str})
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, output_chars=len(str(getattr(output, "content", output))))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, error)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Process wide tracer, its callback handler is added to every langchain run once created"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            exporter = None
+            if os.getenv("TRACING_ENABLED", "true").lower() == "true":
+                exporter = SpanExporter(
+                    os.getenv("TRACE_PATH", "cache/traces.jsonl"),
+                    fmt=os.getenv("TRACE_FORMAT", "jsonl"),
+                    max_bytes=int(os.getenv("TRACE_MAX_MB", "100")) * 1024 * 1024,
+                )
+            _tracer = Tracer(exporter, max_attribute_chars=int(os.getenv("TRACE_MAX_ATTRIBUTE_CHARS", "2000")))
+            if _tracer.enabled:
+                # the default of the variable, so the handler is seen from every thread and context
+                handler_var = contextvars.ContextVar("tracing_callback_handler", default=_tracer.handler)
+                register_configure_hook(handler_var, inheritable=True)
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """Record the block as a span of the current trace, see `Tracer.span`"""
+    return get_tracer().span(name, **attributes)
+
+
+# report
+
+
+def load_spans(path: str) -> list[dict]:
+    """Spans of a JSONL or OTLP JSON trace file, as the dicts of `Span.to_dict`"""
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "resourceSpans" not in record:
+                spans.append(record)
+                continue
+            for resource_spans in record["resourceSpans"]:
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for s in scope_spans.get("spans", []):
+                        start = int(s["startTimeUnixNano"])
+                        spans.append({
+                            "trace_id": s["traceId"],
+                            "span_id": s["spanId"],
+                            "parent_id": s.get("parentSpanId"),
+                            "name": s["name"],
+                            "start_unix_nano": start,
+                            "duration_ms": (int(s["endTimeUnixNano"]) - start) / 1e6,
+                            "attributes": {a["key"]: next(iter(a["value"].values())) for a in s.get("attributes", [])},
+                            "error": s.get("status", {}).get("message"),
+                        })
+    return spans
+
+
+def _self_ms(spans: list[dict]) -> dict[str, float]:
+    """Time of each span not covered by its children, children running in parallel can cover all of it"""
+    children_ms = defaultdict(float)
+    for s in spans:
+        if s["parent_id"]:
+            children_ms[s["parent_id"]] += s["duration_ms"]
+    return {s["span_id"]: max(0.0, s["duration_ms"] - children_ms[s["span_id"]]) for s in spans}
+
+
+def summarize_spans(spans: list[dict]) -> list[dict]:
+    """Latency, self time, tokens and rows per span name, most total self time first"""
+    self_ms = _self_ms(spans)
+    by_name = defaultdict(list)
+    for s in spans:
+        by_name[s["name"]].append(s)
+    summary = []
+    for name, group in by_name.items():
+        durations = sorted(s["duration_ms"] for s in group)
+
+        def total(key):
+            return sum(int(s["attributes"].get(key) or 0) for s in group)
+
+        summary.append({
+            "name": name,
+            "count": len(group),
+            "errors": sum(1 for s in group if s["error"]),
+            "total_ms": sum(durations),
+            "self_ms": sum(self_ms[s["span_id"]] for s in group),
+            "mean_ms": statistics.fmean(durations),
+            "p50_ms": durations[len(durations) // 2],
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "max_ms": durations[-1],
+            "input_tokens": total("input_tokens"),
+            "output_tokens": total("output_tokens"),
+            "rows": total("rows"),
+        })
+    return sorted(summary, key=lambda row: row["self_ms"], reverse=True)
+
+
+def _print_summary(summary: list[dict]):
+    print(f"{'span':<48}{'count':>7}{'self ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'tokens in/out':>18}"
+          f"{'rows':>9}")
+    for row in summary:
+        tokens = f"{row['input_tokens']}/{row['output_tokens']}" if row["input_tokens"] or row["output_tokens"] else ""
+        print(f"{row['name'][:47]:<48}{row['count']:>7}{row['self_ms']:>11.1f}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}{tokens:>18}{row['rows'] or '':>9}")
+
+
+def _print_tree(spans: list[dict]):
+    children = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["start_unix_nano"]):
+        children[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+    start = min(s["start_unix_nano"] for s in spans)
+
+    def show(s, depth):
+        keys = ("input_tokens", "output_tokens", "tool_calls", "rows", "cache_hit")
+        details = " ".join(f"{k}={s['attributes'][k]}" for k in keys if s["attributes"].get(k) is not None)
+        offset = (s["start_unix_nano"] - start) / 1e6
+        error = f" ERROR {s['error'][:80]}" if s["error"] else ""
+        print(f"{offset:>9.1f}ms {s['duration_ms']:>9.1f}ms {'  ' * depth}{s['name']} {details}{error}")
+        for child in children[s["span_id"]]:
+            show(child, depth + 1)
+
+    for root in children[None]:
+        show(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report where the time of the traced runs went")
+    parser.add_argument("--path", default=os.getenv("TRACE_PATH", "cache/traces.jsonl"), help="trace file")
+    parser.add_argument("--trace", help="print the span tree of this trace")
+    parser.add_argument("--slowest", type=int, default=0, help="print the span tree of the N slowest traces")
+    parser.add_argument("--json", action="store_true", help="print the summary as json")
+    args = parser.parse_args()
+
+    spans = load_spans(args.path)
+    traces = defaultdict(list)
+    for s in spans:
+        traces[s["trace_id"]].append(s)
+
+    if args.trace:
+        _print_tree(traces[args.trace])
+        return
+    if args.slowest:
+        def duration(trace):
+            return max(s["start_unix_nano"] / 1e6 + s["duration_ms"] for s in trace) - min(
+                s["start_unix_nano"] / 1e6 for s in trace)
+
+        for trace_id, trace in sorted(traces.items(), key=lambda t: duration(t[1]), reverse=True)[:args.slowest]:
+            print(f"trace {trace_id}: {duration(trace):.1f}ms")
+            _print_tree(trace)
+            print()
+        return
+    summary = summarize_spans(spans)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{len(spans)} spans in {len(traces)} traces")
+        _print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
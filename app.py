@@ -1,18 +1,97 @@
-import time
+import asyncio
+import queue
+import threading
 from uuid import uuid4
 
 import streamlit as st
 from agents.supervisor import get_ai_data_scientist
 
-ai_data_scientist = get_ai_data_scientist()
+
+@st.cache_resource
+def load_ai_data_scientist():
+    # built once per server process, so the conversation memory survives reruns of this script
+    return get_ai_data_scientist()
+
+
+ai_data_scientist = load_ai_data_scientist()
 
 st.title("🤖 AI Data Scientist Chatbot")
 
 
-def stream_response(text):
-    for word in text.split(" "):
-        yield word + " "
-        time.sleep(0.02)
+def iter_events(inputs, config):
+    """Drive the async event stream of the graph on a background loop and yield the events here.
+
+    Keeping the consumer in the script thread lets it call streamlit functions while events arrive.
+    """
+    events = queue.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for event in ai_data_scientist.astream_events(inputs, config=config, version="v2"):
+                events.put(event)
+        except BaseException as e:
+            events.put(e)
+        finally:
+            events.put(done)
+
+    threading.Thread(target=asyncio.run, args=(produce(),), daemon=True).start()
+    while (event := events.get()) is not done:
+        if isinstance(event, BaseException):
+            raise event
+        yield event
+
+
+def stream_response(prompt, status):
+    """Yield the answer tokens as they are generated, report hand-offs and tool progress in the status box.
+
+    The answer is written by the supervisor, or by the agent the router sent the request to directly.
+    """
+    inputs = {"messages": [{"role": "user", "content": prompt}]}
+    config = {"thread_id": st.session_state.thread_id}
+    written = False
+    new_turn = False
+    streamed_runs = set()
+    answering = "supervisor"
+    for event in iter_events(inputs, config):
+        kind = event["event"]
+        from_answering = event["metadata"].get("langgraph_checkpoint_ns", "").startswith(answering)
+        if kind == "on_custom_event" and event["name"] == "fast_path":
+            answering = event["data"]["agent"]
+            status.update(label=f"Routed to {answering}...")
+            status.write(f"⚡ {answering}")
+        elif kind == "on_custom_event" and event["name"] == "plan":
+            status.update(label="Running the plan...")
+            status.write(f"🗺️ Plan:\n{event['data']['steps']}")
+        elif kind == "on_chat_model_start" and from_answering:
+            new_turn = written
+        elif kind in ("on_chat_model_stream", "on_chat_model_end") and from_answering:
+            if kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                streamed_runs.add(event["run_id"])
+            elif event["run_id"] not in streamed_runs:
+                # served from the llm cache or by a model that does not stream, write the reply at once
+                content = event["data"]["output"].content
+            else:
+                continue
+            if isinstance(content, str) and content:
+                if new_turn:
+                    yield "\n\n"
+                    new_turn = False
+                written = True
+                yield content
+        elif kind == "on_tool_start":
+            if event["name"].startswith("transfer_to_"):
+                agent_name = event["name"].removeprefix("transfer_to_")
+                status.update(label=f"Handing off to {agent_name}...")
+                status.write(f"➡️ {agent_name}")
+            elif not event["name"].startswith("transfer_"):
+                status.write(f"🛠️ Running `{event['name']}`...")
+        elif kind == "on_tool_end" and not event["name"].startswith("transfer_"):
+            status.write(f"✅ `{event['name']}` finished")
+    if not written:
+        # the model did not stream tokens, fall back to the final message of the run
+        yield ai_data_scientist.get_state(config).values["messages"][-1].content
 
 
 # Initialize chat history
@@ -39,22 +118,11 @@ if prompt := st.chat_input("Ask me anything about your data!"):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
 
-    response = ai_data_scientist.invoke(
-        {
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        },
-        config={"thread_id": st.session_state.thread_id}
-    )
-    final_response = response["messages"][-1].content
-
-    # Display assistant response in chat message container
+    # Display assistant response in chat message container as it is generated
     with st.chat_message("assistant"):
-        st.write_stream(stream_response(final_response))
+        status = st.status("Thinking...")
+        final_response = st.write_stream(stream_response(prompt, status))
+        status.update(label="Done", state="complete", expanded=False)
 
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": final_response})
@@ -0,0 +1,320 @@
+"""Offline end-to-end benchmark of the graph, tool and SQL overhead.
+
+The LLM provider, vanna's OpenAI client and the embedding model are replaced by the deterministic stand-ins of
+benchmarks/fakes.py, the rest of the system (graph, tools, vanna retrieval, SQLite, python workers) is the real
+one. A sales database of configurable size is generated and ingested with ingest_data.py, then each scenario
+of the catalog is run and its per-node, per-tool and LLM call latency, memory and throughput are reported as JSON.
+
+Usage:
+    python -m benchmarks.e2e --rows 50000 --iterations 3 --output benchmark.json
+    python -m benchmarks.e2e --scenario analyst_query --scenario visualization --concurrency 4
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, redirect_stdout
+from dataclasses import dataclass
+from datetime import date, timedelta
+from unittest import mock
+from uuid import uuid4
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from benchmarks.fakes import FakeOpenAIClient, HashingEmbeddingFunction, ScriptedChatModel
+
+
+@dataclass
+class Scenario:
+    name: str
+    turns: list[str]
+
+
+SCENARIOS = [
+    Scenario("analyst_query", ["What are the total sales generated in this fy?"]),
+    Scenario("visualization", ["Plot the monthly sales by category"]),
+    Scenario("coder_regression", ["Use Regression models to predict the total sales next year"]),
+    Scenario("slides", ["Create slides to present the sales by category"]),
+    Scenario("multi_agent", [
+        "What were the top-performing categories in the last quarter, and can you use regression to predict "
+        "the sales of the top-performing categories in the coming quarter? finally, create a ppt to present "
+        "your result",
+    ]),
+    Scenario("follow_up", [
+        "What are the total sales generated in this fy?",
+        "Show the sales by customer gender",
+        "Use Regression models to predict the total sales next year",
+    ]),
+]
+
+CATEGORIES = ["Clothing", "Shoes", "Books", "Cosmetics", "Food & Beverage", "Toys", "Technology", "Souvenir"]
+MALLS = ["Kanyon", "Forum Istanbul", "Metrocity", "Metropol AVM", "Istinye Park", "Mall of Istanbul"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "Cash"]
+
+
+def generate_sales_csvs(directory: str, rows: int, seed: int = 0) -> list[str]:
+    """Sales and customer CSV files shaped like the kaggle dataset the app is built for"""
+    rng = random.Random(seed)
+    customers = max(1, rows // 2)
+    customer_path = os.path.join(directory, "customer_data.csv")
+    with open(customer_path, "w") as f:
+        f.write("customer_id,gender,age,payment_method\n")
+        for i in range(customers):
+            f.write(f"C{i},{rng.choice(['Male', 'Female'])},{rng.randint(18, 69)},{rng.choice(PAYMENT_METHODS)}\n")
+
+    sales_path = os.path.join(directory, "sales_data.csv")
+    start = date(2021, 1, 1)
+    with open(sales_path, "w") as f:
+        f.write("invoice_no,customer_id,category,quantity,price,invoice_date,shopping_mall\n")
+        for i in range(rows):
+            invoice_date = start + timedelta(days=rng.randrange(730))
+            f.write(
+                f"I{i},C{rng.randrange(customers)},{rng.choice(CATEGORIES)},{rng.randint(1, 5)},"
+                f"{rng.uniform(5, 5000):.2f},{invoice_date:%d-%m-%Y},{rng.choice(MALLS)}\n"
+            )
+    return [sales_path, customer_path]
+
+
+class LatencyRecorder(BaseCallbackHandler):
+    """Collect the duration of every graph node, tool and LLM call of the runs it is attached to"""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self._started: dict = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, key: str):
+        with self._lock:
+            self._started[run_id] = (key, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                key, start = started
+                self.samples[key].append((time.perf_counter() - start) * 1000)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs):
+        metadata = metadata or {}
+        namespace = metadata.get("langgraph_checkpoint_ns", "")
+        # the node itself, not the runnables it is made of nor the run of a subgraph inside its node
+        if name is None or name != metadata.get("langgraph_node") or metadata.get("checkpoint_ns") == namespace:
+            return
+        # e.g. data_analyst_agent/tools for the tools node of the data analyst subgraph
+        path = "/".join(part.split(":")[0] for part in namespace.split("|")) or name
+        self._start(run_id, f"node:{path}")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, name=None, **kwargs):
+        self._start(run_id, f"tool:{name or serialized.get('name')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm:chat_model")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+def summarize_samples(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "total_ms": sum(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+def rss_mb() -> float:
+    """Resident memory of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (FileNotFoundError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_scenario(app, scenario: Scenario) -> tuple[float, LatencyRecorder]:
+    """Run the turns of the scenario on a new conversation, return the wall time and the recorded latencies"""
+    recorder = LatencyRecorder()
+    thread_id = f"benchmark-{scenario.name}-{uuid4()}"
+    start = time.perf_counter()
+    for turn in scenario.turns:
+        result = app.invoke(
+            {"messages": [{"role": "user", "content": turn}]},
+            config={"configurable": {"thread_id": thread_id}, "callbacks": [recorder]},
+        )
+        if not result["messages"][-1].content:
+            raise RuntimeError(f"{scenario.name} produced no answer")
+    return time.perf_counter() - start, recorder
+
+
+def benchmark_scenario(app, scenario: Scenario, iterations: int, concurrency: int) -> dict:
+    """Sequential iterations for latency (the first one runs with cold caches), then a concurrent batch"""
+    rss_before = rss_mb()
+    wall_seconds = []
+    samples = defaultdict(list)
+    for _ in range(iterations):
+        seconds, recorder = run_scenario(app, scenario)
+        wall_seconds.append(seconds)
+        for key, values in recorder.samples.items():
+            samples[key].extend(values)
+
+    report = {
+        "turns": len(scenario.turns),
+        "iterations": iterations,
+        "cold_seconds": wall_seconds[0],
+        "warm_median_seconds": statistics.median(wall_seconds[1:]) if iterations > 1 else None,
+        "latency": {key: summarize_samples(values) for key, values in sorted(samples.items())},
+    }
+    if concurrency > 1:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(lambda _: run_scenario(app, scenario), range(concurrency)))
+        elapsed = time.perf_counter() - start
+        report["throughput"] = {
+            "concurrency": concurrency,
+            "seconds": elapsed,
+            "scenarios_per_second": concurrency / elapsed,
+            "turns_per_second": concurrency * len(scenario.turns) / elapsed,
+        }
+    report["memory"] = {"rss_before_mb": rss_before, "rss_after_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000, help="rows of the generated sales table")
+    parser.add_argument("--iterations", type=int, default=3, help="sequential runs of each scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="also run this many copies concurrently")
+    parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS],
+                        help="scenarios to run, all by default")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="simulated provider latency per call")
+    parser.add_argument("--no-caches", action="store_true",
+                        help="disable the sql, result, retrieval, code and execution caches")
+    parser.add_argument("--no-router", action="store_true", help="send every request through the supervisor")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    db_name = os.path.join(workdir, "sales.db")
+    # settings read when the agents are imported, so they are set first
+    os.environ.update({
+        "SQLITE_DATABASE_NAME": db_name,
+        "MODEL_NAME": "scripted-fake",
+        "OUTPUT_DIRECTORY": os.path.join(workdir, "output"),
+        "CHECKPOINT_DB_PATH": ":memory:",
+        "ARTIFACT_DIR": os.path.join(workdir, "artifacts"),
+        "QUERY_LOG_PATH": os.path.join(workdir, "query_log.db"),
+        "ROUTER_LOG_PATH": os.path.join(workdir, "routing_log.db"),
+        "EXECUTION_CACHE_PATH": os.path.join(workdir, "execution_cache.db"),
+        "MODEL_REGISTRY_DIR": os.path.join(workdir, "models"),
+        "CHART_CACHE_DIR": os.path.join(workdir, "charts"),
+        # image export needs a browser, not measured here
+        "CHART_PREFETCH_ENABLED": "false",
+        "LLM_CACHE_ENABLED": "false",
+        "TRACE_PATH": os.path.join(workdir, "traces.jsonl"),
+    })
+    if args.no_caches:
+        for setting in ("SQL_CACHE_ENABLED", "SQL_RESULT_CACHE_ENABLED", "RETRIEVAL_CACHE_ENABLED",
+                        "EXECUTION_CACHE_ENABLED", "CODE_CACHE_ENABLED"):
+            os.environ[setting] = "false"
+    if args.no_router:
+        os.environ["ROUTER_ENABLED"] = "false"
+
+    # the agents report progress with print, keep stdout for the report
+    with redirect_stdout(sys.stderr):
+        report = run(args, workdir, db_name)
+        print(f"Spans of the runs: python -m agents.tracing --path {os.environ['TRACE_PATH']}")
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+def run(args, workdir: str, db_name: str) -> dict:
+    """Generate and ingest the data, build the system with the fakes patched in and run the scenarios"""
+    from ingest_data import ingest
+    from train import train
+    from agents.data_analyst import DataAnalystVanna
+
+    setup = {}
+    start = time.perf_counter()
+    csv_files = generate_sales_csvs(workdir, args.rows)
+    setup["generate_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    ingest(csv_files, db_name)
+    setup["ingest_seconds"] = time.perf_counter() - start
+
+    llm = ScriptedChatModel(latency_ms=args.llm_latency_ms, output_dir=os.environ["OUTPUT_DIRECTORY"])
+    client = FakeOpenAIClient(latency_ms=args.llm_latency_ms)
+    with ExitStack() as patches:
+        patches.enter_context(mock.patch("agents.llm.llm.build_llm", return_value=llm))
+        patches.enter_context(mock.patch("agents.data_analyst.get_llm_client", return_value=client))
+        vn = DataAnalystVanna(config={
+            "model": "scripted-fake", "client": "in-memory", "embedding_function": HashingEmbeddingFunction(),
+        })
+        vn.connect_to_sqlite(db_name)
+        patches.enter_context(mock.patch("agents.data_analyst.get_vanna", return_value=vn))
+        patches.enter_context(mock.patch("agents.coder.get_vanna", return_value=vn))
+        patches.enter_context(mock.patch("agents.supervisor.get_vanna", return_value=vn))
+
+        start = time.perf_counter()
+        train(vn)
+        setup["train_seconds"] = time.perf_counter() - start
+
+        from agents.repl_pool import get_repl_pool
+        from agents.supervisor import get_ai_data_scientist
+
+        start = time.perf_counter()
+        app = get_ai_data_scientist(warm=False)
+        get_repl_pool()
+        setup["build_seconds"] = time.perf_counter() - start
+
+        scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "setup": setup,
+            "scenarios": {
+                scenario.name: benchmark_scenario(app, scenario, args.iterations, args.concurrency)
+                for scenario in scenarios
+            },
+        }
+        get_repl_pool().close()
+    return report
+
+
+if __name__ == "__main__":
+    main()
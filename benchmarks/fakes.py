@@ -0,0 +1,261 @@
+"""Deterministic local stand-ins for the LLM provider and the embedding model, used by the offline benchmarks.
+
+The fake chat model plays every role of the system (supervisor, agents, code generation, summaries) from the
+conversation it is given, so whole graph runs exercise the real tools, database and workers without any
+network call. `latency_ms` adds a fixed delay per call to model a provider when needed.
+"""
+import hashlib
+import json
+import math
+import re
+import time
+from types import SimpleNamespace
+from typing import Any
+
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# agent picked by the supervisor for each kind of request, in the order they are consulted
+AGENT_KEYWORDS = {
+    "data_analyst_agent": ("what", "plot", "chart", "visuali", "top", "show"),
+    "coder_agent": ("regression", "predict", "forecast"),
+    "slides_generator_agent": ("slide", "ppt", "presentation"),
+}
+
+SQL_BY_KEYWORD = [
+    (("plot", "chart", "monthly"),
+     "SELECT invoice_date_month AS month, category, SUM(price * quantity) AS sales FROM sales_data "
+     "WHERE invoice_date_year = 2022 GROUP BY invoice_date_month, category ORDER BY month"),
+    (("top",),
+     "SELECT category, SUM(price * quantity) AS sales FROM sales_data "
+     "WHERE invoice_date_year = 2022 AND invoice_date_quarter = 4 GROUP BY category ORDER BY sales DESC LIMIT 5"),
+    (("customer", "gender"),
+     "SELECT c.gender, SUM(s.price * s.quantity) AS sales FROM sales_data s "
+     "JOIN customer_data c ON s.customer_id = c.customer_id GROUP BY c.gender"),
+]
+HANDLE = re.compile(r"\b(?:df|fig)-[0-9a-f]{16}\b")
+DEFAULT_SQL = "SELECT SUM(price * quantity) AS total_sales FROM sales_data WHERE invoice_date_fiscal_year = 2022"
+
+REGRESSION_CODE = """
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+query = (
+    "SELECT invoice_date_year * 12 + invoice_date_month AS period, SUM(price * quantity) AS sales "
+    "FROM sales_data GROUP BY period ORDER BY period"
+)
+model = models.fit(LinearRegression(), query, features=["period"], target="sales", name="sales_trend")
+last = db.run_sql(f"SELECT max(period) AS period FROM ({query})")["period"][0]
+next_year = pd.DataFrame({"period": np.arange(last + 1, last + 13)})
+print("predicted sales next year:", float(model.predict(next_year).sum()))
+"""
+
+SLIDES_CODE = """
+import os
+from pptx import Presentation
+from pptx.util import Inches
+
+by_category = db.run_sql(
+    "SELECT category, SUM(price * quantity) AS sales FROM sales_data GROUP BY category ORDER BY sales DESC"
+)
+presentation = Presentation()
+title = presentation.slides.add_slide(presentation.slide_layouts[0])
+title.shapes.title.text = "Sales review"
+slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+slide.shapes.title.text = "Sales by category"
+table = slide.shapes.add_table(len(by_category) + 1, 2, Inches(1), Inches(1.5), Inches(8), Inches(4)).table
+table.cell(0, 0).text, table.cell(0, 1).text = "Category", "Sales"
+for i, row in enumerate(by_category.itertuples(index=False), start=1):
+    table.cell(i, 0).text, table.cell(i, 1).text = str(row.category), f"{row.sales:,.0f}"
+path = os.path.join({output_dir!r}, "sales_review.pptx")
+presentation.save(path)
+print("saved", path)
+"""
+
+PLOTLY_CODE = "```python\nimport plotly.express as px\nfig = px.bar(df, x=df.columns[0], y=df.columns[-1])\n```"
+
+
+def pick_sql(question: str) -> str:
+    question = question.lower()
+    for keywords, sql in SQL_BY_KEYWORD:
+        if any(keyword in question for keyword in keywords):
+            return sql
+    return DEFAULT_SQL
+
+
+def _tool_call(name: str, args: dict, key: str) -> dict:
+    return {"name": name, "args": args, "id": "call_" + hashlib.sha256(f"{name}{key}".encode()).hexdigest()[:12]}
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model answering from the conversation, recognising each role by its system prompt"""
+
+    latency_ms: float = 0
+    output_dir: str = "."
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        tool_names = [tool["function"]["name"] for tool in kwargs.get("tools", [])]
+        system = messages[0].content if messages and messages[0].type == "system" else ""
+        if "Code" in tool_names:
+            message = self._generate_code(system, messages)
+        elif "Plan" in tool_names:
+            message = self._plan(messages)
+        elif "DeckOutline" in tool_names:
+            message = self._outline(messages)
+        elif system.startswith("You maintain the running summary"):
+            message = AIMessage("The user asked about sales, the agents answered with queries, models and slides.")
+        elif system.startswith("You are a team supervisor"):
+            message = self._supervise(messages)
+        else:
+            message = self._act(messages, tool_names)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _current_turn(messages: list[BaseMessage]) -> tuple[str, list[BaseMessage]]:
+        for i in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[i], HumanMessage):
+                return messages[i].content, messages[i + 1:]
+        return "", messages
+
+    def _supervise(self, messages: list[BaseMessage]) -> AIMessage:
+        question, turn = self._current_turn(messages)
+        consulted = {call["name"].removeprefix("transfer_to_")
+                     for message in turn if isinstance(message, AIMessage) for call in message.tool_calls}
+        # agents that already answered in this turn, e.g. the steps of a plan
+        consulted |= {message.name for message in turn if isinstance(message, AIMessage) and message.name}
+        for agent, keywords in AGENT_KEYWORDS.items():
+            if agent not in consulted and any(keyword in question.lower() for keyword in keywords):
+                return AIMessage("", tool_calls=[_tool_call(f"transfer_to_{agent}", {}, f"{question}{len(messages)}")])
+        answers = [m.content for m in turn if isinstance(m, AIMessage) and m.content and not m.tool_calls]
+        return AIMessage("Here is what the team found:\n" + "\n".join(answers[-3:]))
+
+    def _act(self, messages: list[BaseMessage], tool_names: list[str]) -> AIMessage:
+        """An agent: call its tools in order, then answer with what they returned"""
+        question, turn = self._current_turn(messages)
+        # only the messages since this agent was handed the conversation
+        for i in range(len(turn) - 1, -1, -1):
+            if isinstance(turn[i], ToolMessage) and turn[i].name.startswith("transfer_to_"):
+                turn = turn[i + 1:]
+                break
+        results = {m.name: m.content for m in turn if isinstance(m, ToolMessage)}
+        key = f"{question}{len(messages)}"
+
+        if "answer_question_about_data" in tool_names:
+            if results:
+                return AIMessage(f"Result: {next(iter(results.values()))[:500]}")
+            wants_plot = any(keyword in question.lower() for keyword in ("plot", "chart", "visuali"))
+            name = "visualize_data" if wants_plot else "answer_question_about_data"
+            return AIMessage("", tool_calls=[_tool_call(name, {"user_input": question}, key)])
+
+        if "create_slides" in tool_names:
+            if "create_slides" in results:
+                return AIMessage(f"Done: {results['create_slides'][-500:]}")
+            # the handles of earlier results in the conversation, as a model would pass them on
+            handles = list(dict.fromkeys(HANDLE.findall(" ".join(str(m.content) for m in messages))))
+            user_input = f"{question} {' '.join(handles)}".strip()
+            return AIMessage("", tool_calls=[_tool_call("create_slides", {"user_input": user_input}, key)])
+
+        generate = "generate_python_pptx_code" if "generate_python_pptx_code" in tool_names else "generate_python_code"
+        if generate not in results:
+            return AIMessage("", tool_calls=[_tool_call(generate, {"user_input": question}, key)])
+        if "python_repl_tool" not in results:
+            return AIMessage("", tool_calls=[_tool_call("python_repl_tool", {"code": json.loads(results[generate])}, key)])
+        return AIMessage(f"Done: {json.loads(results['python_repl_tool'])[-500:]}")
+
+    def _plan(self, messages: list[BaseMessage]) -> AIMessage:
+        """One step per agent the request asks for, the slides depend on the other steps"""
+        question, _ = self._current_turn(messages)
+        steps = []
+        for agent, keywords in AGENT_KEYWORDS.items():
+            if any(keyword in question.lower() for keyword in keywords):
+                depends_on = [step["id"] for step in steps] if agent == "slides_generator_agent" else []
+                steps.append({"id": len(steps) + 1, "agent": agent, "instruction": question, "depends_on": depends_on})
+        return AIMessage("", tool_calls=[_tool_call("Plan", {"steps": steps}, f"{question}{len(messages)}")])
+
+    def _outline(self, messages: list[BaseMessage]) -> AIMessage:
+        """A title, a bullet slide and a chart of every result the request refers to"""
+        question, _ = self._current_turn(messages)
+        slides = [{"kind": "bullets", "title": "Summary", "bullets": [question]}]
+        slides += [{"kind": "chart", "title": f"Result {handle}", "handle": handle, "chart_type": "column"}
+                   for handle in dict.fromkeys(HANDLE.findall(question))]
+        args = {"title": "Sales review", "subtitle": "Generated offline", "file_name": "sales_review", "slides": slides}
+        return AIMessage("", tool_calls=[_tool_call("DeckOutline", args, f"{question}{len(messages)}")])
+
+    def _generate_code(self, system: str, messages: list[BaseMessage]) -> AIMessage:
+        if "PowerPoint" in system:
+            code = SLIDES_CODE.replace("{output_dir!r}", repr(self.output_dir))
+        else:
+            code = REGRESSION_CODE
+        args = {"prefix": "generated offline", "code": code}
+        return AIMessage("", tool_calls=[_tool_call("Code", args, str(len(messages)))])
+
+
+class FakeOpenAIClient:
+    """Replaces the OpenAI client of vanna: sql, summaries and plotly code without a provider"""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: list[dict], **kwargs) -> SimpleNamespace:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        prompt = messages[-1]["content"]
+        if "plotly" in prompt:
+            content = PLOTLY_CODE
+        elif "summarize" in prompt.lower():
+            content = "The query returned the requested figures."
+        else:
+            content = pick_sql(prompt)
+        return SimpleNamespace(choices=[_Choice(content)])
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = SimpleNamespace(content=content)
+
+    def __contains__(self, key):
+        # vanna checks `"text" in choice` for completion style responses
+        return False
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    """Bag of words hashed into a fixed size, l2 normalized vector. Deterministic and needs no model download"""
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for text in input:
+            vector = [0.0] * self.dimensions
+            for token in re.findall(r"\w+", text.lower()):
+                digest = hashlib.md5(token.encode()).digest()
+                vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return "hashing"
+
+    def get_config(self) -> dict:
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config: dict) -> "HashingEmbeddingFunction":
+        return HashingEmbeddingFunction(config.get("dimensions", 384))
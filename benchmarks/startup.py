@@ -0,0 +1,67 @@
+"""Startup benchmark: cold import time of the package and time to the first answer.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --question "What are the total sales generated in this fy?"
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def measure_cold_import(module: str, runs: int) -> list[float]:
+    """Import the module in a fresh interpreter each run, so nothing is cached in-process"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure_first_answer(question: str) -> dict:
+    """Time the import, graph construction and first invocation in this process"""
+    start = time.perf_counter()
+    from agents.supervisor import get_ai_data_scientist
+    imported = time.perf_counter()
+    ai_data_scientist = get_ai_data_scientist()
+    built = time.perf_counter()
+    ai_data_scientist.invoke(
+        {"messages": [{"role": "user", "content": question}]},
+        config={"thread_id": "startup-benchmark"},
+    )
+    answered = time.perf_counter()
+    return {
+        "import_seconds": imported - start,
+        "build_seconds": built - imported,
+        "first_answer_seconds": answered - built,
+        "time_to_first_answer_seconds": answered - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="agents.supervisor")
+    parser.add_argument("--question", default=None, help="also measure time to the first answer (calls the LLM)")
+    args = parser.parse_args()
+
+    timings = measure_cold_import(args.module, args.runs)
+    report = {
+        "cold_import": {
+            "module": args.module,
+            "runs": args.runs,
+            "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings),
+            "max_seconds": max(timings),
+        }
+    }
+    if args.question:
+        report["first_answer"] = measure_first_answer(args.question)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,41 @@
+import argparse
 import glob
+import hashlib
 import os
-
 import sqlite3
-import kagglehub
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 
 from dotenv import load_dotenv
 
 load_dotenv(".env")
-os.makedirs("data", exist_ok=True)
 
-# Download data
-path = kagglehub.dataset_download("dataceo/sales-and-customer-data")
-print("Path to dataset files:", path)
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "100000"))
+SAMPLE_ROWS = int(os.getenv("INGEST_SAMPLE_ROWS", "10000"))
+
+# bookkeeping of ingested files, prefixed with an underscore so it is not trained as a business table
+MANIFEST_TABLE = "_ingest_manifest"
+# bump when the way files are loaded changes, so unchanged files are loaded again
+INGEST_FORMAT_VERSION = 2
 
-# create a sqlite database
-db_name = os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db")
-conn = sqlite3.connect(db_name)
-cursor = conn.cursor()
+# formats tried to detect date columns, day first formats win ties as that is what our extracts use
+DATE_FORMATS = ["%d-%m-%Y", "%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d", "%m-%d-%Y", "%m/%d/%Y", "%d.%m.%Y"]
+DATE_MATCH_RATIO = 0.95
+
+# generated period columns added for every date column, {col} is the ISO yyyy-MM-dd date column
+_YEAR = "CAST(substr({col}, 1, 4) AS INTEGER)"
+_MONTH = "CAST(substr({col}, 6, 2) AS INTEGER)"
+DATE_PART_COLUMNS = {
+    "year": _YEAR,
+    "month": _MONTH,
+    "quarter": f"(({_MONTH} + 2) / 3)",
+    # financial year starts in april, named after the calendar year it starts in
+    "fiscal_year": f"(CASE WHEN {_MONTH} >= 4 THEN {_YEAR} ELSE {_YEAR} - 1 END)",
+}
+DATE_PART_INDEXES = [["fiscal_year"], ["year", "quarter"], ["year", "month"]]
 
 
 def infer_datatype(series):
@@ -32,24 +50,223 @@ def infer_datatype(series):
         return 'TEXT'
 
 
-def import_csv_to_db(csv_file, table_name):
-    df = pd.read_csv(csv_file)
-    column_types = {col: infer_datatype(df[col]) for col in df.columns}
-    # Create table with inferred types
-    columns_with_types = ', '.join(f"{col} {dtype}" for col, dtype in column_types.items())
-    create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_with_types});"
-    cursor.execute(create_table_query)
-    # Insert data into the table
-    df.to_sql(table_name, conn, if_exists='append', index=False)
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def file_hash(path: str) -> str:
+    """sha256 of the ingestion format version and the file content, read in 1MB blocks"""
+    digest = hashlib.sha256(f"{INGEST_FORMAT_VERSION}\n".encode())
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def detect_date_format(series: pd.Series):
+    """Return the format almost all values of a text column parse with, or None if it is not a date column"""
+    values = series.dropna().astype(str)
+    if values.empty or pd.api.types.is_numeric_dtype(series):
+        return None
+    best_format, best_ratio = None, 0.0
+    for date_format in DATE_FORMATS:
+        ratio = pd.to_datetime(values, format=date_format, errors="coerce").notna().mean()
+        if ratio > best_ratio:
+            best_format, best_ratio = date_format, ratio
+    return best_format if best_ratio >= DATE_MATCH_RATIO else None
+
+
+def infer_column_types(csv_file: str) -> tuple[dict, dict]:
+    """Infer the column types and the date columns from the first rows of the file instead of loading all of it"""
+    sample = pd.read_csv(csv_file, nrows=SAMPLE_ROWS)
+    column_types = {col: infer_datatype(sample[col]) for col in sample.columns}
+    date_formats = {}
+    for col, dtype in column_types.items():
+        if dtype == "TEXT" and (date_format := detect_date_format(sample[col])) is not None:
+            date_formats[col] = date_format
+    return column_types, date_formats
+
+
+def normalize_dates(chunk: pd.DataFrame, date_formats: dict) -> pd.DataFrame:
+    """Rewrite the date columns as ISO yyyy-MM-dd, values that do not parse are kept as they are"""
+    for col, date_format in date_formats.items():
+        parsed = pd.to_datetime(chunk[col], format=date_format, errors="coerce").dt.strftime("%Y-%m-%d")
+        chunk[col] = parsed.where(parsed.notna(), chunk[col])
+    return chunk
+
+
+def date_part_column(col: str, part: str) -> str:
+    return f"{col}_{part}"
+
+
+def create_table_query(table_name: str, column_types: dict, date_columns: list = (), schema: str = "main") -> str:
+    columns_with_types = [f"{quote(col)} {dtype}" for col, dtype in column_types.items()]
+    for col in date_columns:
+        for part, expression in DATE_PART_COLUMNS.items():
+            columns_with_types.append(
+                f"{quote(date_part_column(col, part))} INTEGER "
+                f"GENERATED ALWAYS AS ({expression.format(col=quote(col))}) VIRTUAL"
+            )
+    return f"CREATE TABLE {schema}.{quote(table_name)} ({', '.join(columns_with_types)});"
+
+
+def create_date_indexes(conn: sqlite3.Connection, table_name: str, date_columns: list):
+    """Index the date columns and their generated period columns so date range filters do not full-scan"""
+    for col in date_columns:
+        index_columns = [[col]] + [[date_part_column(col, part) for part in parts] for parts in DATE_PART_INDEXES]
+        for columns in index_columns:
+            index_name = quote(f"idx_{table_name}_{'_'.join(columns)}")
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS main.{index_name} "
+                f"ON {quote(table_name)} ({', '.join(quote(c) for c in columns)})"
+            )
+
+
+def iter_records(chunk: pd.DataFrame):
+    """Rows of the chunk as tuples of python values, with missing values as NULL"""
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def stage_csv(csv_file: str, table_name: str, staging_dir: str) -> dict:
+    """Load one CSV into its own throw-away database, runs in a worker process.
+
+    The staging database has no journal and no fsync, and rows are streamed in chunks with executemany
+    inside a single transaction, so memory stays bounded by the chunk size.
+    """
+    column_types, date_formats = infer_column_types(csv_file)
+    staging_db = os.path.join(staging_dir, f"{table_name}.db")
+    conn = sqlite3.connect(staging_db, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    conn.execute(create_table_query(table_name, column_types))
+    insert_query = f"INSERT INTO {quote(table_name)} VALUES ({', '.join('?' * len(column_types))})"
+    rows = 0
+    conn.execute("BEGIN")
+    for chunk in pd.read_csv(csv_file, chunksize=CHUNK_SIZE):
+        conn.executemany(insert_query, iter_records(normalize_dates(chunk, date_formats)))
+        rows += len(chunk)
+    conn.execute("COMMIT")
+    conn.close()
+    return {
+        "table_name": table_name,
+        "staging_db": staging_db,
+        "column_types": column_types,
+        "date_columns": list(date_formats),
+        "rows": rows,
+    }
+
+
+def ensure_manifest(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} "
+        "(table_name TEXT PRIMARY KEY, source TEXT, sha256 TEXT, rows INTEGER, ingested_at TEXT)"
+    )
+
+
+def is_up_to_date(conn: sqlite3.Connection, table_name: str, sha256: str) -> bool:
+    """The table exists and was loaded from a file with the same content"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    loaded = conn.execute(f"SELECT sha256 FROM {MANIFEST_TABLE} WHERE table_name = ?", (table_name,)).fetchone()
+    return bool(exists) and loaded is not None and loaded[0] == sha256
+
+
+def merge_staged(conn: sqlite3.Connection, staged: dict, source: str, sha256: str):
+    """Replace the table with the staged one in a single transaction"""
+    table_name = staged["table_name"]
+    columns = ", ".join(quote(col) for col in staged["column_types"])
+    conn.execute("ATTACH DATABASE ? AS staged", (staged["staging_db"],))
+    try:
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS main.{quote(table_name)}")
+        conn.execute(create_table_query(table_name, staged["column_types"], staged["date_columns"]))
+        conn.execute(
+            f"INSERT INTO main.{quote(table_name)} ({columns}) "
+            f"SELECT {columns} FROM staged.{quote(table_name)}"
+        )
+        create_date_indexes(conn, table_name, staged["date_columns"])
+        conn.execute(
+            f"INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, datetime('now'))",
+            (table_name, source, sha256, staged["rows"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.execute("DETACH DATABASE staged")
+    os.remove(staged["staging_db"])
+
+
+def ingest(csv_files: list[str], db_name: str, workers: int = None, force: bool = False):
+    """Load the CSV files into the database, one table per file.
+
+    Files whose content hash matches the last ingestion are skipped, changed files replace their table, so
+    running the ingestion again never duplicates rows. Files are staged in parallel worker processes and
+    merged one by one by this process, the only writer of the database.
+    """
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    ensure_manifest(conn)
+
+    pending = {}
+    for csv_file in csv_files:
+        table_name = os.path.basename(csv_file).split(".")[0]
+        sha256 = file_hash(csv_file)
+        if not force and is_up_to_date(conn, table_name, sha256):
+            print(f"Skipping {csv_file}, {table_name} is up to date")
+            continue
+        pending[table_name] = (csv_file, sha256)
+
+    staging_dir = tempfile.mkdtemp(prefix="ingest-", dir=os.path.dirname(os.path.abspath(db_name)))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(stage_csv, csv_file, table_name, staging_dir)
+                for table_name, (csv_file, _) in pending.items()
+            ]
+            for future in as_completed(futures):
+                staged = future.result()
+                csv_file, sha256 = pending[staged["table_name"]]
+                merge_staged(conn, staged, csv_file, sha256)
+                print(f"Loaded {staged['rows']} rows from {csv_file} into {staged['table_name']}")
+    finally:
+        for leftover in glob.glob(os.path.join(staging_dir, "*")):
+            os.remove(leftover)
+        os.rmdir(staging_dir)
+
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the CSV files into the SQLite database")
+    parser.add_argument("--workers", type=int, default=None, help="number of files staged in parallel")
+    parser.add_argument("--force", action="store_true", help="reload every file even if it is unchanged")
+    parser.add_argument("--skip-download", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs("data", exist_ok=True)
+
+    if not args.skip_download:
+        import kagglehub
+
+        # Download data
+        path = kagglehub.dataset_download("dataceo/sales-and-customer-data")
+        print("Path to dataset files:", path)
+
+    # create a sqlite database
+    db_name = os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db")
 
+    # import data to db
+    start = time.perf_counter()
+    csv_files = glob.glob("data/**/*.csv", recursive=True)
+    ingest(csv_files, db_name, workers=args.workers, force=args.force)
 
-# import data to db
-csv_files = glob.glob("data/**/*.csv", recursive=True)
-for csv_file in csv_files:
-    table_name = os.path.basename(csv_file).split(".")[0]
-    import_csv_to_db(csv_file, table_name)
+    print(f"Database '{db_name}' created in {time.perf_counter() - start:.1f}s.")
 
-conn.commit()
-conn.close()
 
-print(f"Database '{db_name}' created.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from agents.artifacts import ArtifactStore
+
+
+def frame(i: int) -> pd.DataFrame:
+    return pd.DataFrame({"category": [f"c{i}"] * 100, "sales": range(100)})
+
+
+def age(store: ArtifactStore, handle: str, seconds: float):
+    mtime = time.time() - seconds
+    os.utime(store.path(handle), (mtime, mtime))
+
+
+def test_round_trip_and_content_addressing(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    handle = store.put_dataframe(frame(1))
+    assert store.put_dataframe(frame(1)) == handle
+    pd.testing.assert_frame_equal(store.load(handle), frame(1))
+    figure = store.put_figure('{"data": [], "layout": {}}')
+    assert store.load(figure) == {"data": [], "layout": {}}
+
+
+def test_least_recently_used_artifacts_are_evicted_over_the_budget(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    first, second = store.put_dataframe(frame(1)), store.put_dataframe(frame(2))
+    # room for two and a half of the frames
+    store.budget.max_bytes = int(os.path.getsize(store.path(first)) * 2.5)
+    age(store, first, 20)
+    age(store, second, 10)
+    # reading the first marks it as used, the second is the least recently used
+    store.load(first)
+    third = store.put_dataframe(frame(3))
+    assert os.path.exists(store.path(first)) and os.path.exists(store.path(third))
+    with pytest.raises(FileNotFoundError):
+        store.load(second)
+
+
+def test_artifacts_unused_for_the_ttl_are_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=3600)
+    old = store.put_dataframe(frame(1))
+    age(store, old, 7200)
+    store.budget.evict()
+    assert not os.path.exists(store.path(old))
@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from agents.charts import SLIDE_IMAGE_HEIGHT, SLIDE_IMAGE_WIDTH, ChartRenderer
+
+FIGURE = '{"data": [{"type": "bar", "x": ["a", "b"], "y": [1, 2]}], "layout": {}}'
+
+
+@pytest.fixture
+def renderer(tmp_path):
+    renderer = ChartRenderer(str(tmp_path), prefetch_backoff=60)
+    yield renderer
+    renderer.close()
+
+
+def failed_future() -> Future:
+    future = Future()
+    future.set_exception(TimeoutError("no browser"))
+    return future
+
+
+def test_cached_images_are_served_without_workers(renderer):
+    path = renderer.path(FIGURE, "svg")
+    with open(path, "w") as f:
+        f.write("<svg/>")
+    assert renderer.render(FIGURE, "svg") == path
+    assert renderer.render_many([FIGURE], "svg") == [path]
+    assert (renderer.hits, renderer.misses) == (2, 0)
+    assert renderer._executor is None
+
+
+def test_cache_key_covers_format_and_size(renderer):
+    paths = {renderer.path(FIGURE), renderer.path(FIGURE, "svg"), renderer.path(FIGURE, width=800),
+             renderer.path(FIGURE.replace("2]", "3]"))}
+    assert len(paths) == 4
+    with pytest.raises(ValueError):
+        renderer.path(FIGURE, "gif")
+
+
+def test_prefetch_backs_off_after_a_failed_export(renderer, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(renderer, "submit", lambda *args: submitted.append(args))
+    renderer.prefetch(FIGURE)
+    assert submitted == [(FIGURE, "png", SLIDE_IMAGE_WIDTH, SLIDE_IMAGE_HEIGHT)]
+
+    renderer._forget(renderer.path(FIGURE), failed_future())
+    renderer.prefetch(FIGURE)
+    assert len(submitted) == 1
+
+    # not for good, prefetching resumes after the backoff
+    renderer._prefetch_paused_until = 0
+    renderer.prefetch(FIGURE)
+    assert len(submitted) == 2
+
+
+def test_least_recently_used_images_are_evicted(renderer):
+    renderer.budget.max_bytes = 250
+    figures = [FIGURE.replace("2]", f"{i}]") for i in range(3)]
+    for i, figure in enumerate(figures):
+        path = renderer.path(figure)
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        mtime = time.time() - 100 + i
+        os.utime(path, (mtime, mtime))
+        done = Future()
+        done.set_result(path)
+        renderer._forget(path, done)
+    assert [os.path.exists(renderer.path(figure)) for figure in figures] == [False, True, True]
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from agents.checkpointer import CompressedSerializer, open_checkpointer
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = open_checkpointer(str(tmp_path / "checkpoints.db"), keep_per_thread=2)
+    saver.setup()
+    yield saver
+    saver.close()
+
+
+def put(saver, thread_id, checkpoint_ns="", messages=("hi",)):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": list(messages)}
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}}
+    saved = saver.put(config, checkpoint, {}, {})
+    saver.put_writes(saved, [("messages", "next")], "task")
+    return saved
+
+
+def count(saver, table, thread_id):
+    with saver.cursor() as cur:
+        return cur.execute(f"SELECT count(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+
+def test_compressed_serializer_round_trip():
+    serde = CompressedSerializer(min_size=16)
+    small, large = {"a": 1}, {"text": "x" * 1000}
+    assert not serde.dumps_typed(small)[0].endswith("+zlib")
+    assert serde.dumps_typed(large)[0].endswith("+zlib")
+    assert serde.loads_typed(serde.dumps_typed(large)) == large
+
+
+def test_compact_keeps_the_latest_checkpoints_of_a_thread(saver):
+    saved = [put(saver, "t1") for _ in range(4)]
+    stats = saver.compact()
+    assert stats["old_checkpoints"] == 2
+    assert count(saver, "checkpoints", "t1") == 2
+    # writes of deleted checkpoints go with them
+    assert count(saver, "writes", "t1") == 2
+    latest = saver.get_tuple({"configurable": {"thread_id": "t1"}})
+    assert latest.config["configurable"]["checkpoint_id"] == saved[-1]["configurable"]["checkpoint_id"]
+    assert latest.checkpoint["channel_values"]["messages"] == ["hi"]
+
+
+def test_compact_drops_subgraph_checkpoints_of_finished_runs(saver):
+    put(saver, "t1", checkpoint_ns="agent:1")
+    put(saver, "t1")
+    assert saver.compact()["subgraph_checkpoints"] == 1
+    with saver.cursor() as cur:
+        assert cur.execute("SELECT checkpoint_ns FROM checkpoints").fetchall() == [("",)]
+
+
+def test_compact_deletes_idle_threads(saver):
+    put(saver, "idle")
+    put(saver, "active")
+    with saver.cursor() as cur:
+        cur.execute("UPDATE thread_activity SET updated_at = ? WHERE thread_id = 'idle'",
+                    (time.time() - saver.ttl_seconds - 1,))
+    assert saver.compact()["expired_threads"] == 1
+    assert count(saver, "checkpoints", "idle") == 0
+    assert count(saver, "checkpoints", "active") == 1
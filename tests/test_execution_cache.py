@@ -0,0 +1,76 @@
+import pytest
+
+from agents.cache.execution_cache import defined_names, free_names, is_volatile, normalize_code, parse_code
+
+
+def names(code: str) -> set[str]:
+    return free_names(parse_code(code))
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("df = db.run_sql('SELECT 1')\nprint(df.describe())", set()),
+    ("import pandas as pd\nframe = pd.DataFrame()\nprint(models, load_artifact)", set()),
+    ("df = df.dropna()\nprint(df.describe())", {"df"}),
+    ("total += 1\nprint(total)", {"total"}),
+    ("print(model.predict(X))", {"model", "X"}),
+    ("x = 1\nx += 1\nprint(x)", set()),
+    ("del df", {"df"}),
+])
+def test_free_names_reads_before_bindings(code, expected):
+    assert names(code) == expected
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("for x in range(3):\n    y = x\nprint(y)", {"y"}),
+    ("if flag:\n    m = 1\nelse:\n    m = 2\nprint(m)", {"flag"}),
+    ("if True:\n    m = 1\nprint(m)", {"m"}),
+    ("try:\n    import foo\nexcept ImportError:\n    foo = None\nprint(foo)", set()),
+    ("with open('a.txt') as f:\n    text = f.read()\nprint(text)", set()),
+])
+def test_free_names_branches_and_loops(code, expected):
+    assert names(code) == expected
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("def f(a):\n    return a + k\nk = 1\nprint(f(2))", set()),
+    ("def f(a):\n    return a + k\nprint(f(2))", {"k"}),
+    ("print([x * 2 for x in range(3)], (lambda z: z + w)(1))", {"w"}),
+])
+def test_free_names_scopes(code, expected):
+    assert names(code) == expected
+
+
+@pytest.mark.parametrize("code", [
+    "from datetime import datetime\nprint(datetime.now())",
+    "import datetime\nprint(datetime.date.today())",
+    "import pandas as pd\nprint(pd.Timestamp.now())",
+    "import time\nprint(time.time())",
+    "from time import perf_counter\nprint(perf_counter())",
+    "import random\nprint(random.choice([1, 2]))",
+    "import numpy as np\nprint(np.random.rand(3))",
+    "from numpy.random import default_rng\nprint(default_rng().random())",
+    "import uuid\nprint(uuid.uuid4())",
+])
+def test_is_volatile_clock_and_randomness(code):
+    assert is_volatile(parse_code(code))
+
+
+def test_is_volatile_deterministic_code():
+    code = "import numpy as np\ndf = db.run_sql('SELECT 1')\nprint(np.mean(df.values), df.describe())"
+    assert not is_volatile(parse_code(code))
+
+
+def test_defined_names():
+    tree = parse_code(
+        "import numpy as np\nfrom a.b import c\ndef f(x):\n    y = x\nclass K:\n    pass\nfor i in []:\n    pass"
+    )
+    assert defined_names(tree) == {"np", "c", "f", "x", "y", "K", "i"}
+
+
+def test_normalize_code_ignores_comments_and_formatting():
+    assert normalize_code(parse_code("x=1  # one\n\n\nprint( x )")) == normalize_code(parse_code("x = 1\nprint(x)"))
+
+
+def test_parse_code_strips_fences_and_rejects_syntax_errors():
+    assert parse_code("```python\nprint(1)\n```") is not None
+    assert parse_code("print(") is None
@@ -0,0 +1,42 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from agents import history
+from agents.history import compact_history
+
+SYSTEM = SystemMessage("You are a data analyst.")
+
+
+def turn(i, tool_result="rows"):
+    return [
+        HumanMessage(f"question {i}", id=f"q{i}"),
+        AIMessage("", tool_calls=[{"name": "run_sql", "args": {"sql": "SELECT 1"}, "id": f"call{i}"}], id=f"c{i}"),
+        ToolMessage(tool_result, tool_call_id=f"call{i}", id=f"t{i}"),
+        AIMessage(f"answer {i}", id=f"a{i}"),
+    ]
+
+
+def test_short_conversations_are_sent_as_they_are():
+    messages = turn(1) + turn(2)
+    assert compact_history(SYSTEM, messages, budget=10_000) == [SYSTEM] + messages
+
+
+def test_tool_results_of_earlier_turns_are_truncated():
+    long_result = "x" * (history.TOOL_RESULT_MAX_CHARS + 100)
+    compacted = compact_history(SYSTEM, turn(1, long_result) + turn(2, long_result), budget=10_000)
+    assert compacted[3].content.endswith("[100 characters of an earlier tool result removed]")
+    # the current turn is sent verbatim
+    assert compacted[7].content == long_result
+
+
+def test_older_turns_are_replaced_by_their_summary(monkeypatch):
+    summarized = []
+    monkeypatch.setattr(history, "summarize", lambda messages: summarized.append(messages) or "earlier summary")
+    monkeypatch.setattr(history, "SUMMARY_TOKENS", 10)
+    messages = [m for i in range(10) for m in turn(i, "r" * 400)]
+    compacted = compact_history(SYSTEM, messages, budget=600)
+    assert compacted[0].content.endswith("Summary of the earlier conversation:\nearlier summary")
+    kept = compacted[1:]
+    # cut at a user message, so no tool result is separated from its call
+    assert isinstance(kept[0], HumanMessage)
+    assert kept[-4:] == turn(9, "r" * 400)
+    assert summarized[0] + kept[:-4] == [history._truncate_tool_result(m) for m in messages[:-4]]
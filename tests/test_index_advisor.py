@@ -0,0 +1,15 @@
+from agents.index_advisor import QueryLog
+
+
+def test_query_log_keeps_the_latest_queries(tmp_path):
+    log = QueryLog(str(tmp_path / "query_log.db"), max_rows=5)
+    for i in range(12):
+        log.record(f"SELECT {i} FROM sales_data", 1.0, 1)
+    assert sorted(int(q["sql"].split()[1]) for q in log.workload()) == list(range(7, 12))
+
+
+def test_query_log_workload_groups_equivalent_queries(tmp_path):
+    log = QueryLog(str(tmp_path / "query_log.db"))
+    log.record("SELECT * FROM sales_data WHERE price > 10", 2.0, 1)
+    log.record("select *  from sales_data  -- cheap\n where price > 10", 4.0, 1)
+    assert [(q["calls"], q["total_ms"]) for q in log.workload()] == [(2, 6.0)]
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+from ingest_data import MANIFEST_TABLE, ingest
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_text("invoice_date,amount\n05-01-2023,10\n20-04-2023,20\n")
+    return path
+
+
+def rows(db_name, sql):
+    with sqlite3.connect(db_name) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def test_ingest_again_does_not_duplicate_rows(tmp_path, csv_file, capsys):
+    db_name = str(tmp_path / "data.db")
+    ingest([str(csv_file)], db_name, workers=1)
+    ingest([str(csv_file)], db_name, workers=1)
+    assert "sales is up to date" in capsys.readouterr().out
+    assert rows(db_name, "SELECT count(*) FROM sales") == [(2,)]
+    assert rows(db_name, f"SELECT table_name, rows FROM {MANIFEST_TABLE}") == [("sales", 2)]
+
+
+def test_ingest_replaces_the_table_of_a_changed_file(tmp_path, csv_file):
+    db_name = str(tmp_path / "data.db")
+    ingest([str(csv_file)], db_name, workers=1)
+    csv_file.write_text("invoice_date,amount\n05-01-2023,10\n")
+    ingest([str(csv_file)], db_name, workers=1)
+    assert rows(db_name, "SELECT invoice_date, amount, invoice_date_fiscal_year FROM sales") == [("2023-01-05", 10, 2022)]
+    assert rows(db_name, f"SELECT rows FROM {MANIFEST_TABLE}") == [(1,)]
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from agents.model_registry import ModelRegistry, fit_fingerprint
+
+
+class Fits:
+    def __init__(self):
+        self.count = 0
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / "data.db")
+    with sqlite3.connect(db_name) as conn:
+        # as ingested, so reading the database leaves its version alone
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE sales (month INTEGER, amount REAL)")
+        conn.executemany("INSERT INTO sales VALUES (?, ?)", [(1, 10.0), (2, 20.0)])
+    return db_name
+
+
+@pytest.fixture
+def registry(tmp_path, db_name):
+    return ModelRegistry(str(tmp_path / "models"), db_name)
+
+
+def mean_model(fits):
+    def fit(df):
+        fits.count += 1
+        return {"mean": float(df["amount"].mean())}
+    return fit
+
+
+def test_fit_fingerprint_follows_code_and_closure():
+    assert fit_fingerprint(lambda df: df.mean()) == fit_fingerprint(lambda df: df.mean())
+    assert fit_fingerprint(lambda df: df.mean()) != fit_fingerprint(lambda df: df.median())
+    assert fit_fingerprint(mean_model(Fits())) != fit_fingerprint(mean_model(Fits()))
+
+
+def test_same_query_spec_and_fit_are_fitted_once(registry):
+    fits = Fits()
+    fit = mean_model(fits)
+    assert registry.get_or_fit("SELECT * FROM sales", "mean", fit) == {"mean": 15.0}
+    assert registry.get_or_fit("select *\nfrom sales;", "mean", fit) == {"mean": 15.0}
+    assert fits.count == 1
+
+
+def test_other_specs_and_fit_functions_are_fitted_again(registry):
+    fits = Fits()
+    fit = mean_model(fits)
+    registry.get_or_fit("SELECT * FROM sales", "mean", fit)
+    registry.get_or_fit("SELECT * FROM sales", "mean-v2", fit)
+    registry.get_or_fit("SELECT * FROM sales", "mean", lambda df: {"mean": float(df["amount"].mean()) + 1})
+    assert fits.count == 2
+    assert len(registry.list()) == 3
+
+
+def test_new_data_version_refits_and_replaces_the_model(registry, db_name):
+    fits = Fits()
+    fit = mean_model(fits)
+    registry.get_or_fit("SELECT * FROM sales", "mean", fit)
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("INSERT INTO sales VALUES (3, 30.0)")
+    assert registry.get_or_fit("SELECT * FROM sales", "mean", fit) == {"mean": 20.0}
+    assert fits.count == 2
+    assert len(registry.list()) == 1
+    assert registry.lookup(name="mean") == {"mean": 20.0}
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agents.planner import Plan, Step, execute_plan, looks_compound, order_steps
+
+AGENTS = ["data_analyst_agent", "coder_agent", "slides_generator_agent"]
+
+
+def plan(*steps):
+    return Plan(steps=[Step(id=i, agent=agent, instruction=f"step {i}", depends_on=deps) for i, agent, deps in steps])
+
+
+class FakeAgent:
+    """Answers with the instruction it got, tracking how many steps of its kind run at once"""
+
+    def __init__(self, tracker, fail=False):
+        self.tracker = tracker
+        self.fail = fail
+
+    def invoke(self, state, config):
+        with self.tracker["lock"]:
+            self.tracker["running"] += 1
+            self.tracker["peak"] = max(self.tracker["peak"], self.tracker["running"])
+        try:
+            time.sleep(0.05)
+            if self.fail:
+                raise RuntimeError("boom")
+            return {"messages": state["messages"] + [AIMessage(state["messages"][-1].content)]}
+        finally:
+            with self.tracker["lock"]:
+                self.tracker["running"] -= 1
+
+
+def tracker():
+    return {"lock": threading.Lock(), "running": 0, "peak": 0}
+
+
+def test_looks_compound():
+    assert looks_compound("plot monthly sales and make slides of the chart")
+    assert not looks_compound("how many orders are there")
+
+
+def test_order_steps_follows_dependencies_then_step_numbers():
+    steps = order_steps(plan((1, "slides_generator_agent", [2, 3]), (2, "data_analyst_agent", []),
+                             (3, "coder_agent", [])), AGENTS, 6)
+    assert [step.id for step in steps] == [2, 3, 1]
+
+
+@pytest.mark.parametrize("steps", [
+    [(1, "data_analyst_agent", [2]), (2, "coder_agent", [1])],
+    [(1, "data_analyst_agent", []), (2, "unknown_agent", [1])],
+    [(1, "data_analyst_agent", []), (2, "coder_agent", [3])],
+    [(1, "data_analyst_agent", []), (2, "coder_agent", [2])],
+    [(1, "data_analyst_agent", []), (1, "coder_agent", [])],
+    [(1, "data_analyst_agent", [])],
+    [(i, "data_analyst_agent", []) for i in range(1, 8)],
+], ids=["cycle", "unknown-agent", "unknown-dependency", "self-dependency", "duplicate-id", "too-few", "too-many"])
+def test_order_steps_rejects_invalid_plans(steps):
+    assert order_steps(plan(*steps), AGENTS, 6) is None
+
+
+def test_execute_plan_passes_results_to_dependent_steps():
+    t = tracker()
+    agents = {name: FakeAgent(t) for name in AGENTS}
+    steps = order_steps(plan((1, "data_analyst_agent", []), (2, "slides_generator_agent", [1])), AGENTS, 6)
+    outputs = execute_plan(steps, agents, [HumanMessage("question")], {})
+    assert outputs[1][-1].name == "data_analyst_agent"
+    assert "Result of step 1:\nstep 1" in outputs[2][-1].content
+
+
+def test_execute_plan_runs_independent_steps_at_the_same_time():
+    t = tracker()
+    agents = {"data_analyst_agent": FakeAgent(t)}
+    steps = order_steps(plan((1, "data_analyst_agent", []), (2, "data_analyst_agent", [])), AGENTS, 6)
+    execute_plan(steps, agents, [], {})
+    assert t["peak"] == 2
+
+
+def test_execute_plan_runs_repl_steps_one_after_another():
+    t = tracker()
+    agents = {"coder_agent": FakeAgent(t), "slides_generator_agent": FakeAgent(t)}
+    steps = order_steps(plan((1, "coder_agent", []), (2, "slides_generator_agent", [])), AGENTS, 6)
+    execute_plan(steps, agents, [], {})
+    assert t["peak"] == 1
+
+
+def test_execute_plan_skips_steps_after_a_failure():
+    slides = tracker()
+    agents = {"data_analyst_agent": FakeAgent(tracker(), fail=True), "slides_generator_agent": FakeAgent(slides)}
+    steps = order_steps(plan((1, "data_analyst_agent", []), (2, "slides_generator_agent", [1])), AGENTS, 6)
+    outputs = execute_plan(steps, agents, [], {})
+    assert "failed" in outputs[1][-1].content
+    assert "skipped" in outputs[2][-1].content
+    assert slides["peak"] == 0
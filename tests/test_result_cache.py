@@ -0,0 +1,78 @@
+import os
+
+import pandas as pd
+import pytest
+
+from agents.cache.result_cache import ResultCache, canonicalize_sql, database_version
+
+
+class CountingRunner:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, sql):
+        self.calls += 1
+        return pd.DataFrame({"n": [self.calls]})
+
+
+def test_canonicalize_sql_keeps_literals():
+    assert canonicalize_sql("SELECT *\n  FROM t -- all\nWHERE name = 'Bob';") == "select * from t where name = 'Bob'"
+
+
+@pytest.mark.parametrize("sql, cacheable", [
+    ("SELECT 1", True),
+    ("-- note\nWITH x AS (SELECT 1) SELECT * FROM x", True),
+    ("/* SELECT */ DELETE FROM t", False),
+    ("UPDATE t SET x = 1", False),
+])
+def test_only_read_only_statements_are_cacheable(sql, cacheable):
+    assert ResultCache.is_cacheable(sql) is cacheable
+
+
+def test_equivalent_sql_is_served_from_the_cache():
+    cache, run = ResultCache(1 << 20), CountingRunner()
+    cache.get_or_run("SELECT n FROM t", "v1", run)
+    df = cache.get_or_run("select n\nfrom t;", "v1", run)
+    assert run.calls == 1
+    df["n"] = 0
+    # callers get a copy, mutating it leaves the cached frame alone
+    assert cache.get_or_run("SELECT n FROM t", "v1", run)["n"].tolist() == [1]
+
+
+def test_a_new_database_version_runs_the_query_again():
+    cache, run = ResultCache(1 << 20), CountingRunner()
+    cache.get_or_run("SELECT n FROM t", "v1", run)
+    assert cache.get_or_run("SELECT n FROM t", "v2", run)["n"].tolist() == [2]
+    assert run.calls == 2
+    # the result of the old version is dropped rather than kept around
+    assert len(cache._entries) == 1
+
+
+def test_least_recently_used_results_are_evicted_by_size():
+    run = CountingRunner()
+    size = int(run("").memory_usage(index=True, deep=True).sum())
+    cache = ResultCache(2 * size)
+    cache.get_or_run("SELECT 1", "v1", run)
+    cache.get_or_run("SELECT 2", "v1", run)
+    cache.get_or_run("SELECT 1", "v1", run)
+    cache.get_or_run("SELECT 3", "v1", run)
+    assert cache.current_bytes <= cache.max_bytes
+    calls = run.calls
+    cache.get_or_run("SELECT 1", "v1", run)
+    assert run.calls == calls
+    cache.get_or_run("SELECT 2", "v1", run)
+    assert run.calls == calls + 1
+
+
+def test_database_version_changes_on_write(tmp_path):
+    db_name = str(tmp_path / "data.db")
+    with open(db_name, "wb") as f:
+        f.write(b"a")
+    before = database_version(db_name)
+    with open(f"{db_name}-wal", "wb") as f:
+        f.write(b"b")
+    assert database_version(db_name) != before
+    os.remove(f"{db_name}-wal")
+    open(f"{db_name}-wal", "wb").close()
+    # an empty WAL holds no changes
+    assert database_version(db_name) == before
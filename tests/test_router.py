@@ -0,0 +1,29 @@
+import pytest
+
+from agents.router import SUPERVISOR, Router, RoutingLog
+
+AGENTS = ["data_analyst_agent", "coder_agent", "slides_generator_agent"]
+
+
+@pytest.fixture
+def router(tmp_path):
+    # an empty decision log, the keyword rules decide
+    return Router(RoutingLog(str(tmp_path / "routing_log.db")), lambda text: [1.0, 0.0], AGENTS)
+
+
+@pytest.mark.parametrize("question, destination", [
+    ("What are the total sales generated in this fy?", "data_analyst_agent"),
+    ("Plot the monthly sales by category", "data_analyst_agent"),
+    ("Use regression to forecast next year's sales", "coder_agent"),
+    ("Make a powerpoint of the results", "slides_generator_agent"),
+    ("What does that mean?", SUPERVISOR),
+    ("Which one was better?", SUPERVISOR),
+    ("Plot the sales and then forecast them", SUPERVISOR),
+])
+def test_keyword_routes_of_a_first_request(router, question, destination):
+    assert router.route(question).destination == destination
+
+
+def test_keywords_do_not_route_follow_ups(router):
+    route = router.route("What are the total sales generated in this fy?", first_turn=False)
+    assert route.destination == SUPERVISOR
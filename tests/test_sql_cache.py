@@ -0,0 +1,55 @@
+import chromadb
+import pytest
+
+from agents.cache.sql_cache import SemanticSQLCache, normalize_question
+
+
+@pytest.fixture
+def version():
+    return {"value": "v1"}
+
+
+@pytest.fixture
+def cache(request, version):
+    # every question embeds to the same vector, so only the signature decides whether a near hit is served
+    return SemanticSQLCache(
+        chromadb.EphemeralClient(),
+        None,
+        lambda: version["value"],
+        collection_name=request.node.name.replace("[", "-").rstrip("]"),
+        embed=lambda text: [1.0, 0.0],
+    )
+
+
+def test_normalize_question():
+    assert normalize_question("  How many   Orders, in 2023? ") == "how many orders in 2023"
+
+
+def test_exact_hit_ignores_case_and_punctuation(cache):
+    cache.put("How many orders are there?", "SELECT COUNT(*) FROM orders")
+    assert cache.get("how many orders are there") == "SELECT COUNT(*) FROM orders"
+    assert cache.stats()["hits"] == 1
+
+
+def test_near_hit_is_served_when_numbers_and_qualifiers_match(cache):
+    cache.put("total sales in 2023 by region", "SELECT region, SUM(amount) FROM sales WHERE year = 2023")
+    assert cache.get("sales total per region in 2023") is not None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+@pytest.mark.parametrize("question", [
+    "total sales in 2024 by region",
+    "total sales in 2023 by region last month",
+    "top total sales in 2023 by region",
+], ids=["number", "period", "ranking"])
+def test_near_hit_is_refused_when_numbers_or_qualifiers_differ(cache, question):
+    cache.put("total sales in 2023 by region", "SELECT region, SUM(amount) FROM sales WHERE year = 2023")
+    assert cache.get(question) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_of_an_older_version_are_dropped(cache, version):
+    cache.put("how many orders are there", "SELECT COUNT(*) FROM orders")
+    version["value"] = "v2"
+    assert cache.get("how many orders are there") is None
+    assert cache.collection.count() == 0
@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+from agents.db import ConnectionPool
+from agents.sql_guard import SQLValidationError, SQLValidator
+
+
+@pytest.fixture
+def validator(tmp_path):
+    db_name = str(tmp_path / "sales.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE sales (invoice_no TEXT, customer_id TEXT, price REAL)")
+    conn.execute("CREATE TABLE customers (customer_id TEXT PRIMARY KEY, gender TEXT)")
+    conn.executemany("INSERT INTO sales VALUES (?, ?, ?)", [(f"I{i}", f"C{i % 50}", i) for i in range(2000)])
+    conn.executemany("INSERT INTO customers VALUES (?, ?)", [(f"C{i}", "F" if i % 2 else "M") for i in range(50)])
+    conn.commit()
+    conn.close()
+    return SQLValidator(ConnectionPool(db_name), max_scan_rows=1_000_000)
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("DELETE FROM sales", "Only SELECT"),
+    ("SELECT 1; SELECT 2", "single statement"),
+    ("SELECT * FROM orders", "no such table: orders"),
+    ("SELECT s.amount FROM sales s", "no such column: s.amount"),
+    ("SELECT nope FROM sales", "no such column: nope"),
+    ("SELECT * FROM sales a, sales b", "would read about"),
+    ("SELECT * FROM sales s WHERE s.price > (SELECT avg(t.price) FROM sales t WHERE t.customer_id = s.customer_id)",
+     "would read about"),
+])
+def test_rejected_queries(validator, sql, message):
+    with pytest.raises(SQLValidationError, match=message):
+        validator.validate(sql)
+
+
+def test_accepted_queries_and_estimates(validator):
+    assert validator.validate("SELECT sum(price) FROM sales").estimated_rows == 2000
+    joined = validator.validate(
+        "SELECT c.gender, sum(s.price) FROM sales s JOIN customers c ON c.customer_id = s.customer_id GROUP BY 1"
+    )
+    assert joined.tables == ["customers", "sales"]
+    # the customers are searched through their primary key, once per sale
+    assert joined.estimated_rows == 2000
+    cte = "WITH totals AS (SELECT customer_id, sum(price) AS total FROM sales GROUP BY 1) SELECT * FROM totals"
+    assert validator.validate(cte).tables == ["sales"]
+
+
+def test_schema_qualified_tables(validator):
+    assert validator.validate("SELECT count(*) FROM main.sales").tables == ["sales"]
+
+
+def test_correlated_subquery_runs_per_outer_row(validator):
+    validator.max_scan_rows = 0
+    validation = validator.validate(
+        "SELECT * FROM sales s WHERE s.price > (SELECT avg(t.price) FROM sales t WHERE t.customer_id = s.customer_id)"
+    )
+    assert validation.estimated_rows == 2000 + 2000 * 2000
+
+
+def test_estimate_reads_the_plan_format_of_older_sqlite(validator):
+    validator.validate("SELECT 1 FROM sales")
+    plan = [(2, 0, 0, "SCAN TABLE sales AS a"), (4, 0, 0, "SCAN TABLE sales AS b")]
+    assert validator._estimate(plan, {"a": "sales", "b": "sales"}) == 2000 * 2000
@@ -0,0 +1,44 @@
+import json
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from agents.tool_node import create_tool_node
+
+
+@tool
+def slow(seconds: float) -> str:
+    """Sleep for the given number of seconds"""
+    time.sleep(seconds)
+    return f"slept {seconds}"
+
+
+@tool
+def fail() -> str:
+    """Always raise"""
+    raise ValueError("bad input")
+
+
+def call_tools(node, *calls):
+    tool_calls = [{"name": name, "args": args, "id": f"call{i}"} for i, (name, args) in enumerate(calls)]
+    return node({"messages": [AIMessage("", tool_calls=tool_calls)]}, {})["messages"]
+
+
+def test_results_keep_the_order_of_the_tool_calls():
+    node = create_tool_node([slow], timeout=5)
+    started = time.monotonic()
+    messages = call_tools(node, ("slow", {"seconds": 0.3}), ("slow", {"seconds": 0.1}))
+    assert [m.tool_call_id for m in messages] == ["call0", "call1"]
+    assert [json.loads(m.content) for m in messages] == ["slept 0.3", "slept 0.1"]
+    # the calls run at the same time
+    assert time.monotonic() - started < 0.35
+
+
+def test_a_failed_or_timed_out_call_only_fails_itself():
+    node = create_tool_node([slow, fail], timeout=0.1)
+    messages = call_tools(node, ("slow", {"seconds": 0.5}), ("fail", {}), ("missing", {}), ("slow", {"seconds": 0}))
+    assert [m.status for m in messages] == ["error", "error", "error", "success"]
+    assert json.loads(messages[0].content) == "slow timed out after 0.1 seconds"
+    assert "bad input" in json.loads(messages[1].content)
+    assert json.loads(messages[2].content) == "Unknown tool missing"
@@ -0,0 +1,48 @@
+import chromadb
+import pytest
+from vanna.utils import deterministic_uuid
+
+from train import sync_collection
+
+
+class FakeVanna:
+    def __init__(self):
+        self.embedded = []
+
+    def embedding_function(self, documents):
+        self.embedded.extend(documents)
+        return [[float(len(document)), 1.0] for document in documents]
+
+
+@pytest.fixture
+def collection(request):
+    client = chromadb.EphemeralClient()
+    return client.get_or_create_collection(request.node.name, embedding_function=None)
+
+
+def test_sync_collection_embeds_only_new_documents(collection):
+    vn = FakeVanna()
+    assert sync_collection(vn, collection, ["CREATE TABLE a(x)", "CREATE TABLE b(x)"], "-ddl") == {
+        "added": 2, "removed": 0, "unchanged": 0,
+    }
+    assert sync_collection(vn, collection, ["CREATE TABLE a(x)", "CREATE TABLE b(x)"], "-ddl") == {
+        "added": 0, "removed": 0, "unchanged": 2,
+    }
+    assert len(vn.embedded) == 2
+
+
+def test_sync_collection_keeps_training_data_added_by_hand(collection):
+    collection.add(ids=["hand-ddl"], documents=["CREATE TABLE hand(x)"], embeddings=[[1.0, 2.0]])
+    sync_collection(FakeVanna(), collection, ["CREATE TABLE a(x)", "CREATE TABLE b(x)"], "-ddl")
+    assert sync_collection(FakeVanna(), collection, ["CREATE TABLE a(x)"], "-ddl")["removed"] == 1
+    assert sorted(collection.get()["ids"]) == sorted(["hand-ddl", deterministic_uuid("CREATE TABLE a(x)") + "-ddl"])
+
+
+def test_sync_collection_adopts_identical_untagged_entries(collection):
+    document = "CREATE TABLE a(x)"
+    collection.add(ids=[deterministic_uuid(document) + "-ddl"], documents=[document], embeddings=[[1.0, 2.0]])
+    vn = FakeVanna()
+    assert sync_collection(vn, collection, [document], "-ddl")["unchanged"] == 1
+    assert vn.embedded == []
+    # written by the script from now on, removed once it is no longer wanted
+    assert sync_collection(vn, collection, [], "-ddl")["removed"] == 1
@@ -1,29 +1,85 @@
 import os
-import pandas as pd
+import time
+
+from vanna.utils import deterministic_uuid
 
 from agents.data_analyst import DataAnalystVanna
+from agents.db import get_database_name
+
+BATCH_SIZE = int(os.getenv("TRAIN_BATCH_SIZE", "64"))
+# metadata of the entries written here, training data added with vn.train or the vanna ui is never removed
+TRAINED_BY = {"source": "train.py"}
+
+
+def date_column_documentation(vn) -> list[str]:
+    """Describe the date columns normalized by ingest_data.py and the generated period columns derived from them"""
+    documentation = []
+    tables = vn.run_sql("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE '\\_%' ESCAPE '\\'")
+    for table in tables["name"].to_list():
+        columns = vn.run_sql(f"PRAGMA table_xinfo('{table}')")
+        # hidden 2 and 3 are virtual and stored generated columns
+        generated = set(columns.loc[columns["hidden"].isin([2, 3]), "name"])
+        for col in columns["name"]:
+            if f"{col}_fiscal_year" not in generated:
+                continue
+            documentation.append(
+                f"The {col} of {table} is stored as ISO yyyy-MM-dd text, compare it with date literals such as "
+                f"'2022-04-01' instead of using substr. {table} has indexed generated columns {col}_year, "
+                f"{col}_month, {col}_quarter (calendar quarter 1-4) and {col}_fiscal_year (the calendar year in "
+                f"which the april to march financial year starts), use them to filter or group by period."
+            )
+    return documentation
+
+
+def sync_collection(vn, collection, documents: list[str], suffix: str) -> dict:
+    """Make the entries this script wrote to the collection exactly the documents, embedding and upserting only
+    those it does not have yet.
+
+    Ids are the content hashes vanna itself uses (`deterministic_uuid(content) + suffix`), so unchanged documents
+    are skipped. The entries are tagged with TRAINED_BY, only tagged entries that are no longer wanted, e.g. the
+    DDL of a dropped table, are deleted.
+    """
+    wanted = {deterministic_uuid(document) + suffix: document for document in documents}
+    entries = collection.get(include=["metadatas"])
+    existing = set(entries["ids"])
+    trained = {id for id, metadata in zip(entries["ids"], entries["metadatas"]) if metadata == TRAINED_BY}
+    missing = [(id, document) for id, document in wanted.items() if id not in existing]
+    # the same document trained by hand or by an earlier version of this script, tagged without embedding it again
+    adopted = sorted(id for id in wanted.keys() & existing if id not in trained)
+    stale = sorted(trained - wanted.keys())
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        ids, batch = zip(*missing[i:i + BATCH_SIZE])
+        collection.upsert(ids=list(ids), documents=list(batch), embeddings=vn.embedding_function(list(batch)),
+                          metadatas=[TRAINED_BY] * len(ids))
+    if adopted:
+        collection.update(ids=adopted, metadatas=[TRAINED_BY] * len(adopted))
+    if stale:
+        collection.delete(ids=stale)
+    return {"added": len(missing), "removed": len(stale), "unchanged": len(wanted) - len(missing)}
 
 
 def train(vn):
-    df_ddl = vn.run_sql("SELECT type, sql FROM sqlite_master WHERE sql is not null")
-    for ddl in df_ddl["sql"].to_list():
-        vn.train(ddl=ddl)
+    """Bring the DDL and documentation collections in line with the database, only changed items are embedded"""
+    start = time.perf_counter()
+    # tables prefixed with an underscore are internal bookkeeping, e.g. the ingestion manifest
+    df_ddl = vn.run_sql("SELECT type, sql FROM sqlite_master WHERE sql is not null AND name NOT LIKE '\\_%' ESCAPE '\\'")
+    ddl = sync_collection(vn, vn.ddl_collection, df_ddl["sql"].to_list(), "-ddl")
 
     # Sometimes you may want to add documentation about your business terminology or definitions.
-    vn.train(
-        documentation="Our business defines financial year start with april to mar of each year")
-    vn.train(
-        documentation="The invoice_date of sales_data is in dd-MM-yyyy format")
-    vn.train(
-        documentation="Today's date is 2022-01-01")
-    # At any time you can inspect what training data the package is able to reference
-    training_data = vn.get_training_data()
-    with pd.option_context("display.max_rows", None, "display.max_columns", None):
-        print("training_data: \n", training_data)
-    print("Training is completed.")
+    documentation = [
+        "Our business defines financial year start with april to mar of each year",
+        *date_column_documentation(vn),
+        "Today's date is 2022-01-01",
+    ]
+    docs = sync_collection(vn, vn.documentation_collection, documentation, "-doc")
+
+    for name, counts in (("ddl", ddl), ("documentation", docs)):
+        print(f"{name}: {counts['added']} added, {counts['removed']} removed, {counts['unchanged']} unchanged")
+    print(f"Training is completed in {time.perf_counter() - start:.1f}s.")
 
 
 if __name__ == "__main__":
     vn = DataAnalystVanna(config={"model": os.getenv("MODEL_NAME"), "client": "persistent", "path": "./vanna-db"})
-    vn.connect_to_sqlite(f"{os.getenv("SQLITE_DATABASE_NAME", "data/sales-and-customer-database.db")}")
+    vn.connect_to_sqlite(get_database_name())
     train(vn=vn)